@@ -1,5 +1,5 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, BackgroundTasks, Request, Depends
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import os
 import numpy as np
@@ -7,15 +7,38 @@ import open3d as o3d
 import tempfile
 import argparse
 import uuid
+import json
 import base64
+import gzip
+import zlib
+import hashlib
 import uvicorn
 import torch
-import gc
 import shutil
+import time
 from typing import Optional, List
-from pydantic import BaseModel
-from pipeline import Process_point_cloud, Inference, Restore_point_cloud
-from io import BytesIO
+from pydantic import BaseModel, PrivateAttr
+from pipeline import Inference, Restore_point_cloud
+from custom.down_sample import normalize_point_cloud, sample_point_cloud, remove_outliers
+from custom.binary_io import parse_point_cloud, encode_points, ENCODINGS
+from custom.tiling import Tiled_inference
+from custom.clustering import Objects_inference
+from custom.inference import load_inference_model, model_metadata, load_query_calibration, PRECISIONS
+from custom.inference import resolve_num_query, Inference_batch, set_inference_pool, set_inference_scheduler
+from custom.inference import forward_batch, set_profile_capture, set_memory_manager
+from custom.cache import ResultCache, file_digest, model_digest, params_digest
+from custom.pose_cache import PoseCache
+from custom.single_flight import SingleFlight
+from custom.timing import StageTimer, server_timing
+from custom.manifest import FolderManifest
+from custom.worker_pool import WorkerPool, parse_replicas
+from custom.shm_ring import ShmPreprocessor
+from custom.admission import AdmissionController, AdmissionRejected
+from custom.scheduler import InferenceScheduler, DeadlineExceeded, PRIORITIES, deadline_after, check_deadline
+from custom.metrics import REGISTRY, Gauge, SAMPLING_SECONDS, FILES, POINTS_IN, POINTS_OUT, CACHE_HITS, ERRORS
+from custom.metrics import process_rss_bytes
+from custom.profiling import ProfileCapture
+from custom.memory import MemoryManager, MEMORY_POLICIES
 
 app = FastAPI()
 
@@ -28,20 +51,36 @@ app.add_middleware(
     allow_headers=["*"],  # 允许所有头
 )
 
-# Global variable to store normalization parameters
-normal_record_map = {}
+# 合并相同输入和参数的并发请求
+single_flight = SingleFlight()
 
 # Parse command line arguments
 def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         '--model_config',
-        required=True,
-        help='yaml config file')
+        help='yaml config file (pytorch backend)')
     parser.add_argument(
         '--model_checkpoint',
-        required=True,
-        help='pretrained weight')
+        help='pretrained weight (pytorch backend)')
+    parser.add_argument(
+        '--backend',
+        choices=['pytorch', 'torchscript', 'onnx'],
+        default='pytorch',
+        help='pytorch: build the model from yaml + checkpoint; torchscript/onnx: load an artifact from tools/export.py')
+    parser.add_argument(
+        '--model_artifact',
+        help='exported model file for the torchscript/onnx backend')
+    parser.add_argument(
+        '--ort_threads',
+        type=int,
+        default=0,
+        help='onnxruntime intra-op threads, 0 lets onnxruntime decide')
+    parser.add_argument(
+        '--ort_opt_level',
+        choices=['disable', 'basic', 'extended', 'all'],
+        default='all',
+        help='onnxruntime graph optimization level')
     parser.add_argument(
         '--device', 
         default='cuda:0', 
@@ -60,6 +99,165 @@ def get_args():
         type=float,
         default=0.7,
         help='Maximum GPU memory fraction to use (0.0-1.0)')
+    parser.add_argument(
+        '--optimize',
+        action='store_true',
+        help='Fold BatchNorm, precompute constants and drop Dropout/DropPath at load time')
+    parser.add_argument(
+        '--quantize',
+        choices=['dynamic-int8'],
+        default=None,
+        help='Dynamically quantize nn.Linear layers to int8 (pytorch backend, cpu only)')
+    parser.add_argument(
+        '--precision',
+        choices=['fp32', 'bf16', 'fp16'],
+        default='fp32',
+        help='Default inference precision, bf16/fp16 run the forward pass under autocast (pytorch backend)')
+    parser.add_argument(
+        '--stop_at',
+        type=str,
+        default=None,
+        help='Default decoder stage to stop at, e.g. coarse for AdaPoinTr/PoinTr, pc/p1/p2 for SnowFlakeNet (pytorch backend)')
+    parser.add_argument(
+        '--num_query',
+        type=int,
+        default=None,
+        help='Default number of AdaPoinTr queries, fewer queries are faster and give num_query * factor points')
+    parser.add_argument(
+        '--latency_budget_ms',
+        type=float,
+        default=None,
+        help='Default latency budget, picks the AdaPoinTr query count from --query_calibration')
+    parser.add_argument(
+        '--query_calibration',
+        type=str,
+        default=None,
+        help='Query count / latency table written by tools/calibrate_queries.py')
+    parser.add_argument(
+        '--max_batch_size',
+        type=int,
+        default=None,
+        help='Maximum point clouds per forward pass when several are batched; tiles and objects are submitted '
+             'as separate jobs of this many clouds (default 8)')
+    parser.add_argument(
+        '--cache_dir',
+        type=str,
+        default=None,
+        help='Directory of the result cache keyed by input bytes and parameters, disabled when not set')
+    parser.add_argument(
+        '--cache_max_mb',
+        type=float,
+        default=1024,
+        help='Size limit of the on-disk result cache, least recently used results are evicted')
+    parser.add_argument(
+        '--cache_memory_mb',
+        type=float,
+        default=64,
+        help='Size of the in-memory hot tier of the result cache')
+    parser.add_argument(
+        '--pose_cache',
+        action='store_true',
+        help='Reuse completions of rigidly transformed copies of already completed shapes (single mode)')
+    parser.add_argument(
+        '--pose_cache_entries',
+        type=int,
+        default=1024,
+        help='Maximum number of shapes kept by the pose cache')
+    parser.add_argument(
+        '--pose_descriptor_tol',
+        type=float,
+        default=0.05,
+        help='Maximum shape descriptor distance of a pose cache candidate')
+    parser.add_argument(
+        '--pose_chamfer_tol',
+        type=float,
+        default=0.02,
+        help='Maximum Chamfer distance (canonical frame, unit RMS radius) to accept a pose cache candidate')
+    parser.add_argument(
+        '--replicas',
+        type=str,
+        default=None,
+        help='Run inference in a pool of replica processes, e.g. "cuda:0,cuda:1" or "cpu:0-3,cpu:4-7" (CPU core sets)')
+    parser.add_argument(
+        '--replica_timeout',
+        type=float,
+        default=300,
+        help='Fail a batch handed to a replica process if no result comes back within this many seconds')
+    parser.add_argument(
+        '--prefork',
+        action='store_true',
+        help='Load and optimize the model once, move it to shared memory and fork the CPU replicas from --replicas')
+    parser.add_argument(
+        '--preprocess_workers',
+        type=int,
+        default=0,
+        help='Read and preprocess files in this many processes, handing clouds to inference through shared memory')
+    parser.add_argument(
+        '--preprocess_slots',
+        type=int,
+        default=None,
+        help='Number of shared memory slots (clouds in flight), defaults to two per preprocessing worker')
+    parser.add_argument(
+        '--preprocess_max_points',
+        type=int,
+        default=16384,
+        help='Capacity of a shared memory slot, requests with a larger target_points are preprocessed in-process')
+    parser.add_argument(
+        '--max_in_flight',
+        type=int,
+        default=0,
+        help='Maximum point clouds processed at the same time, further requests get 503/429 (0 means unlimited)')
+    parser.add_argument(
+        '--max_queued_points',
+        type=int,
+        default=0,
+        help='Maximum total input points of the admitted point clouds (0 means unlimited)')
+    parser.add_argument(
+        '--max_file_mb',
+        type=float,
+        default=0,
+        help='Reject input files or request bodies larger than this with 413 (0 means unlimited)')
+    parser.add_argument(
+        '--bulk_share',
+        type=float,
+        default=0.5,
+        help='Share of the in-flight and point limits available to folder/batch jobs, the rest is kept for single requests')
+    parser.add_argument(
+        '--scheduler',
+        action='store_true',
+        help='Queue forward passes by priority and deadline and batch requests with the same inference parameters')
+    parser.add_argument(
+        '--scheduler_batch_size',
+        type=int,
+        default=8,
+        help='Maximum point clouds the scheduler puts into one forward pass')
+    parser.add_argument(
+        '--scheduler_timeout',
+        type=float,
+        default=600,
+        help='Fail a forward pass that has not finished this many seconds after entering the scheduler queue')
+    parser.add_argument(
+        '--profile_dir',
+        type=str,
+        default='profiles',
+        help='Directory for the traces and summaries captured through POST /admin/profile')
+    parser.add_argument(
+        '--memory_policy',
+        choices=MEMORY_POLICIES,
+        default='adaptive',
+        help='adaptive releases the CUDA cache only below --memory_watermark or after an OOM, '
+             'always runs empty_cache + gc.collect after every request (the old behaviour, to measure its cost)')
+    parser.add_argument(
+        '--memory_watermark',
+        type=float,
+        default=0.1,
+        help='Release the CUDA cache when the free device memory drops below this fraction')
+    parser.add_argument(
+        '--memory_sample_every',
+        type=int,
+        default=50,
+        help='With the adaptive policy, release once every this many requests that skipped the release, '
+             'to measure its cost (0 disables sampling)')
     args = parser.parse_args()
     return args
 
@@ -70,18 +268,103 @@ class FolderProcessRequest(BaseModel):
     sampling_method: str = 'fps'
     file_extension: str = '.ply'
     skip_files: List[str] = []  # 新增参数：不需要补全直接复制的文件名列表（不含扩展名）
+    overwrite: bool = False  # 忽略输出文件夹中的处理清单, 重新处理所有文件
+    precision: Optional[str] = None  # 推理精度 fp32/bf16/fp16, 默认使用启动参数 --precision
+    stop_at: Optional[str] = None  # 提前结束的解码阶段(如 coarse), 默认使用启动参数 --stop_at
+    num_query: Optional[int] = None  # AdaPoinTr 查询数, 默认使用启动参数 --num_query
+    latency_budget_ms: Optional[float] = None  # 延迟预算, 按标定表选择 AdaPoinTr 查询数
+    mode: str = 'single'  # 'single' 整体补全, 'tiled' 分块补全场景级点云
+    tile_method: str = 'grid'  # 分块方法 'grid' 或 'dbscan'
+    tile_size: float = 0.25  # 分块边长(归一化坐标)
+    tile_overlap: float = 0.25  # 相邻分块重叠比例
+    cluster_eps: float = 0.05  # dbscan 分块的邻域半径(归一化坐标)
+    merge_voxel_size: float = 0.002  # 合并分块输出时去重的体素大小(归一化坐标)
+    cluster_voxel_size: float = 0.02  # objects 模式体素连通域聚类的体素大小(归一化坐标)
+    min_cluster_points: int = 64  # objects 模式点数少于该值的聚类视为噪声
+    seed: int = 0  # 采样随机种子, 相同输入和参数得到相同结果(可被结果缓存命中)
+    priority: Optional[str] = None  # 调度优先级 interactive/bulk, 默认 bulk
+    deadline_ms: Optional[float] = None  # 截止时间(从收到请求起的毫秒数), 超时未开始推理的点云被取消
+    _received: float = PrivateAttr(default_factory=time.monotonic)
 
 class FileProcessRequest(BaseModel):
     input_file: str
     output_file: str
     target_points: int = 4096  # 降低默认点数
     sampling_method: str = 'fps'
+    precision: Optional[str] = None  # 推理精度 fp32/bf16/fp16, 默认使用启动参数 --precision
+    stop_at: Optional[str] = None  # 提前结束的解码阶段(如 coarse), 默认使用启动参数 --stop_at
+    num_query: Optional[int] = None  # AdaPoinTr 查询数, 默认使用启动参数 --num_query
+    latency_budget_ms: Optional[float] = None  # 延迟预算, 按标定表选择 AdaPoinTr 查询数
+    mode: str = 'single'  # 'single' 整体补全, 'tiled' 分块补全场景级点云
+    tile_method: str = 'grid'  # 分块方法 'grid' 或 'dbscan'
+    tile_size: float = 0.25  # 分块边长(归一化坐标)
+    tile_overlap: float = 0.25  # 相邻分块重叠比例
+    cluster_eps: float = 0.05  # dbscan 分块的邻域半径(归一化坐标)
+    merge_voxel_size: float = 0.002  # 合并分块输出时去重的体素大小(归一化坐标)
+    cluster_voxel_size: float = 0.02  # objects 模式体素连通域聚类的体素大小(归一化坐标)
+    min_cluster_points: int = 64  # objects 模式点数少于该值的聚类视为噪声
+    seed: int = 0  # 采样随机种子, 相同输入和参数得到相同结果(可被结果缓存命中)
+    priority: Optional[str] = None  # 调度优先级 interactive/bulk, 默认 interactive
+    deadline_ms: Optional[float] = None  # 截止时间(从收到请求起的毫秒数), 超时未开始推理的点云被取消
+    _received: float = PrivateAttr(default_factory=time.monotonic)
 
-def clear_gpu_memory():
-    """清理GPU内存"""
-    if torch.cuda.is_available():
-        torch.cuda.empty_cache()
-        gc.collect()
+class BinaryProcessRequest(BaseModel):
+    # /complete_binary 的请求体是点云本身, 参数通过查询字符串传递
+    target_points: int = 4096
+    sampling_method: str = 'fps'
+    precision: Optional[str] = None  # 推理精度 fp32/bf16/fp16, 默认使用启动参数 --precision
+    stop_at: Optional[str] = None  # 提前结束的解码阶段(如 coarse), 默认使用启动参数 --stop_at
+    num_query: Optional[int] = None  # AdaPoinTr 查询数, 默认使用启动参数 --num_query
+    latency_budget_ms: Optional[float] = None  # 延迟预算, 按标定表选择 AdaPoinTr 查询数
+    mode: str = 'single'  # 'single' 整体补全, 'tiled' 分块补全场景级点云
+    tile_method: str = 'grid'  # 分块方法 'grid' 或 'dbscan'
+    tile_size: float = 0.25  # 分块边长(归一化坐标)
+    tile_overlap: float = 0.25  # 相邻分块重叠比例
+    cluster_eps: float = 0.05  # dbscan 分块的邻域半径(归一化坐标)
+    merge_voxel_size: float = 0.002  # 合并分块输出时去重的体素大小(归一化坐标)
+    cluster_voxel_size: float = 0.02  # objects 模式体素连通域聚类的体素大小(归一化坐标)
+    min_cluster_points: int = 64  # objects 模式点数少于该值的聚类视为噪声
+    seed: int = 0  # 采样随机种子, 相同输入和参数得到相同结果(可被结果缓存命中)
+    encoding: str = 'float32'  # 响应坐标编码 float32/float16/int16
+    compression: Optional[str] = None  # 响应压缩 gzip/deflate
+    priority: Optional[str] = None  # 调度优先级 interactive/bulk, 默认 interactive
+    deadline_ms: Optional[float] = None  # 截止时间(从收到请求起的毫秒数), 超时未开始推理的点云被取消
+    _received: float = PrivateAttr(default_factory=time.monotonic)
+
+class BatchItem(BaseModel):
+    input_file: Optional[str] = None  # 服务器上的点云文件路径
+    data: Optional[str] = None  # 或 base64 编码的点云字节(小端 float32 的 N x 3 坐标, 或 PLY 文件)
+    output_file: Optional[str] = None  # 不指定时结果以 base64 随记录返回
+    # 以下参数不指定时使用 BatchProcessRequest 中的值
+    target_points: Optional[int] = None
+    sampling_method: Optional[str] = None
+    seed: Optional[int] = None
+    precision: Optional[str] = None
+    stop_at: Optional[str] = None
+    num_query: Optional[int] = None
+
+class BatchProcessRequest(BaseModel):
+    items: List[BatchItem]
+    target_points: int = 4096
+    sampling_method: str = 'fps'
+    precision: Optional[str] = None  # 推理精度 fp32/bf16/fp16, 默认使用启动参数 --precision
+    stop_at: Optional[str] = None  # 提前结束的解码阶段(如 coarse), 默认使用启动参数 --stop_at
+    num_query: Optional[int] = None  # AdaPoinTr 查询数, 默认使用启动参数 --num_query
+    latency_budget_ms: Optional[float] = None  # 延迟预算, 按标定表选择 AdaPoinTr 查询数
+    seed: int = 0  # 采样随机种子
+    encoding: str = 'float32'  # 没有 output_file 的条目返回坐标的编码 float32/float16/int16
+    priority: Optional[str] = None  # 调度优先级 interactive/bulk, 默认 bulk
+    deadline_ms: Optional[float] = None  # 截止时间(从收到请求起的毫秒数), 超时未开始推理的点云被取消
+    _received: float = PrivateAttr(default_factory=time.monotonic)
+
+class ProfileRequest(BaseModel):
+    num_requests: int = 1  # 录制接下来多少次模型前向
+    output_dir: Optional[str] = None  # 输出目录, 默认 --profile_dir 下按时间命名的子目录
+    row_limit: int = 15  # 汇总表中每个子模块列出的算子数
+
+def release_memory():
+    """请求结束后调用, 由内存管理器按水位决定是否释放缓存, 不再每次都 empty_cache + gc.collect"""
+    app.state.memory.after_request()
 
 def get_gpu_info() -> dict:
     """获取所有GPU的内存信息"""
@@ -171,11 +454,453 @@ def available_devices():
         "current": app.state.device
     }
 
-@app.post('/complete_folder')
-async def complete_folder(request: FolderProcessRequest):
+def validate_precision(precision):
+    """检查请求的推理精度, 非 pytorch 后端只支持fp32"""
+    if precision is None:
+        return
+    if precision not in PRECISIONS:
+        raise HTTPException(status_code=400, detail=f"Unsupported precision '{precision}', choose from {list(PRECISIONS)}")
+    if precision != 'fp32' and app.state.args.backend != 'pytorch':
+        raise HTTPException(status_code=400, detail=f"Precision '{precision}' requires the pytorch backend")
+
+def current_model_info():
+    """当前模型的信息; 使用推理池时取副本启动时发回的信息, 前端进程不加载模型"""
+    if app.state.pool is not None:
+        return app.state.pool.model_info
+    model, _ = load_inference_model(app.state.args)
+    return model_metadata(model)
+
+def validate_stop_at(stop_at):
+    """检查请求的 stop_at 是否是当前模型的解码阶段"""
+    if stop_at is None:
+        return
+    stages = current_model_info()['stages']
+    if stop_at not in stages:
+        raise HTTPException(status_code=400, detail=f"Unsupported stop_at '{stop_at}', the model supports {stages}")
+
+def validate_num_query(num_query, latency_budget_ms):
+    """检查请求的查询数或延迟预算"""
+    if num_query is None and latency_budget_ms is None:
+        return
+    limits = current_model_info()['query_range']
+    if limits is None:
+        raise HTTPException(status_code=400, detail="The model does not support num_query / latency_budget_ms")
+    if num_query is not None and not limits[0] <= num_query <= limits[1]:
+        raise HTTPException(status_code=400, detail=f"num_query should be in [{limits[0]}, {limits[1]}]")
+    if num_query is None and not app.state.args.query_calibration:
+        raise HTTPException(status_code=400, detail="latency_budget_ms requires the server to run with --query_calibration")
+
+@app.get('/model_info')
+def model_info():
+    """当前模型的后端和可以提前结束的解码阶段"""
+    return {"backend": app.state.args.backend, **current_model_info()}
+
+MODES = ['single', 'tiled', 'objects']
+
+def validate_mode(request):
+    """检查补全模式及分块参数"""
+    if request.mode not in MODES:
+        raise HTTPException(status_code=400, detail=f"Unsupported mode '{request.mode}', choose from {MODES}")
+    if request.mode == 'tiled':
+        if request.tile_method not in ['grid', 'dbscan']:
+            raise HTTPException(status_code=400, detail=f"Unsupported tile_method '{request.tile_method}'")
+        if request.tile_size <= 0 or not 0 <= request.tile_overlap < 1 or request.merge_voxel_size <= 0:
+            raise HTTPException(status_code=400, detail="tile_size and merge_voxel_size should be positive, tile_overlap in [0, 1)")
+    if request.mode == 'objects' and request.cluster_voxel_size <= 0:
+        raise HTTPException(status_code=400, detail="cluster_voxel_size should be positive")
+
+def validate_schedule(request):
+    """检查调度优先级和截止时间"""
+    if request.priority is not None and request.priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"Unsupported priority '{request.priority}', choose from {list(PRIORITIES)}")
+    if request.deadline_ms is not None and request.deadline_ms <= 0:
+        raise HTTPException(status_code=400, detail="deadline_ms should be positive")
+
+def validate_request(request):
+    validate_precision(request.precision)
+    validate_stop_at(request.stop_at)
+    validate_num_query(request.num_query, request.latency_budget_ms)
+    validate_mode(request)
+    validate_schedule(request)
+
+# 不影响补全结果的请求字段, 不参与缓存键
+_UNCACHED_FIELDS = ['input_file', 'output_file', 'input_folder', 'output_folder', 'file_extension', 'skip_files',
+                    'latency_budget_ms', 'encoding', 'compression', 'overwrite', 'priority', 'deadline_ms']
+
+def request_deadline(request):
+    """请求的绝对截止时间(time.monotonic()), 从服务器收到请求时算起"""
+    return deadline_after(request.deadline_ms, request._received)
+
+def inference_options(request):
+    """传给 Inference/Inference_batch 的推理和调度参数, 文件夹请求默认 bulk 优先级, 其余默认 interactive"""
+    default_priority = 'bulk' if isinstance(request, FolderProcessRequest) else 'interactive'
+    return dict(precision=request.precision, stop_at=request.stop_at, num_query=request.num_query,
+                latency_budget_ms=request.latency_budget_ms, seed=request.seed,
+                priority=request.priority or default_priority, deadline=request_deadline(request))
+
+def schedule_key(request):
+    """合并请求时还要求调度参数相同, 否则后到的请求会继承第一个请求的优先级和截止时间
+    (如没有截止时间的请求因第一个请求超时而返回 504). 结果缓存的键不含调度参数"""
+    options = inference_options(request)
+    return options['priority'], options['deadline']
+
+def effective_params(request, output_format='.ply'):
+    """影响补全结果的请求参数, 启动参数的默认值已填入, 并附带模型摘要"""
+    args = app.state.args
+    params = {k: v for k, v in request.dict().items() if k not in _UNCACHED_FIELDS}
+    params.update({
+        'precision': request.precision or args.precision,
+        'stop_at': request.stop_at or args.stop_at,
+        'num_query': resolve_num_query(args, request.num_query, request.latency_budget_ms),
+        'backend': args.backend,
+        'optimize': args.optimize,
+        'quantize': args.quantize,
+        'model': model_digest(args),
+        'output_format': output_format.lower(),
+    })
+    return params
+
+@app.get('/cache_stats')
+def cache_stats():
+    """结果缓存的命中/未命中统计, 启用姿态缓存时附带其命中率和节省的推理时间"""
+    stats = {"enabled": app.state.cache is not None}
+    if app.state.cache is not None:
+        stats.update(app.state.cache.stats())
+    if app.state.pose_cache is not None:
+        stats["pose"] = app.state.pose_cache.stats()
+    return stats
+
+def pose_cached_inference(pcd, request, options):
+    """启用姿态缓存时先查找同一形状在其他姿态下的补全结果, 未命中再推理并保存"""
+    pose_cache = app.state.pose_cache
+    if pose_cache is None:
+        return Inference(pcd, app.state.args, **options)
+    pose_key = params_digest(effective_params(request))
+    points = pcd if isinstance(pcd, np.ndarray) else np.asarray(pcd.points)
+    pcd_out, token = pose_cache.lookup(pose_key, points)
+    if pcd_out is None:
+        start = time.perf_counter()
+        pcd_out = Inference(pcd, app.state.args, **options)
+        pose_cache.put(pose_key, token, pcd_out, (time.perf_counter() - start) * 1000)
+    else:
+        CACHE_HITS.inc(cache='pose')
+    return pcd_out
+
+def normalize_points(points, timer=None):
+    """归一化原始坐标的点云
+
+    Returns:
+        tuple or None: (normalized_points, center, scale_factor), 空点云或无法归一化时返回 None
     """
-    Process all point cloud files in a folder and save results to output folder
+    if len(points) == 0:
+        print("警告: 空点云，跳过处理")
+        return None
+    with (timer or StageTimer()).stage('normalize'):
+        normalized = normalize_point_cloud(np.asarray(points, dtype=np.float64))
+    if normalized is None:
+        print("警告: 点云是平面或线性的，无法正常归一化")
+    return normalized
+
+def restore_points(pcd_out, center, scale_factor, timer=None):
+    """把模型输出还原到原始坐标系并去除离群点"""
+    timer = timer or StageTimer()
+    # Restore the point cloud
+    with timer.stage('restore'):
+        restored_pcd = Restore_point_cloud(pcd_out, center, scale_factor)
+
+    # Remove statistical outliers
+    with timer.stage('postfilter'):
+        cl, ind = restored_pcd.remove_statistical_outlier(nb_neighbors=20, std_ratio=2)
+        result_pcd = restored_pcd.select_by_index(ind)
+    POINTS_OUT.inc(len(result_pcd.points))
+    return result_pcd
+
+def complete_points(points, request, timer=None):
+    """补全内存中的点云: 归一化、采样 -> 推理 -> 反归一化 -> 去除离群点
+
+    Args:
+        points (np.ndarray): 原始坐标的点云 shape=(N, 3)
+        timer (StageTimer, optional): 记录各阶段耗时
+
+    Returns:
+        o3d.geometry.PointCloud or None: 补全结果, 空点云或无法归一化时返回 None
+    """
+    timer = timer or StageTimer()
+    POINTS_IN.inc(len(points))
+    normalized = normalize_points(points, timer)
+    if normalized is None:
+        return None
+    normalized_points, center, scale_factor = normalized
+
+    options = inference_options(request)
+    if request.mode == 'objects':
+        # 分块/多物体模式直接在完整分辨率的归一化点云上切分, 每个分块或物体单独采样, 计入 inference 阶段
+        with timer.stage('inference'):
+            pcd_out = Objects_inference(
+                normalized_points, app.state.args,
+                voxel_size=request.cluster_voxel_size,
+                min_points=request.min_cluster_points,
+                target_points=request.target_points,
+                sampling_method=request.sampling_method,
+                **options)
+    elif request.mode == 'tiled':
+        with timer.stage('inference'):
+            pcd_out = Tiled_inference(
+                normalized_points, app.state.args,
+                tile_method=request.tile_method,
+                tile_size=request.tile_size,
+                tile_overlap=request.tile_overlap,
+                cluster_eps=request.cluster_eps,
+                merge_voxel_size=request.merge_voxel_size,
+                target_points=request.target_points,
+                sampling_method=request.sampling_method,
+                **options)
+    else:
+        # 采样并去除离群点, 与 Process_point_cloud 相同
+        with timer.stage('sample'), SAMPLING_SECONDS.time(method=request.sampling_method):
+            sampled_points = sample_point_cloud(normalized_points, request.target_points, request.sampling_method,
+                                                request.seed)
+        with timer.stage('prefilter'):
+            pcd_filtered = remove_outliers(sampled_points)
+
+        # Run inference
+        with timer.stage('inference'):
+            pcd_out = pose_cached_inference(pcd_filtered, request, options)
+
+    return restore_points(pcd_out, center, scale_factor, timer)
+
+def complete_file_shm(input_path, request, timer):
+    """读取和预处理(归一化、采样、去除离群点)在预处理进程中完成, 推理直接读取共享内存槽位中的点云
+
+    Returns:
+        o3d.geometry.PointCloud or None: 补全结果, 空点云或无法归一化时返回 None
+    """
+    preprocessor = app.state.preprocessor
+    options = inference_options(request)
+    with timer.stage('preprocess'):
+        slot, future = preprocessor.submit(input_path, request.target_points, request.sampling_method, request.seed)
+    try:
+        with timer.stage('preprocess'):
+            try:
+                future.result()
+            except ValueError as e:
+                print(f"警告: {e}")
+                return None
+        points, center, scale_factor = preprocessor.ring.read(slot)
+        POINTS_IN.inc(preprocessor.ring.source_points(slot))
+        with timer.stage('inference'):
+            pcd_out = pose_cached_inference(points, request, options)
+    finally:
+        preprocessor.release(slot)
+    return restore_points(pcd_out, center, scale_factor, timer)
+
+def cache_put(cache, key, data, ext):
+    """写入结果缓存; 写入失败(磁盘满、缓存目录被删除等)只打印警告, 不影响已经完成的请求"""
+    try:
+        cache.put(key, data, ext)
+    except OSError as e:
+        print(f"警告: 写入结果缓存失败: {e}")
+
+def complete_one(input_path, output_path, request):
+    """单个文件的完整处理流程: 读取 -> complete_points -> 保存
+
+    启用结果缓存时, 命中的请求直接写出缓存的结果, 不经过模型.
+
+    Returns:
+        dict or None: 成功时返回 {"cached": 是否命中缓存, "timings": 各阶段耗时(毫秒)},
+            点云读取或归一化失败时返回 None
     """
+    timer = StageTimer()
+    cache = app.state.cache
+    output_format = os.path.splitext(output_path)[1]
+    key = None
+    if cache is not None:
+        with timer.stage('cache'):
+            key = ResultCache.key(file_digest(input_path), effective_params(request, output_format))
+            data = cache.get(key)
+        if data is not None:
+            with timer.stage('write'):
+                with open(output_path, 'wb') as f:
+                    f.write(data)
+            CACHE_HITS.inc(cache='result')
+            FILES.inc(status='cached')
+            return {"cached": True, "timings": timer.rounded()}
+
+    preprocessor = app.state.preprocessor
+    if preprocessor is not None and request.mode == 'single' and request.target_points <= preprocessor.ring.max_points:
+        result_pcd = complete_file_shm(input_path, request, timer)
+    else:
+        with timer.stage('read'):
+            points = np.asarray(o3d.io.read_point_cloud(input_path).points)
+        result_pcd = complete_points(points, request, timer)
+    if result_pcd is None:
+        FILES.inc(status='failed')
+        return None
+
+    # Save the result
+    with timer.stage('write'):
+        o3d.io.write_point_cloud(output_path, result_pcd)
+    if key is not None:
+        with timer.stage('cache'):
+            with open(output_path, 'rb') as f:
+                cache_put(cache, key, f.read(), output_format)
+    FILES.inc(status='success')
+    return {"cached": False, "timings": timer.rounded()}
+
+async def complete_one_coalesced(input_path, output_path, request):
+    """合并相同的并发请求: 输入路径和生效参数相同的请求只计算一次
+
+    后到的请求等待第一个请求的结果, 输出路径不同时复制它的输出文件.
+
+    Returns:
+        dict or None: 同 complete_one, 额外包含 "coalesced", 合并的请求返回实际计算的请求的耗时
+    """
+    stat = os.stat(input_path)
+    key = (os.path.abspath(input_path), stat.st_mtime, stat.st_size,
+           params_digest(effective_params(request, os.path.splitext(output_path)[1])), schedule_key(request))
+    outcome, coalesced = await single_flight.run(key, complete_one_to, input_path, output_path, request)
+    if not outcome:
+        return outcome
+    if coalesced:
+        CACHE_HITS.inc(cache='coalesced')
+    if coalesced and os.path.abspath(outcome["output_path"]) != os.path.abspath(output_path):
+        shutil.copyfile(outcome["output_path"], output_path)
+    return {"cached": outcome["cached"], "coalesced": coalesced, "timings": outcome["timings"]}
+
+def complete_one_to(input_path, output_path, request):
+    # 结果中带上输出路径, 供合并的请求复制
+    outcome = complete_one(input_path, output_path, request)
+    if outcome:
+        outcome["output_path"] = output_path
+    return outcome
+
+def complete_bytes(digest, points, request):
+    """补全请求体中解析出的点云, 结果以 float32 坐标缓存
+
+    Args:
+        digest (str): 请求体的 sha256
+
+    Returns:
+        tuple: (points, cached, timings), points 为 None 表示空点云或无法归一化
+    """
+    timer = StageTimer()
+    cache = app.state.cache
+    key = None
+    if cache is not None:
+        with timer.stage('cache'):
+            key = ResultCache.key(digest, effective_params(request, '.f32'))
+            data = cache.get(key)
+        if data is not None:
+            CACHE_HITS.inc(cache='result')
+            FILES.inc(status='cached')
+            return np.frombuffer(data, dtype='<f4').reshape(-1, 3), True, timer.rounded()
+
+    result_pcd = complete_points(points, request, timer)
+    if result_pcd is None:
+        FILES.inc(status='failed')
+        return None, False, timer.rounded()
+    result = np.asarray(result_pcd.points, dtype='<f4')
+    if key is not None:
+        with timer.stage('cache'):
+            cache_put(cache, key, result.tobytes(), '.f32')
+    FILES.inc(status='success')
+    return result, False, timer.rounded()
+
+def request_elapsed_ms(request):
+    """从收到请求到现在的毫秒数, 作为 Server-Timing 的 total 项"""
+    return (time.monotonic() - request._received) * 1000
+
+def client_id(raw):
+    """按 X-Client-Id 请求头区分客户端, 没有时使用客户端地址"""
+    return raw.headers.get('x-client-id') or (raw.client.host if raw.client else 'unknown')
+
+def admission_error(e):
+    headers = {'Retry-After': str(e.retry_after)} if e.retry_after is not None else None
+    return HTTPException(status_code=e.status, detail=e.reason, headers=headers)
+
+@app.get('/queue')
+def queue_state():
+    """准入控制状态: 限制、在途点云数和点数、各客户端占用、等待中的文件数、按原因统计的拒绝数"""
+    state = app.state.admission.state()
+    if app.state.scheduler is not None:
+        state["scheduler"] = app.state.scheduler.stats()
+    return state
+
+@app.get('/workers')
+def workers():
+    """多副本推理池中各副本的设备、排队任务数、最近延迟和完成数"""
+    if app.state.pool is None:
+        return {"enabled": False, "replicas": []}
+    return {"enabled": True, **app.state.pool.stats()}
+
+@app.get('/memory')
+def memory_stats():
+    """内存管理: 各batch形状的峰值/预留显存(CPU 上为 RSS)和平均前向耗时, 按原因统计的缓存释放次数和耗时, OOM 拆分次数,
+    以及相比每个请求都释放估计省下的延迟"""
+    return app.state.memory.stats()
+
+@app.get('/coalescing_stats')
+def coalescing_stats():
+    """请求合并统计: 正在计算的请求数, 实际计算的请求数, 被合并的请求数"""
+    return single_flight.stats()
+
+def queue_depth():
+    """各队列当前的深度, 服务启动前没有的队列不报告"""
+    depth = {('coalescing',): single_flight.stats()['in_flight']}
+    admission = getattr(app.state, 'admission', None)
+    if admission is not None:
+        state = admission.state()
+        depth[('in_flight',)] = state['in_flight']
+        depth[('waiting',)] = state['waiting']
+    scheduler = getattr(app.state, 'scheduler', None)
+    if scheduler is not None:
+        queued = scheduler.stats()['queued']
+        for priority in PRIORITIES:
+            depth[(f'scheduler_{priority}',)] = queued.get(priority, 0)
+    return depth
+
+def memory_bytes():
+    memory = {('rss',): process_rss_bytes()}
+    if torch.cuda.is_available():
+        memory[('cuda_allocated',)] = torch.cuda.memory_allocated()
+        memory[('cuda_reserved',)] = torch.cuda.memory_reserved()
+    return memory
+
+REGISTRY.register(Gauge('pointr_queue_depth', 'Current depth of the request queues', ['queue'], collect=queue_depth))
+REGISTRY.register(Gauge('pointr_memory_bytes', 'Process and CUDA memory usage', ['kind'], collect=memory_bytes))
+
+@app.get('/metrics')
+def metrics():
+    """Prometheus 文本格式的指标: 各阶段延迟直方图、按采样方法的采样耗时、文件/点数/缓存命中/错误计数、队列深度和内存"""
+    return Response(content=REGISTRY.render(), media_type='text/plain; version=0.0.4')
+
+@app.post('/admin/profile')
+def start_profile(request: ProfileRequest):
+    """用 torch.profiler 录制接下来 num_requests 次模型前向, 写出 Chrome trace 和按子模块分组的算子汇总"""
+    if app.state.pool is not None:
+        raise HTTPException(status_code=400, detail="使用 --replicas 时模型在副本进程中运行, 无法在服务器进程中录制")
+    if app.state.args.backend == 'onnx':
+        raise HTTPException(status_code=400, detail="onnx 后端不经过 PyTorch, 无法用 torch.profiler 录制")
+    if request.num_requests < 1:
+        raise HTTPException(status_code=400, detail="num_requests should be at least 1")
+    capture = app.state.profile
+    if capture is not None and not capture.done:
+        raise HTTPException(status_code=409, detail=f"正在录制: {capture.captured}/{capture.num_requests}")
+    output_dir = request.output_dir or os.path.join(app.state.args.profile_dir, time.strftime('%Y%m%d-%H%M%S'))
+    app.state.profile = ProfileCapture(output_dir, request.num_requests, request.row_limit)
+    set_profile_capture(app.state.profile)
+    return app.state.profile.status()
+
+@app.get('/admin/profile')
+def profile_status():
+    """最近一次录制的进度和输出文件, 录满后 summary 为汇总表路径"""
+    if app.state.profile is None:
+        return {"active": False}
+    return {"active": not app.state.profile.done, **app.state.profile.status()}
+
+def list_folder_files(request):
+    """检查文件夹请求并返回要处理的文件名列表"""
+    validate_request(request)
     # Validate input folder
     if not os.path.exists(request.input_folder):
         raise HTTPException(status_code=400, detail=f"Input folder '{request.input_folder}' does not exist")
@@ -188,13 +913,15 @@ async def complete_folder(request: FolderProcessRequest):
     
     if not files:
         raise HTTPException(status_code=400, detail=f"No {request.file_extension} files found in the input folder")
-    
-    results = []
-    success_count = 0
-    
+    return files
+
+async def folder_results(request, files, client):
+    """逐个处理文件夹中的文件, 每个文件完成后产生 (结果, 各阶段耗时)
+
+    每个文件处理前按 bulk 类别等待准入配额, 等待时间计入 queue 阶段.
+    """
     # 处理无需补全、直接复制的文件
     skip_files = request.skip_files or []
-    copied_files = 0
     
     for filename_no_ext in skip_files:
         filename = f"{filename_no_ext}{request.file_extension}"
@@ -202,103 +929,181 @@ async def complete_folder(request: FolderProcessRequest):
         output_path = os.path.join(request.output_folder, filename)
         
         if os.path.exists(input_path):
+            timer = StageTimer()
             try:
                 # 直接复制文件
-                shutil.copy2(input_path, output_path)
-                results.append({
+                with timer.stage('copy'):
+                    shutil.copy2(input_path, output_path)
+                yield {
                     "file": filename,
                     "status": "copied",
                     "output_path": output_path
-                })
-                success_count += 1
-                copied_files += 1
+                }, timer.rounded()
             except Exception as e:
-                results.append({
+                yield {
                     "file": filename,
                     "status": "failed",
                     "error": f"复制失败: {str(e)}"
-                })
+                }, timer.rounded()
         else:
-            results.append({
+            yield {
                 "file": filename,
                 "status": "failed",
                 "error": f"文件不存在: {input_path}"
-            })
+            }, {}
     
     # 过滤出需要进行补全处理的文件
     files_to_process = [f for f in files if os.path.splitext(f)[0] not in skip_files]
     
+    # 输出文件夹中的处理清单, 输入和参数都没变且输出完整的文件直接跳过
+    manifest = FolderManifest(request.output_folder)
+    admission = app.state.admission
+    
     # Process each file
     for filename in files_to_process:
         input_path = os.path.join(request.input_folder, filename)
         output_filename = os.path.splitext(filename)[0] + '.ply'
         output_path = os.path.join(request.output_folder, output_filename)
+        # 读取输入出错时清单中的失败记录没有输入摘要
+        input_digest = request_digest = None
         
         try:
-            # Process the point cloud
-            success, center, scale_factor, pcd_filtered = Process_point_cloud(
-                input_path, 
-                request.target_points, 
-                request.sampling_method
-            )
-            
-            if not success:
-                results.append({
+            timer = StageTimer()
+            with timer.stage('manifest'):
+                input_digest = file_digest(input_path)
+                request_digest = params_digest(effective_params(request, '.ply'))
+                done = not request.overwrite and manifest.is_done(filename, input_digest, request_digest, output_path)
+            if done:
+                yield {
+                    "file": filename,
+                    "status": "skipped",
+                    "output_path": output_path
+                }, timer.rounded()
+                continue
+
+            # 超过截止时间后剩余的文件不再读取
+            check_deadline(request_deadline(request), '读取')
+            points = admission.check_file(input_path)
+            with timer.stage('queue'):
+                ticket = await admission.admit_wait(client, points, bulk=True)
+            try:
+                outcome = await complete_one_coalesced(input_path, output_path, request)
+            finally:
+                admission.release(ticket)
+            if not outcome:
+                ERRORS.inc(endpoint='complete_folder')
+                manifest.append(filename, input_digest, request_digest, output_path, "failed",
+                                error="Failed to process point cloud")
+                yield {
                     "file": filename,
                     "status": "failed",
                     "error": "Failed to process point cloud"
-                })
+                }, {}
                 continue
             
-            # Store normalization parameters
-            normal_record_map[output_filename] = (center, scale_factor)
-            
-            # Run inference
-            pcd_out = Inference(pcd_filtered, app.state.args)
-            
-            # Restore the point cloud
-            current_center, current_scale_factor = normal_record_map[output_filename]
-            restored_pcd = Restore_point_cloud(pcd_out, current_center, current_scale_factor)
-            
-            # Remove statistical outliers
-            cl, ind = restored_pcd.remove_statistical_outlier(nb_neighbors=20, std_ratio=2)
-            result_pcd = restored_pcd.select_by_index(ind)
-            
-            # Save the result
-            o3d.io.write_point_cloud(output_path, result_pcd)
-            
-            success_count += 1
-            results.append({
+            # 加上检查清单和等待准入的耗时
+            outcome["timings"] = {**timer.rounded(), **outcome["timings"]}
+            manifest.append(filename, input_digest, request_digest, output_path, "success", outcome["timings"])
+            yield {
                 "file": filename,
                 "status": "success",
-                "output_path": output_path
-            })
+                "output_path": output_path,
+                "cached": outcome["cached"],
+                "coalesced": outcome["coalesced"]
+            }, outcome["timings"]
+            if outcome["cached"] or outcome["coalesced"]:
+                continue
             
-            # 清理GPU内存
-            clear_gpu_memory()
+            # 按需释放缓存
+            release_memory()
             
+        except DeadlineExceeded as e:
+            manifest.append(filename, input_digest, request_digest, output_path, "cancelled", error=str(e))
+            yield {
+                "file": filename,
+                "status": "cancelled",
+                "reason": str(e)
+            }, timer.rounded()
         except Exception as e:
-            results.append({
+            ERRORS.inc(endpoint='complete_folder')
+            manifest.append(filename, input_digest, request_digest, output_path, "failed", error=str(e))
+            yield {
                 "file": filename,
                 "status": "failed",
                 "error": str(e)
-            })
-            # 出错后也清理内存
-            clear_gpu_memory()
-    
+            }, {}
+            # 出错后同样按需释放
+            release_memory()
+
+def folder_summary(files, results):
+    # 按处理清单跳过的文件之前已经成功补全, 计入成功数和补全数
+    success_count = sum(r["status"] in ["success", "copied", "skipped"] for r in results)
+    copied_files = sum(r["status"] == "copied" for r in results)
     return {
         "total_files": len(files),
         "successful": success_count,
         "copied_files": copied_files,
         "completed_files": success_count - copied_files,
+        "skipped_files": sum(r["status"] == "skipped" for r in results),
+        "cancelled_files": sum(r["status"] == "cancelled" for r in results),
         "results": results
     }
 
+def start_folder_job(raw, request):
+    """检查文件夹请求并登记 bulk 任务, 任务数超限时立即返回 429/503"""
+    files = list_folder_files(request)
+    client = client_id(raw)
+    try:
+        app.state.admission.start_job(client)
+    except AdmissionRejected as e:
+        raise admission_error(e)
+    return files, client
+
+@app.post('/complete_folder')
+async def complete_folder(raw: Request, request: FolderProcessRequest):
+    """
+    Process all point cloud files in a folder and save results to output folder
+    """
+    files, client = start_folder_job(raw, request)
+    try:
+        results = [{**result, "timings": timings} async for result, timings in folder_results(request, files, client)]
+    finally:
+        app.state.admission.end_job(client)
+    # 响应头给出所有文件各阶段耗时之和
+    totals = {}
+    for result in results:
+        for name, ms in result["timings"].items():
+            totals[name] = totals.get(name, 0.0) + ms
+    return JSONResponse(folder_summary(files, results),
+                        headers={'Server-Timing': server_timing(totals, request_elapsed_ms(request))})
+
+@app.post('/complete_folder_stream')
+async def complete_folder_stream(raw: Request, request: FolderProcessRequest):
+    """
+    与 /complete_folder 相同, 以 NDJSON 流式返回: 每个文件写出后立即返回一行记录(含各阶段耗时),
+    最后一行是与 /complete_folder 响应相同的汇总
+    """
+    files, client = start_folder_job(raw, request)
+
+    async def stream():
+        results = []
+        try:
+            async for result, timings in folder_results(request, files, client):
+                record = {**result, "timings": timings}
+                results.append(record)
+                yield json.dumps(record, ensure_ascii=False) + "\n"
+        finally:
+            app.state.admission.end_job(client)
+        yield json.dumps(folder_summary(files, results), ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream(), media_type='application/x-ndjson')
+
 @app.post('/complete_file')
-async def complete_file(request: FileProcessRequest):
+async def complete_file(raw: Request, request: FileProcessRequest):
     """
     Process a single point cloud file and save the result to the specified output path
     """
+    validate_request(request)
     # Validate input file
     if not os.path.exists(request.input_file):
         raise HTTPException(status_code=400, detail=f"Input file '{request.input_file}' does not exist")
@@ -308,61 +1113,307 @@ async def complete_file(request: FileProcessRequest):
     if output_dir:
         os.makedirs(output_dir, exist_ok=True)
     
+    # 交互请求超出准入限制时立即返回, 不等待
     try:
-        # Process the point cloud
-        success, center, scale_factor, pcd_filtered = Process_point_cloud(
-            request.input_file, 
-            request.target_points, 
-            request.sampling_method
-        )
-        
-        if not success:
-            raise HTTPException(status_code=500, detail="Failed to process point cloud")
-        
-        # Store normalization parameters
-        output_filename = os.path.basename(request.output_file)
-        normal_record_map[output_filename] = (center, scale_factor)
-        
-        # Run inference
-        pcd_out = Inference(pcd_filtered, app.state.args)
-        
-        # Restore the point cloud
-        current_center, current_scale_factor = normal_record_map[output_filename]
-        restored_pcd = Restore_point_cloud(pcd_out, current_center, current_scale_factor)
-        
-        # Remove statistical outliers
-        cl, ind = restored_pcd.remove_statistical_outlier(nb_neighbors=20, std_ratio=2)
-        result_pcd = restored_pcd.select_by_index(ind)
-        
-        # Save the result
-        o3d.io.write_point_cloud(request.output_file, result_pcd)
-        
-        # 清理GPU内存
-        clear_gpu_memory()
-        
-        return {
-            "status": "success",
-            "input_file": request.input_file,
-            "output_file": request.output_file
-        }
-        
+        ticket = app.state.admission.admit(client_id(raw), app.state.admission.check_file(request.input_file))
+    except AdmissionRejected as e:
+        raise admission_error(e)
+
+    try:
+        outcome = await complete_one_coalesced(request.input_file, request.output_file, request)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except Exception as e:
+        ERRORS.inc(endpoint='complete_file')
+        # 出错后同样按需释放
+        release_memory()
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        app.state.admission.release(ticket)
+
+    if not outcome:
+        release_memory()
+        raise HTTPException(status_code=500, detail="Failed to process point cloud")
+    if not (outcome["cached"] or outcome["coalesced"]):
+        # 按需释放缓存
+        release_memory()
+    
+    # 合并的请求返回实际计算的请求的各阶段耗时, total 是本请求自己的总耗时
+    return JSONResponse({
+        "status": "success",
+        "input_file": request.input_file,
+        "output_file": request.output_file,
+        "cached": outcome["cached"],
+        "coalesced": outcome["coalesced"],
+        "timings": outcome["timings"]
+    }, headers={'Server-Timing': server_timing(outcome["timings"], request_elapsed_ms(request))})
+
+# 响应压缩方式, 与 HTTP Content-Encoding 同名, 客户端可以透明解压
+COMPRESSIONS = {'gzip': gzip.compress, 'deflate': zlib.compress}
+
+async def read_limited_body(raw, admission):
+    """读取请求体, 超过 max_file_bytes 时立即抛出 AdmissionRejected(413)
+
+    先按 Content-Length 在读取之前拒绝; 没有该请求头(如分块上传)或声明不实时按已读取的字节数检查.
+    """
+    admission.check_bytes(int(raw.headers.get('content-length', 0)))
+    chunks = []
+    size = 0
+    async for chunk in raw.stream():
+        size += len(chunk)
+        admission.check_bytes(size)
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+@app.post('/complete_binary')
+async def complete_binary(raw: Request, request: BinaryProcessRequest = Depends()):
+    """
+    请求体为点云本身(小端 float32 的 N x 3 坐标, 或 PLY 文件字节), 响应体为补全后的坐标, 服务器不写临时文件
+    """
+    validate_request(request)
+    if request.encoding not in ENCODINGS:
+        raise HTTPException(status_code=400, detail=f"Unsupported encoding '{request.encoding}', choose from {ENCODINGS}")
+    if request.compression is not None and request.compression not in COMPRESSIONS:
+        raise HTTPException(status_code=400, detail=f"Unsupported compression '{request.compression}', choose from {list(COMPRESSIONS)}")
+
+    admission = app.state.admission
+    try:
+        body = await read_limited_body(raw, admission)
+    except AdmissionRejected as e:
+        raise admission_error(e)
+    try:
+        points = parse_point_cloud(body)
+    except (ValueError, KeyError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid point cloud: {e}")
+    try:
+        ticket = admission.admit(client_id(raw), len(points))
+    except AdmissionRejected as e:
+        raise admission_error(e)
+
+    digest = hashlib.sha256(body).hexdigest()
+    key = (digest, params_digest(effective_params(request, '.f32')), schedule_key(request))
+    try:
+        (result, cached, timings), coalesced = await single_flight.run(key, complete_bytes, digest, points, request)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
-        # 出错后也清理内存
-        clear_gpu_memory()
+        ERRORS.inc(endpoint='complete_binary')
+        # 出错后同样按需释放
+        release_memory()
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        admission.release(ticket)
+
+    if result is None:
+        raise HTTPException(status_code=500, detail="Failed to process point cloud")
+    if not (cached or coalesced):
+        # 按需释放缓存
+        release_memory()
+
+    content, headers = encode_points(result, request.encoding)
+    if request.compression is not None:
+        content = COMPRESSIONS[request.compression](content)
+        headers['Content-Encoding'] = request.compression
+    headers['X-Cached'] = str(cached).lower()
+    headers['X-Coalesced'] = str(coalesced).lower()
+    headers['Server-Timing'] = server_timing(timings, request_elapsed_ms(request))
+    return Response(content=content, media_type='application/octet-stream', headers=headers)
+
+# 每个条目可以单独指定的参数
+_BATCH_ITEM_FIELDS = ['target_points', 'sampling_method', 'seed', 'precision', 'stop_at', 'num_query']
+
+def batch_item_request(request, item):
+    """合并批量请求的默认参数和条目自己的参数, 得到与 /complete_binary 相同的单条请求"""
+    params = {name: getattr(request, name) for name in _BATCH_ITEM_FIELDS}
+    params.update({name: getattr(item, name) for name in _BATCH_ITEM_FIELDS if getattr(item, name) is not None})
+    item_request = BinaryProcessRequest(latency_budget_ms=request.latency_budget_ms, encoding=request.encoding,
+                                        priority=request.priority or 'bulk', deadline_ms=request.deadline_ms, **params)
+    # 截止时间从收到批量请求时算起
+    item_request._received = request._received
+    return item_request
+
+def load_batch_item(item):
+    if item.data is not None:
+        return parse_point_cloud(base64.b64decode(item.data))
+    if item.input_file is None:
+        raise ValueError("input_file 和 data 至少指定一个")
+    if not os.path.exists(item.input_file):
+        raise ValueError(f"Input file '{item.input_file}' does not exist")
+    return np.asarray(o3d.io.read_point_cloud(item.input_file).points)
+
+def batch_item_points(item):
+    """不解析点云估计条目的点数, 同时检查文件大小"""
+    admission = app.state.admission
+    if item.data is not None:
+        admission.check_bytes(len(item.data) * 3 // 4)
+        return len(item.data) * 3 // 4 // 12
+    if item.input_file is not None and os.path.exists(item.input_file):
+        return admission.check_file(item.input_file)
+    # 无效条目在处理时单独报错
+    return 0
+
+def batch_records(request):
+    """逐条产生 /complete_batch 的结果记录
+
+    所有条目先各自预处理(归一化、采样、去除离群点), 推理参数相同的条目拼成batch一次前向,
+    每个条目还原并保存后立即产生记录. 任何一步失败只影响该条目.
+    """
+    def failed(index, item, error):
+        ERRORS.inc(endpoint='complete_batch')
+        FILES.inc(status='failed')
+        return {"index": index, "file": item.input_file, "status": "failed", "error": error}
+
+    # 预处理, 按推理参数分组
+    groups = {}
+    for index, item in enumerate(request.items):
+        try:
+            item_request = batch_item_request(request, item)
+            validate_request(item_request)
+            points = load_batch_item(item)
+            POINTS_IN.inc(len(points))
+            normalized = normalize_points(points)
+            if normalized is None:
+                yield failed(index, item, "Failed to process point cloud")
+                continue
+            normalized_points, center, scale_factor = normalized
+            with SAMPLING_SECONDS.time(method=item_request.sampling_method):
+                sampled_points = sample_point_cloud(normalized_points, item_request.target_points,
+                                                    item_request.sampling_method, item_request.seed)
+            pcd_filtered = remove_outliers(sampled_points)
+        except HTTPException as e:
+            yield failed(index, item, e.detail)
+            continue
+        except Exception as e:
+            yield failed(index, item, str(e))
+            continue
+        forward = (item_request.precision, item_request.stop_at,
+                   resolve_num_query(app.state.args, item_request.num_query, item_request.latency_budget_ms),
+                   item_request.seed)
+        groups.setdefault(forward, []).append((index, item, center, scale_factor, pcd_filtered))
+
+    # 每组一次batch前向
+    for (precision, stop_at, num_query, seed), group in groups.items():
+        try:
+            outputs = Inference_batch([entry[4] for entry in group], app.state.args, precision=precision,
+                                      stop_at=stop_at, num_query=num_query, seed=seed,
+                                      priority=request.priority or 'bulk', deadline=request_deadline(request))
+        except DeadlineExceeded as e:
+            for index, item, _, _, _ in group:
+                yield {"index": index, "file": item.input_file, "status": "cancelled", "reason": str(e)}
+            continue
+        except Exception as e:
+            for index, item, _, _, _ in group:
+                yield failed(index, item, str(e))
+            release_memory()
+            continue
+
+        for (index, item, center, scale_factor, _), pcd_out in zip(group, outputs):
+            try:
+                result_pcd = restore_points(pcd_out, center, scale_factor)
+                record = {"index": index, "file": item.input_file, "status": "success",
+                          "points": len(result_pcd.points)}
+                if item.output_file:
+                    output_dir = os.path.dirname(item.output_file)
+                    if output_dir:
+                        os.makedirs(output_dir, exist_ok=True)
+                    o3d.io.write_point_cloud(item.output_file, result_pcd)
+                    record["output_path"] = item.output_file
+                else:
+                    content, headers = encode_points(np.asarray(result_pcd.points), request.encoding)
+                    record.update({"data": base64.b64encode(content).decode('ascii'), "encoding": request.encoding})
+                    if 'X-Point-Scale' in headers:
+                        record["scale"] = headers['X-Point-Scale']
+                        record["offset"] = headers['X-Point-Offset']
+                FILES.inc(status='success')
+                yield record
+            except Exception as e:
+                yield failed(index, item, str(e))
+        release_memory()
+
+@app.post('/complete_batch')
+async def complete_batch(raw: Request, request: BatchProcessRequest):
+    """
+    一次请求补全多个点云(服务器路径或 base64 内嵌数据), 推理参数相同的条目拼成batch一次前向.
+    以 NDJSON 流式返回, 每个条目完成后立即返回一行记录, 最后一行是汇总.
+    """
+    if not request.items:
+        raise HTTPException(status_code=400, detail="items should not be empty")
+    if request.encoding not in ENCODINGS:
+        raise HTTPException(status_code=400, detail=f"Unsupported encoding '{request.encoding}', choose from {ENCODINGS}")
+    validate_schedule(request)
+
+    # 整个批量请求是一个 bulk 任务, 按所有条目的点数等待一次配额
+    admission = app.state.admission
+    client = client_id(raw)
+    try:
+        points = sum(batch_item_points(item) for item in request.items)
+        admission.start_job(client)
+    except AdmissionRejected as e:
+        raise admission_error(e)
+    try:
+        ticket = await admission.admit_wait(client, points, bulk=True)
+    except BaseException:
+        admission.end_job(client)
+        raise
+
+    def stream():
+        success_count = 0
+        try:
+            for record in batch_records(request):
+                success_count += record["status"] == "success"
+                yield json.dumps(record, ensure_ascii=False) + "\n"
+        finally:
+            admission.release(ticket)
+            admission.end_job(client)
+        yield json.dumps({
+            "total_items": len(request.items),
+            "successful": success_count,
+            "failed": len(request.items) - success_count
+        }) + "\n"
+
+    # 同步生成器由 StreamingResponse 放到线程池中迭代, 不阻塞事件循环
+    return StreamingResponse(stream(), media_type='application/x-ndjson')
 
 def start():
     args = get_args()
     
     # Validate required arguments
-    if not os.path.exists(args.model_config):
-        print(f"Error: Model config file {args.model_config} not found")
+    if args.backend == 'pytorch':
+        if not args.model_config or not os.path.exists(args.model_config):
+            print(f"Error: Model config file {args.model_config} not found")
+            exit(1)
+        
+        if not args.model_checkpoint or not os.path.exists(args.model_checkpoint):
+            print(f"Error: Model checkpoint file {args.model_checkpoint} not found")
+            exit(1)
+    elif not args.model_artifact or not os.path.exists(args.model_artifact):
+        print(f"Error: Model artifact {args.model_artifact} not found")
         exit(1)
     
-    if not os.path.exists(args.model_checkpoint):
-        print(f"Error: Model checkpoint file {args.model_checkpoint} not found")
+    # onnx 后端使用 onnxruntime 的 CPU 执行器
+    if args.backend == 'onnx' and args.device != 'cpu':
+        print(f"onnx 后端只支持CPU, 忽略设备 {args.device}")
+        args.device = 'cpu'
+        args.auto_select_device = False
+    if args.precision != 'fp32' and args.backend != 'pytorch':
+        print(f"Error: --precision {args.precision} 只支持 pytorch 后端")
         exit(1)
-    
+    if args.prefork and not args.replicas:
+        print("Error: --prefork 需要同时指定 --replicas, 如 --replicas cpu:0-3,cpu:4-7")
+        exit(1)
+    if args.prefork and args.device != 'cpu':
+        print(f"prefork 模式只支持CPU副本, 忽略设备 {args.device}")
+        args.device = 'cpu'
+        args.auto_select_device = False
+    if args.quantize is not None:
+        if args.backend != 'pytorch':
+            print("Error: --quantize 只支持 pytorch 后端")
+            exit(1)
+        if args.device != 'cpu':
+            print(f"int8 量化模型只支持CPU, 忽略设备 {args.device}")
+            args.device = 'cpu'
+            args.auto_select_device = False
+
     # 设置CUDA设备
     if args.auto_select_device:
         args.device = find_best_device()
@@ -406,10 +1457,64 @@ def start():
     # 存储设备信息到应用状态
     app.state.device = args.device
     app.state.args = args
+    app.state.cache = None
+    app.state.pose_cache = None
+    if args.pose_cache:
+        app.state.pose_cache = PoseCache(args.pose_cache_entries, args.pose_descriptor_tol, args.pose_chamfer_tol)
+    if args.cache_dir:
+        app.state.cache = ResultCache(args.cache_dir, int(args.cache_max_mb * 1024 * 1024),
+                                      int(args.cache_memory_mb * 1024 * 1024))
+        stats = app.state.cache.stats()
+        print(f"结果缓存: {args.cache_dir}, 已有 {stats['disk_entries']} 条 ({stats['disk_bytes'] / 1024 / 1024:.1f}MB)")
+
+    app.state.admission = AdmissionController(args.max_in_flight, args.max_queued_points,
+                                              int(args.max_file_mb * 1024 * 1024), args.bulk_share)
+    app.state.preprocessor = None
+    if args.preprocess_workers > 0:
+        app.state.preprocessor = ShmPreprocessor(args.preprocess_workers, args.preprocess_slots,
+                                                 args.preprocess_max_points)
+        ring = app.state.preprocessor.ring
+        print(f"预处理进程 {args.preprocess_workers} 个, 共享内存 {ring.num_slots} 个槽位 x {ring.max_points} 点")
+    app.state.pool = None
+    if args.replicas:
+        # 前向交给副本进程, 前端进程不加载模型, 校验请求和 /model_info 使用副本发回的模型信息
+        app.state.pool = WorkerPool(args, parse_replicas(args.replicas), prefork=args.prefork,
+                                    timeout=args.replica_timeout).start()
+        set_inference_pool(app.state.pool)
+        stats = app.state.pool.stats()
+        if stats['parent_load_ms'] is not None:
+            print(f"父进程加载模型 {stats['parent_load_ms']:.0f}ms, 参数已移到共享内存")
+        for replica in stats['replicas']:
+            memory = replica.get('memory', {})
+            print(f"推理副本 {replica['index']}: {replica['device']}, 核 {replica['cores'] or '全部'}, "
+                  f"pid {replica['pid']}, 冷启动 {replica['start_ms']:.0f}ms, 模型加载 {replica['load_ms']:.0f}ms, "
+                  f"RSS {memory.get('rss_mb', 0):.0f}MB (PSS {memory.get('pss_mb', 0):.0f}MB)")
+    else:
+        # 启动时预加载模型, 避免第一个请求承担模型加载的开销
+        load_inference_model(args)
+    # 使用推理池时前向在副本进程中, 各副本自己管理显存, 前端进程只记录 RSS, 不初始化 CUDA
+    app.state.memory = MemoryManager('cpu' if app.state.pool is not None else args.device,
+                                     args.memory_watermark, args.memory_policy, args.memory_sample_every)
+    set_memory_manager(app.state.memory)
+    app.state.profile = None
+    app.state.scheduler = None
+    if args.scheduler:
+        # 使用多副本推理池时每个副本一个调度线程
+        threads = len(app.state.pool.replicas) if app.state.pool is not None else 1
+        app.state.scheduler = InferenceScheduler(lambda clouds, key: forward_batch(clouds, args, *key),
+                                                 args.scheduler_batch_size, threads, args.scheduler_timeout)
+        set_inference_scheduler(app.state.scheduler)
+    if args.query_calibration:
+        calibration = load_query_calibration(args.query_calibration)
+        print(f"查询数标定 ({calibration.get('device')}, {calibration.get('precision')}): "
+              + ", ".join(f"{n}: {ms:.1f}ms" for n, ms in sorted(calibration['latency_ms'].items())))
     
     print(f"\n启动API服务器，端口: {args.port}...")
-    print(f"模型配置: {args.model_config}")
-    print(f"模型权重: {args.model_checkpoint}")
+    if args.backend == 'pytorch':
+        print(f"模型配置: {args.model_config}")
+        print(f"模型权重: {args.model_checkpoint}")
+    else:
+        print(f"模型文件 ({args.backend}): {args.model_artifact}")
     print(f"使用设备: {args.device}")
     
     uvicorn.run(app, host="0.0.0.0", port=args.port)
@@ -0,0 +1,217 @@
+import asyncio
+import math
+import os
+import threading
+import time
+
+# 服务时间的指数滑动平均系数, 用于估计 Retry-After
+_LATENCY_DECAY = 0.8
+
+
+class AdmissionRejected(Exception):
+    """请求超出准入限制
+
+    Attributes:
+        status (int): 429 表示客户端或任务类别超出配额, 503 表示服务器整体已满, 413 表示输入文件过大
+        retry_after (int or None): 建议的重试等待秒数, 413 时为 None
+    """
+    def __init__(self, status, reason, retry_after=None):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def estimate_points(path):
+    """不读取整个文件估计点数: PLY/PCD 读取头部的点数, 其他格式按每点12字节(3个float32)估计"""
+    with open(path, 'rb') as f:
+        head = f.read(4096)
+    for line in head.split(b'\n'):
+        tokens = line.split()
+        if len(tokens) == 3 and tokens[:2] == [b'element', b'vertex']:
+            return int(tokens[2])
+        if len(tokens) == 2 and tokens[0] == b'POINTS':
+            return int(tokens[1])
+        if line.strip() in [b'end_header', b'DATA ascii', b'DATA binary', b'DATA binary_compressed']:
+            break
+    return os.path.getsize(path) // 12
+
+
+class _Ticket(object):
+    def __init__(self, client, points, bulk):
+        self.client = client
+        self.points = points
+        self.bulk = bulk
+        self.start = time.perf_counter()
+
+
+class AdmissionController(object):
+    """补全请求的准入控制和背压
+
+    以单个点云(文件)为单位计数: 同时在处理的点云数不超过 max_in_flight, 已接收未完成的输入点数之和不超过
+    max_queued_points. 文件夹/批量任务属于 bulk 类别, 最多占用 bulk_share 比例的配额, 剩余部分留给
+    /complete_file 等交互请求; 多个客户端同时活跃时每个客户端最多占用平均份额. 交互请求超限时立即拒绝
+    (AdmissionRejected), bulk 任务的每个文件则等待配额(admit_wait), 任务本身的数量同样受限.
+
+    限制为 0 表示不限制.
+    """
+    def __init__(self, max_in_flight=0, max_queued_points=0, max_file_bytes=0, bulk_share=0.5):
+        self.max_in_flight = max_in_flight
+        self.max_queued_points = max_queued_points
+        self.max_file_bytes = max_file_bytes
+        self.bulk_share = bulk_share
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._in_flight = 0
+        self._points = 0
+        self._bulk_in_flight = 0
+        self._bulk_points = 0
+        self._jobs = 0
+        self._latency_s = None
+        self._rejected = {}
+
+    def _client(self, client):
+        # 新客户端的状态在被接收后才登记, 被拒绝的客户端不会留下空记录
+        return self._clients.get(client) or {'in_flight': 0, 'points': 0, 'jobs': 0, 'waiting': 0}
+
+    def _active_clients(self, client):
+        return max(1, sum(1 for name, s in self._clients.items()
+                          if name == client or s['in_flight'] or s['jobs']))
+
+    def _reject(self, status, reason):
+        self._rejected[reason] = self._rejected.get(reason, 0) + 1
+        retry_after = max(1, math.ceil(self._latency_s or 1.0))
+        return AdmissionRejected(status, reason, retry_after)
+
+    def check_file(self, path):
+        """检查输入文件大小并估计点数, 超过 max_file_bytes 时拒绝(413)
+
+        Returns:
+            int: 估计的点数
+        """
+        size = os.path.getsize(path)
+        if self.max_file_bytes and size > self.max_file_bytes:
+            with self._lock:
+                self._rejected['file_size'] = self._rejected.get('file_size', 0) + 1
+            raise AdmissionRejected(413, f"文件大小 {size / 1024 / 1024:.1f}MB 超过上限 "
+                                         f"{self.max_file_bytes / 1024 / 1024:.1f}MB")
+        return estimate_points(path)
+
+    def check_bytes(self, size):
+        if self.max_file_bytes and size > self.max_file_bytes:
+            with self._lock:
+                self._rejected['file_size'] = self._rejected.get('file_size', 0) + 1
+            raise AdmissionRejected(413, f"请求体 {size / 1024 / 1024:.1f}MB 超过上限 "
+                                         f"{self.max_file_bytes / 1024 / 1024:.1f}MB")
+
+    def admit(self, client, points, bulk=False):
+        """接收一个点云, 超出限制时抛出 AdmissionRejected
+
+        Returns:
+            _Ticket: 处理完成后传给 release
+        """
+        with self._lock:
+            state = self._client(client)
+            if self.max_in_flight:
+                if self._in_flight >= self.max_in_flight:
+                    raise self._reject(503, 'in_flight')
+                if bulk and self._bulk_in_flight >= max(1, int(self.max_in_flight * self.bulk_share)):
+                    raise self._reject(429, 'bulk_in_flight')
+                if state['in_flight'] >= max(1, self.max_in_flight // self._active_clients(client)):
+                    raise self._reject(429, 'client_in_flight')
+            if self.max_queued_points and self._points > 0:
+                # 没有在途点云时总能接收一个, 超大的单个输入由 max_file_bytes 限制
+                if self._points + points > self.max_queued_points:
+                    raise self._reject(503, 'queued_points')
+                if bulk and self._bulk_points > 0 and \
+                        self._bulk_points + points > self.max_queued_points * self.bulk_share:
+                    raise self._reject(429, 'bulk_points')
+                if state['points'] > 0 and \
+                        state['points'] + points > self.max_queued_points / self._active_clients(client):
+                    raise self._reject(429, 'client_points')
+
+            state['in_flight'] += 1
+            state['points'] += points
+            self._clients[client] = state
+            self._in_flight += 1
+            self._points += points
+            if bulk:
+                self._bulk_in_flight += 1
+                self._bulk_points += points
+        return _Ticket(client, points, bulk)
+
+    async def admit_wait(self, client, points, bulk=True, poll_s=0.05):
+        """bulk 任务的文件等待配额而不是失败, 等待期间让出事件循环"""
+        while True:
+            try:
+                return self.admit(client, points, bulk)
+            except AdmissionRejected:
+                with self._lock:
+                    state = self._clients[client] = self._client(client)
+                    state['waiting'] += 1
+                try:
+                    await asyncio.sleep(poll_s)
+                finally:
+                    with self._lock:
+                        state = self._client(client)
+                        state['waiting'] -= 1
+                        self._forget(client, state)
+
+    def release(self, ticket):
+        elapsed = time.perf_counter() - ticket.start
+        with self._lock:
+            state = self._client(ticket.client)
+            state['in_flight'] -= 1
+            state['points'] -= ticket.points
+            self._in_flight -= 1
+            self._points -= ticket.points
+            if ticket.bulk:
+                self._bulk_in_flight -= 1
+                self._bulk_points -= ticket.points
+            self._latency_s = elapsed if self._latency_s is None else (
+                _LATENCY_DECAY * self._latency_s + (1 - _LATENCY_DECAY) * elapsed)
+            self._forget(ticket.client, state)
+
+    def start_job(self, client):
+        """开始一个 bulk 任务(文件夹/批量), 任务数超过 max_in_flight 或客户端的平均份额时拒绝"""
+        with self._lock:
+            state = self._client(client)
+            if self.max_in_flight:
+                if self._jobs >= self.max_in_flight:
+                    raise self._reject(503, 'jobs')
+                if state['jobs'] >= max(1, self.max_in_flight // self._active_clients(client)):
+                    raise self._reject(429, 'client_jobs')
+            state['jobs'] += 1
+            self._clients[client] = state
+            self._jobs += 1
+
+    def end_job(self, client):
+        with self._lock:
+            state = self._client(client)
+            state['jobs'] -= 1
+            self._jobs -= 1
+            self._forget(client, state)
+
+    def _forget(self, client, state):
+        if not any(state.values()):
+            self._clients.pop(client, None)
+
+    def state(self):
+        with self._lock:
+            return {
+                'limits': {
+                    'max_in_flight': self.max_in_flight,
+                    'max_queued_points': self.max_queued_points,
+                    'max_file_bytes': self.max_file_bytes,
+                    'bulk_share': self.bulk_share,
+                },
+                'in_flight': self._in_flight,
+                'queued_points': self._points,
+                'bulk_in_flight': self._bulk_in_flight,
+                'bulk_points': self._bulk_points,
+                'jobs': self._jobs,
+                'waiting': sum(s['waiting'] for s in self._clients.values()),
+                'service_time_s': round(self._latency_s, 3) if self._latency_s is not None else None,
+                'clients': {client: dict(s) for client, s in self._clients.items()},
+                'rejected': dict(self._rejected),
+            }
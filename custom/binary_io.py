@@ -0,0 +1,99 @@
+import numpy as np
+
+# PLY 属性类型 -> numpy 类型
+_PLY_TYPES = {
+    'char': 'i1', 'int8': 'i1', 'uchar': 'u1', 'uint8': 'u1',
+    'short': 'i2', 'int16': 'i2', 'ushort': 'u2', 'uint16': 'u2',
+    'int': 'i4', 'int32': 'i4', 'uint': 'u4', 'uint32': 'u4',
+    'float': 'f4', 'float32': 'f4', 'double': 'f8', 'float64': 'f8',
+}
+
+ENCODINGS = ['float32', 'float16', 'int16']
+
+
+def parse_ply(data):
+    """从内存中的 PLY 字节解析顶点坐标, 支持 ascii 和 binary 格式
+
+    顶点需要是第一个元素且不含 list 属性(扫描设备导出的点云都满足).
+
+    Returns:
+        np.ndarray: shape=(N, 3) float32
+    """
+    end = data.find(b'end_header')
+    if end < 0:
+        raise ValueError("PLY 缺少 end_header")
+    body_start = data.index(b'\n', end) + 1
+    header = data[:end].decode('ascii', errors='replace').splitlines()
+
+    fmt, elements = None, []
+    for line in header:
+        tokens = line.split()
+        if not tokens:
+            continue
+        if tokens[0] == 'format':
+            fmt = tokens[1]
+        elif tokens[0] == 'element':
+            elements.append((tokens[1], int(tokens[2]), []))
+        elif tokens[0] == 'property' and elements:
+            elements[-1][2].append(tokens[1:])
+    if not elements or elements[0][0] != 'vertex':
+        raise ValueError("PLY 的第一个元素不是 vertex")
+    _, count, prop_tokens = elements[0]
+    if any(tokens[0] == 'list' for tokens in prop_tokens):
+        raise ValueError("不支持带 list 属性的 vertex")
+    props = [(tokens[1], _PLY_TYPES[tokens[0]]) for tokens in prop_tokens]
+    names = [name for name, _ in props]
+    if not all(axis in names for axis in 'xyz'):
+        raise ValueError("PLY 的 vertex 缺少 x/y/z 属性")
+
+    if fmt == 'ascii':
+        values = np.array(data[body_start:].split()[:count * len(props)], dtype=np.float64)
+        values = values.reshape(count, len(props))
+        return values[:, [names.index(axis) for axis in 'xyz']].astype(np.float32)
+    if fmt not in ['binary_little_endian', 'binary_big_endian']:
+        raise ValueError(f"不支持的 PLY 格式: {fmt}")
+    order = '<' if fmt == 'binary_little_endian' else '>'
+    dtype = np.dtype([(name, order + t) for name, t in props])
+    vertices = np.frombuffer(data, dtype=dtype, count=count, offset=body_start)
+    return np.stack([vertices[axis] for axis in 'xyz'], axis=1).astype(np.float32)
+
+
+def parse_point_cloud(data):
+    """解析请求体: PLY 字节, 或小端 float32 的 N x 3 坐标
+
+    Returns:
+        np.ndarray: shape=(N, 3) float32
+    """
+    if data[:3] == b'ply':
+        return parse_ply(data)
+    if len(data) % 12 != 0:
+        raise ValueError(f"原始点云的字节数 {len(data)} 不是 N x 3 个 float32")
+    return np.frombuffer(data, dtype='<f4').reshape(-1, 3)
+
+
+def encode_points(points, encoding='float32'):
+    """把点云编码为响应体
+
+    Args:
+        points (np.ndarray): shape=(N, 3)
+        encoding (str): 'float32', 'float16', 或 'int16'(按包围盒量化, 坐标 = (q + 32768) * scale + offset)
+
+    Returns:
+        tuple: (bytes, headers), headers 包含点数、编码及 int16 的 scale/offset
+    """
+    points = np.asarray(points, dtype=np.float32).reshape(-1, 3)
+    headers = {'X-Point-Count': str(len(points)), 'X-Point-Encoding': encoding}
+    if encoding == 'float32':
+        return points.astype('<f4').tobytes(), headers
+    if encoding == 'float16':
+        return points.astype('<f2').tobytes(), headers
+    if encoding != 'int16':
+        raise ValueError(f"不支持的编码: {encoding}, 可选 {ENCODINGS}")
+
+    offset = points.min(axis=0) if len(points) else np.zeros(3, dtype=np.float32)
+    extent = points.max(axis=0) - offset if len(points) else np.zeros(3, dtype=np.float32)
+    scale = np.where(extent > 0, extent / 65535, 1.0).astype(np.float32)
+    quantized = np.round((points - offset) / scale) - 32768
+    headers['X-Point-Scale'] = ','.join(repr(float(s)) for s in scale)
+    headers['X-Point-Offset'] = ','.join(repr(float(o)) for o in offset)
+    return np.clip(quantized, -32768, 32767).astype('<i2').tobytes(), headers
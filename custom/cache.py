@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """按块计算文件的 sha256, 大文件不会一次读入内存"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def params_digest(params):
+    """参数摘要, 参数按键排序后序列化"""
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+_model_digest_cache = {}
+
+
+def model_digest(args):
+    """模型摘要: pytorch 后端为 yaml 配置 + 权重文件, 其他后端为导出的模型文件
+
+    同一路径只计算一次, 权重文件较大时避免每个请求重新哈希.
+    """
+    backend = getattr(args, 'backend', 'pytorch')
+    if backend == 'pytorch':
+        paths = (args.model_config, args.model_checkpoint)
+    else:
+        paths = (args.model_artifact,)
+    key = tuple((p, os.path.getmtime(p)) for p in paths)
+    if key not in _model_digest_cache:
+        h = hashlib.sha256()
+        for p in paths:
+            h.update(file_digest(p).encode())
+        _model_digest_cache[key] = h.hexdigest()
+    return _model_digest_cache[key]
+
+
+class ResultCache(object):
+    """补全结果缓存: 键为输入文件内容与全部参数的哈希, 值为输出文件的字节
+
+    两级存储:
+        1. 内存热层, 按最近使用淘汰, 容量 memory_bytes
+        2. 磁盘存储 <cache_dir>/<key前2位>/<key><ext>, 按最近使用淘汰, 容量 max_bytes
+    启动时按文件修改时间恢复磁盘存储的LRU顺序, 命中时更新修改时间.
+    """
+    def __init__(self, cache_dir, max_bytes=1 << 30, memory_bytes=64 << 20):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> bytes
+        self._memory_size = 0
+        self._disk = OrderedDict()  # key -> (path, size)
+        self._disk_size = 0
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'puts': 0, 'evictions': 0}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, os.path.splitext(name)[0], path, stat.st_size))
+        for _, key, path, size in sorted(entries):
+            self._disk[key] = (path, size)
+            self._disk_size += size
+        self._evict_disk()
+
+    @staticmethod
+    def key(input_digest, params):
+        """缓存键: 输入文件摘要 + 参数(含模型摘要和随机种子)"""
+        return hashlib.sha256((input_digest + params_digest(params)).encode()).hexdigest()
+
+    def get(self, key):
+        """返回缓存的输出文件字节, 未命中返回 None"""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return data
+            entry = self._disk.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            path, _ = entry
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                os.utime(path)
+            except OSError:
+                # 缓存文件被外部删除
+                self._drop_disk(key)
+                self._stats['misses'] += 1
+                return None
+            self._disk.move_to_end(key)
+            self._stats['disk_hits'] += 1
+            self._put_memory(key, data)
+            return data
+
+    def put(self, key, data, ext='.ply'):
+        """写入缓存, 磁盘上先写临时文件再改名, 其他进程不会读到写了一半的文件
+
+        每次写入使用独立的临时文件, 同一个键的并发写入各自改名, 后完成的覆盖先完成的.
+        """
+        path = os.path.join(self.cache_dir, key[:2], key + ext)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=key, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        with self._lock:
+            if key in self._disk:
+                self._disk_size -= self._disk.pop(key)[1]
+            self._disk[key] = (path, len(data))
+            self._disk_size += len(data)
+            self._stats['puts'] += 1
+            self._evict_disk()
+            self._put_memory(key, data)
+
+    def _put_memory(self, key, data):
+        if len(data) > self.memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_bytes:
+            _, old = self._memory.popitem(last=False)
+            self._memory_size -= len(old)
+
+    def _drop_disk(self, key):
+        path, size = self._disk.pop(key)
+        self._disk_size -= size
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _evict_disk(self):
+        while self._disk_size > self.max_bytes and self._disk:
+            key = next(iter(self._disk))
+            self._drop_disk(key)
+            if key in self._memory:
+                self._memory_size -= len(self._memory.pop(key))
+            self._stats['evictions'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            hits = stats['memory_hits'] + stats['disk_hits']
+            lookups = hits + stats['misses']
+            stats.update({
+                'hits': hits,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_size,
+                'disk_entries': len(self._disk),
+                'disk_bytes': self._disk_size,
+                'max_bytes': self.max_bytes,
+            })
+            return stats
@@ -0,0 +1,93 @@
+import itertools
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from custom.down_sample import normalize_point_cloud, sample_point_cloud, remove_outliers
+from custom.inference import Inference_chunked
+from custom.inverse_normalize import inverse_normalize_point_cloud
+
+# 26邻域中的一半偏移, 每对相邻体素只需检查一次
+_HALF_NEIGHBOURS = [offset for offset in itertools.product([-1, 0, 1], repeat=3) if offset > (0, 0, 0)]
+
+
+def voxel_components(points, voxel_size=0.02, min_points=64):
+    """体素连通域聚类: 把点放进体素, 26邻域相邻的非空体素属于同一物体
+
+    Args:
+        points (np.ndarray): 点云 shape=(N, 3)
+        voxel_size (float): 体素大小, 间隔超过一个体素的物体会被分开
+        min_points (int): 点数少于该值的连通域视为噪声丢弃
+
+    Returns:
+        list[np.ndarray]: 每个物体的点索引, 按点数从多到少排列
+    """
+    keys = np.floor(points / voxel_size).astype(np.int64)
+    keys -= keys.min(axis=0) - 1  # 留出一圈空体素, 邻居坐标不会越界
+    dims = keys.max(axis=0) + 2
+
+    def _hash(k):
+        return (k[:, 0] * dims[1] + k[:, 1]) * dims[2] + k[:, 2]
+
+    voxel_hashes, first, inverse = np.unique(_hash(keys), return_index=True, return_inverse=True)
+    voxels = keys[first]
+    n_voxels = len(voxel_hashes)
+
+    rows, cols = [], []
+    for offset in _HALF_NEIGHBOURS:
+        neighbour = _hash(voxels + np.array(offset))
+        pos = np.minimum(np.searchsorted(voxel_hashes, neighbour), n_voxels - 1)
+        found = voxel_hashes[pos] == neighbour
+        rows.append(np.nonzero(found)[0])
+        cols.append(pos[found])
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    graph = coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n_voxels, n_voxels))
+    _, voxel_labels = connected_components(graph, directed=False)
+
+    labels = voxel_labels[inverse.reshape(-1)]
+    counts = np.bincount(labels)
+    clusters = [np.nonzero(labels == label)[0] for label in np.argsort(-counts) if counts[label] >= min_points]
+    return clusters
+
+
+def _prepare_object(points, target_points, sampling_method, seed=None):
+    # 与 Process_point_cloud 相同: 归一化 -> 采样 -> 统计离群点移除
+    normalized = normalize_point_cloud(points)
+    if normalized is None:
+        return None
+    normalized_points, center, scale_factor = normalized
+    sampled_points = sample_point_cloud(normalized_points, target_points, sampling_method, seed)
+    return np.asarray(remove_outliers(sampled_points).points), center, scale_factor
+
+
+def Objects_inference(points, args, voxel_size=0.02, min_points=64, target_points=2048, sampling_method='fps',
+                      num_workers=4, seed=None, **options):
+    """多物体补全: 体素连通域聚类出每个物体, 各自归一化后分批前向(Inference_chunked), 再按各自参数还原并合并
+
+    Args:
+        points (np.ndarray): 整体归一化后的点云 shape=(N, 3), 不需要预先采样
+        args: 推理参数, 同 Inference
+        voxel_size (float): 聚类体素大小(整体归一化坐标)
+        min_points (int): 点数少于该值的聚类丢弃
+        target_points (int): 每个物体采样后的点数
+        num_workers (int): 物体预处理(归一化+采样)的线程数
+        seed (int, optional): 采样随机种子, 指定后结果可复现
+        options: 透传给 Inference_chunked 的参数(chunk_size, precision, stop_at, num_query, latency_budget_ms, priority, deadline)
+
+    Returns:
+        np.ndarray: 所有物体补全结果合并后的点云, 整体归一化坐标
+    """
+    clusters = voxel_components(points, voxel_size, min_points)
+    with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+        prepared = list(executor.map(lambda idx: _prepare_object(points[idx], target_points, sampling_method, seed), clusters))
+    prepared = [p for p in prepared if p is not None]
+    if not prepared:
+        raise ValueError(f"没有点数不少于 {min_points} 的物体")
+    print(f"多物体补全: {len(prepared)} 个物体")
+
+    outputs = Inference_chunked([p[0] for p in prepared], args, seed=seed, **options)
+    restored = [inverse_normalize_point_cloud(out, center, scale_factor)
+                for out, (_, center, scale_factor) in zip(outputs, prepared)]
+    return np.concatenate(restored)
@@ -4,12 +4,18 @@ import os
 from sklearn.neighbors import NearestNeighbors
 from tqdm import tqdm
 
-def random_sampling(points, n_points):
+def _random_state(seed=None):
+    # seed 为 None 时使用全局随机状态, 否则每次调用得到相同的采样结果
+    return np.random if seed is None else np.random.RandomState(seed)
+
+
+def random_sampling(points, n_points, seed=None):
     """随机采样
 
     Args:
         points (np.ndarray): 输入点云 shape=(N, 3)
         n_points (int): 采样后的点数
+        seed (int, optional): 随机种子
 
     Returns:
         np.ndarray: 采样后的点云 shape=(n_points, 3)
@@ -19,16 +25,17 @@ def random_sampling(points, n_points):
         return points
 
     # 随机选择n_points个点
-    indices = np.random.choice(points.shape[0], n_points, replace=False)
+    indices = _random_state(seed).choice(points.shape[0], n_points, replace=False)
     return points[indices]
 
 
-def farthest_point_sampling(points, n_points):
+def farthest_point_sampling(points, n_points, seed=None):
     """最远点采样 (FPS)
 
     Args:
         points (np.ndarray): 输入点云 shape=(N, 3)
         n_points (int): 采样后的点数
+        seed (int, optional): 随机种子, 决定第一个点
 
     Returns:
         np.ndarray: 采样后的点云 shape=(n_points, 3)
@@ -43,7 +50,7 @@ def farthest_point_sampling(points, n_points):
     distances = np.ones(N) * 1e10
 
     # 随机选择第一个点
-    farthest_idx = np.random.randint(0, N)
+    farthest_idx = _random_state(seed).randint(0, N)
 
     # 迭代选择最远点
     for i in range(n_points):
@@ -81,33 +88,16 @@ def voxel_down_sampling(points, voxel_size):
     return np.asarray(downsampled_pcd.points)
 
 
-def Process_point_cloud(input_file, target_points=2048, sampling_method='fps'):
-    """处理单个点云文件
+def normalize_point_cloud(points):
+    """把点云平移、等比缩放到以原点为中心的单位立方体 [-0.5, 0.5]
 
     Args:
-        input_file (str): 输入点云文件路径
-        output_file (str): 输出点云文件路径
-        target_points (int): 采样后的点数
-        sampling_method (str): 采样方法, 'random'、'fps'或'voxel'
-    """
-    # 读取点云
-    pcd = o3d.io.read_point_cloud(input_file)
-    points = np.asarray(pcd.points)
-
-    # 检查点云是否为空
-    if len(points) == 0:
-        print(f"警告: {input_file} 是空点云，跳过处理")
-        return False
+        points (np.ndarray): 输入点云 shape=(N, 3)
 
-    # 归一化点云
-    # centroid = np.mean(points, axis=0)
-    # points_centered = points - centroid
-    # max_distance = np.max(np.sqrt(np.sum(points_centered ** 2, axis=1)))
-    # if max_distance == 0:
-    #     print(f"警告: {input_file} 所有点重合，跳过处理")
-    #     return False
-    # points_normalized = points_centered / max_distance
-        # 计算点云的边界框
+    Returns:
+        tuple: (normalized_points, center, scale_factor), 点云是平面或线性时返回 None
+    """
+    # 计算点云的边界框
     min_coords = np.min(points, axis=0)
     max_coords = np.max(points, axis=0)
 
@@ -118,10 +108,9 @@ def Process_point_cloud(input_file, target_points=2048, sampling_method='fps'):
     max_extent = np.max(extents)
 
     if max_extent == 0:
-        print("警告: 点云是平面或线性的，无法正常归一化")
-        return points
+        return None
 
-        # 计算中心点
+    # 计算中心点
     center = (min_coords + max_coords) / 2
 
     # 平移点云到原点为中心
@@ -130,28 +119,96 @@ def Process_point_cloud(input_file, target_points=2048, sampling_method='fps'):
     # 缩放点云使最大尺寸为1.0（即范围为[-0.5, 0.5]）
     scale_factor = 1.0 / max_extent
     normalized_points = centered_points * scale_factor
+    return normalized_points, center, scale_factor
 
-    print("处理前的缩放因子：",scale_factor)
-    # 根据选择的方法对点云进行采样
+
+def sample_point_cloud(points, target_points, sampling_method='fps', seed=None):
+    """按选择的方法对点云进行采样
+
+    Args:
+        points (np.ndarray): 输入点云 shape=(N, 3)
+        target_points (int): 采样后的点数
+        sampling_method (str): 采样方法, 'random'、'fps'或'voxel'
+        seed (int, optional): 随机种子, 指定后采样结果可复现
+    """
     if sampling_method == 'random':
-        sampled_points = random_sampling(normalized_points, target_points)
+        return random_sampling(points, target_points, seed)
     elif sampling_method == 'fps':
-        sampled_points = farthest_point_sampling(normalized_points, target_points)
+        return farthest_point_sampling(points, target_points, seed)
     elif sampling_method == 'voxel':
         # 使用体素下采样后再用FPS精确控制点数
         voxel_size = 0.02  # 可以根据点云特性调整
-        downsampled = voxel_down_sampling(normalized_points, voxel_size)
-        sampled_points = farthest_point_sampling(downsampled, target_points)
+        downsampled = voxel_down_sampling(points, voxel_size)
+        return farthest_point_sampling(downsampled, target_points, seed)
     else:
         raise ValueError(f"不支持的采样方法: {sampling_method}")
 
-    # 创建新的点云对象
+
+def remove_outliers(points):
+    """统计离群点移除
+
+    Returns:
+        o3d.geometry.PointCloud: 去除离群点后的点云
+    """
     pcd_processed = o3d.geometry.PointCloud()
-    pcd_processed.points = o3d.utility.Vector3dVector(sampled_points)
+    pcd_processed.points = o3d.utility.Vector3dVector(points)
+    cl, ind = pcd_processed.remove_statistical_outlier(nb_neighbors=20, std_ratio=2)
+    return pcd_processed.select_by_index(ind)
+
+
+def Load_normalized_point_cloud(input_file):
+    """读取点云文件并归一化, 不做采样
+
+    Returns:
+        tuple: (success, center, scale_factor, normalized_points)
+    """
+    pcd = o3d.io.read_point_cloud(input_file)
+    points = np.asarray(pcd.points)
+
+    if len(points) == 0:
+        print(f"警告: {input_file} 是空点云，跳过处理")
+        return False, None, None, None
+
+    normalized = normalize_point_cloud(points)
+    if normalized is None:
+        print("警告: 点云是平面或线性的，无法正常归一化")
+        return False, None, None, None
+    normalized_points, center, scale_factor = normalized
+    return True, center, scale_factor, normalized_points
+
+
+def Process_point_cloud(input_file, target_points=2048, sampling_method='fps', seed=None):
+    """处理单个点云文件
+
+    Args:
+        input_file (str): 输入点云文件路径
+        output_file (str): 输出点云文件路径
+        target_points (int): 采样后的点数
+        sampling_method (str): 采样方法, 'random'、'fps'或'voxel'
+        seed (int, optional): 随机种子, 指定后采样结果可复现
+    """
+    # 读取点云
+    pcd = o3d.io.read_point_cloud(input_file)
+    points = np.asarray(pcd.points)
+
+    # 检查点云是否为空
+    if len(points) == 0:
+        print(f"警告: {input_file} 是空点云，跳过处理")
+        return False
+
+    # 归一化点云
+    normalized = normalize_point_cloud(points)
+    if normalized is None:
+        print("警告: 点云是平面或线性的，无法正常归一化")
+        return points
+    normalized_points, center, scale_factor = normalized
+
+    print("处理前的缩放因子：",scale_factor)
+    # 根据选择的方法对点云进行采样
+    sampled_points = sample_point_cloud(normalized_points, target_points, sampling_method, seed)
 
     # 统计离群点移除
-    cl, ind = pcd_processed.remove_statistical_outlier(nb_neighbors=20, std_ratio=2)
-    pcd_filtered = pcd_processed.select_by_index(ind)
+    pcd_filtered = remove_outliers(sampled_points)
     print("移除离群点后点云点数：", len(pcd_filtered.points))
     # 保存处理后的点云
     # o3d.io.write_point_cloud(output_file, pcd_processed)
@@ -4,57 +4,228 @@
 ###############################################################
 import argparse
 import os
+import json
+import contextlib
 import numpy as np
-import cv2
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import torch
 import open3d as o3d
 
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.join(BASE_DIR, '../'))
 
-from tools import builder
-from utils.config import cfg_from_yaml_file
-from utils import misc
-from datasets.io import IO
 from datasets.data_transforms import Compose
+from utils.torch_ops import install_device_dispatch
+from custom.scheduler import check_deadline
+from custom.metrics import STAGE_SECONDS
 
+# 已加载模型的缓存, 避免每次推理都重新构建模型和读取权重
+_model_cache = {}
+_model_cache_lock = threading.Lock()
 
+# tools/calibrate_queries.py 生成的 查询数-延迟 表, 按文件路径缓存
+_query_calibration_cache = {}
 
-def inference_single(model, pcd, args, config):
-    # if root is not None:
-    #     pc_file = os.path.join(root, pc_path)
-    # else:
-    #     pc_file = pc_path
-    # read single point cloud
-    # pc_ndarray = IO.get(pc_file).astype(np.float32)
-    # transform it according to the model
-    pc_ndarray =pcd
-    
+# 推理精度 -> autocast 的数据类型, fp32 不开启 autocast
+PRECISIONS = {'fp32': None, 'bf16': torch.bfloat16, 'fp16': torch.float16}
+
+# Inference_chunked 在没有 --max_batch_size 时每次提交的点云数
+DEFAULT_CHUNK_SIZE = 8
+
+# 多副本推理池(custom/worker_pool.py), 设置后 Inference/Inference_batch 的前向交给池中负载最低的副本
+_inference_pool = None
+# 推理调度器(custom/scheduler.py), 设置后 Inference/Inference_batch 按优先级和截止时间排队组batch
+_inference_scheduler = None
+# torch.profiler 录制(custom/profiling.py), 设置后本进程接下来的前向在 profiler 中执行
+_profile_capture = None
+# 内存管理器(custom/memory.py), 设置后本进程的前向按batch形状记录内存, OOM 时拆分batch重试
+_memory_manager = None
+
+
+def set_inference_pool(pool):
+    global _inference_pool
+    _inference_pool = pool
+
+
+def set_inference_scheduler(scheduler):
+    global _inference_scheduler
+    _inference_scheduler = scheduler
+
+
+def set_profile_capture(capture):
+    global _profile_capture
+    _profile_capture = capture
+
+
+def set_memory_manager(manager):
+    global _memory_manager
+    _memory_manager = manager
+
+
+def model_op_context(args):
+    """pointnet2_ops 只有CUDA实现, pytorch 后端在CPU上推理时使用纯PyTorch实现
+
+    不再在每次前向时替换模块中的算子(并发的前向会互相覆盖), 而是一次性安装按张量设备分派的算子:
+    CUDA 张量调用原来的 CUDA 算子, 其他张量调用纯PyTorch实现. 安装是幂等的, 加载 CPU 模型时已经安装.
+    """
+    if getattr(args, 'backend', 'pytorch') == 'pytorch' and args.device.lower() == 'cpu':
+        install_device_dispatch()
+    return contextlib.nullcontext()
+
+def precision_context(args, precision=None):
+    """推理上下文: torch.inference_mode, bf16/fp16 时再按设备开启 autocast
+
+    FPS、kNN、three_nn 以及最终的坐标相加在模型内部保持fp32 (utils.misc.fp32_geometry).
+
+    Args:
+        precision (str or None): 'fp32'、'bf16' 或 'fp16', None 时使用 args.precision
+    """
+    precision = precision or getattr(args, 'precision', None) or 'fp32'
+    if precision not in PRECISIONS:
+        raise ValueError(f"不支持的推理精度: {precision}, 可选 {list(PRECISIONS)}")
+    stack = contextlib.ExitStack()
+    stack.enter_context(torch.inference_mode())
+    dtype = PRECISIONS[precision]
+    if dtype is not None:
+        if getattr(args, 'backend', 'pytorch') != 'pytorch':
+            raise ValueError(f"{precision} 推理只支持 pytorch 后端")
+        stack.enter_context(torch.autocast(device_type=torch.device(args.device.lower()).type, dtype=dtype))
+    return stack
+
+def model_stages(model):
+    """模型可以提前结束的阶段, 最后一个是完整输出; 导出的模型(torchscript/onnx)只有完整输出"""
+    return list(getattr(model, 'stages', []))
+
+def query_range(model):
+    """AdaPoinTr 推理时可用的查询数范围 (min, max), 不支持调整查询数的模型返回 None"""
+    if not hasattr(model, 'min_query'):
+        return None
+    return model.min_query, model.num_query
+
+def model_metadata(model):
+    """校验请求参数和 /model_info 用到的模型信息, 可以序列化后在进程间传递"""
+    return {
+        'model': type(model).__name__,
+        'stages': model_stages(model),
+        'query_range': query_range(model),
+    }
+
+def load_query_calibration(path):
+    """读取 tools/calibrate_queries.py 生成的查询数-延迟表
+
+    Returns:
+        dict: 'latency_ms' 为 {查询数: 延迟(ms)}, 其余字段是测量条件(模型、设备、精度等)
+    """
+    with _model_cache_lock:
+        if path not in _query_calibration_cache:
+            with open(path, 'r') as f:
+                calibration = json.load(f)
+            calibration['latency_ms'] = {int(k): float(v) for k, v in calibration['latency_ms'].items()}
+            _query_calibration_cache[path] = calibration
+    return _query_calibration_cache[path]
+
+def select_num_query(calibration, latency_budget_ms):
+    """选择测得延迟不超过预算的最大查询数, 预算小于所有测量值时返回最小的查询数"""
+    latency_ms = calibration['latency_ms']
+    fits = [n for n, ms in latency_ms.items() if ms <= latency_budget_ms]
+    return max(fits) if fits else min(latency_ms)
+
+def resolve_num_query(args, num_query=None, latency_budget_ms=None):
+    """确定本次推理的查询数: 显式指定的查询数优先, 其次按延迟预算在标定表中选择, 都没有时返回 None(使用模型默认值)"""
+    num_query = num_query or getattr(args, 'num_query', None)
+    if num_query is not None:
+        return num_query
+    latency_budget_ms = latency_budget_ms or getattr(args, 'latency_budget_ms', None)
+    if latency_budget_ms is None:
+        return None
+    if not getattr(args, 'query_calibration', None):
+        raise ValueError("按延迟预算选择查询数需要 --query_calibration 标定文件 (tools/calibrate_queries.py)")
+    return select_num_query(load_query_calibration(args.query_calibration), latency_budget_ms)
+
+def _forward_kwargs(model, stop_at=None, num_query=None):
+    # 只有需要时才传 stop_at/num_query, 导出的模型不接受额外参数
+    kwargs = {}
+    if stop_at is not None:
+        if stop_at not in model_stages(model):
+            raise ValueError(f"模型不支持 stop_at={stop_at}, 可选 {model_stages(model)}")
+        kwargs['stop_at'] = stop_at
+    if num_query is not None:
+        limits = query_range(model)
+        if limits is None:
+            raise ValueError("当前模型不支持调整查询数 num_query")
+        if not limits[0] <= num_query <= limits[1]:
+            raise ValueError(f"num_query 应在 [{limits[0]}, {limits[1]}] 范围内, 当前 {num_query}")
+        kwargs['num_query'] = num_query
+    return kwargs
+
+def _model_input(pcd, seed=None):
     # Check if pcd is an Open3D PointCloud object and convert it to numpy array if needed
+    pc_ndarray = pcd
     if isinstance(pc_ndarray, o3d.geometry.PointCloud):
         pc_ndarray = np.asarray(pc_ndarray.points)
-        
+
     transform = Compose([{
         'callback': 'UpSamplePoints',
         'parameters': {
-            'n_points': 2048
+            'n_points': 2048,
+            'seed': seed
         },
         'objects': ['input']
     }, {
         'callback': 'ToTensor',
         'objects': ['input']
     }])
-    
-    pc_ndarray_normalized = transform({'input': pc_ndarray})
-    # inference
-    ret = model(pc_ndarray_normalized['input'].unsqueeze(0).to(args.device.lower()))
-    dense_points = ret[-1].squeeze(0).detach().cpu().numpy()
+    return transform({'input': pc_ndarray})['input']
+
+def _batch_limit(config, max_batch_size=None):
+    # 导出时没有动态batch的模型只能按导出时的batch大小推理
+    if isinstance(config, dict) and not config.get('dynamic_batch', True):
+        return config.get('batch_size', 1), True
+    return max_batch_size, False
 
-    return dense_points
+def inference_batch(model, clouds, args, config, precision=None, stop_at=None, num_query=None, max_batch_size=None,
+                    seed=None):
+    """把多个归一化后的点云拼成batch推理
 
-def Inference(pcd,args):
-    # args = get_args()
+    Args:
+        clouds (list): 归一化后的点云, np.ndarray shape=(N, 3) 或 o3d.geometry.PointCloud, 点数可以不同
+        max_batch_size (int or None): 每次前向的最大点云数, None 表示一次前向处理全部点云
+        seed (int or None): 补齐/截取到模型输入点数时的随机种子
+
+    Returns:
+        list[np.ndarray]: 每个输入对应的补全点云
+    """
+    if len(clouds) == 0:
+        return []
+    kwargs = _forward_kwargs(model, stop_at, num_query)
+    x = torch.stack([_model_input(pcd, seed) for pcd in clouds])
+    batch_size, fixed = _batch_limit(config, max_batch_size)
+    batch_size = batch_size or len(clouds)
+
+    outputs = []
+    with model_op_context(args), precision_context(args, precision):
+        for start in range(0, len(x), batch_size):
+            chunk = x[start:start + batch_size]
+            n_valid = chunk.size(0)
+            if fixed and n_valid < batch_size:
+                # 固定batch的模型用最后一个点云补齐
+                chunk = torch.cat([chunk, chunk[-1:].expand(batch_size - n_valid, -1, -1)])
+            ret = model(chunk.to(args.device.lower()), **kwargs)
+            outputs.extend(ret[-1][:n_valid].float().cpu().numpy())
+    return outputs
+
+def inference_single(model, pcd, args, config, precision=None, stop_at=None, num_query=None, seed=None):
+    return inference_batch(model, [pcd], args, config, precision=precision, stop_at=stop_at, num_query=num_query,
+                           seed=seed)[0]
+
+def _load_pytorch_model(args):
+    # 训练代码(timm, einops, registry, 所有模型)只在 pytorch 后端需要时才导入
+    from tools import builder
+    from utils.config import cfg_from_yaml_file
+    from custom.optimize import optimize_for_inference, quantize_dynamic_int8
 
     # init config
     config = cfg_from_yaml_file(args.model_config)
@@ -63,13 +234,173 @@ def Inference(pcd,args):
     builder.load_model(base_model, args.model_checkpoint)
     base_model.to(args.device.lower())
     base_model.eval()
+    if args.device.lower() == 'cpu':
+        install_device_dispatch()
+    if getattr(args, 'optimize', False):
+        # 权重文件不变, 优化后的模型在加载时派生
+        base_model = optimize_for_inference(base_model)
+    quantize = getattr(args, 'quantize', None)
+    if quantize == 'dynamic-int8':
+        if args.device.lower() != 'cpu':
+            raise ValueError("dynamic-int8 量化只支持CPU推理, 请使用 --device cpu")
+        base_model = quantize_dynamic_int8(base_model)
+    elif quantize is not None:
+        raise ValueError(f"不支持的量化模式: {quantize}")
+    return base_model, config
+
+def _load_torchscript_model(args):
+    # 导出的 TorchScript 文件自带计算图和权重, 不需要模型源码和yaml配置
+    extra_files = {'meta.json': ''}
+    model = torch.jit.load(args.model_artifact, map_location=args.device.lower(), _extra_files=extra_files)
+    model.eval()
+    meta = json.loads(extra_files['meta.json']) if extra_files['meta.json'] else {}
+    traced_device = meta.get('device', args.device.lower())
+    if torch.device(traced_device).type != torch.device(args.device.lower()).type:
+        # trace 时创建张量的设备会被固化在计算图里
+        print(f"警告: {args.model_artifact} 是在 {traced_device} 上导出的, 当前设备 {args.device}, 请在目标设备上重新导出")
+    return model, meta
+
+class OnnxModel(object):
+    """onnxruntime CPU 推理封装, 调用方式与 torch 模型一致: model(xyz) -> tuple(torch.Tensor)
+
+    Args:
+        path (str): tools/export.py --format onnx 导出的文件
+        num_threads (int): intra-op 线程数, 0 表示由 onnxruntime 决定
+        opt_level (str): 图优化级别, 'disable'、'basic'、'extended' 或 'all'
+    """
+    OPT_LEVELS = ['disable', 'basic', 'extended', 'all']
+
+    def __init__(self, path, num_threads=0, opt_level='all'):
+        import onnxruntime as ort
+
+        levels = {
+            'disable': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+            'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+            'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+            'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+        }
+        if opt_level not in levels:
+            raise ValueError(f"不支持的图优化级别: {opt_level}")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = levels[opt_level]
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        custom_meta = self.session.get_modelmeta().custom_metadata_map
+        self.meta = json.loads(custom_meta['meta.json']) if 'meta.json' in custom_meta else {}
+
+    def eval(self):
+        return self
+
+    def __call__(self, xyz):
+        outputs = self.session.run(None, {self.input_name: xyz.detach().cpu().numpy().astype(np.float32)})
+        return tuple(torch.from_numpy(out) for out in outputs)
+
+def _load_onnx_model(args):
+    model = OnnxModel(args.model_artifact,
+                      num_threads=getattr(args, 'ort_threads', 0),
+                      opt_level=getattr(args, 'ort_opt_level', 'all'))
+    return model, model.meta
+
+def load_inference_model(args):
+    """加载推理模型并缓存, 避免每次推理都重新构建模型和读取权重
+
+    Args:
+        args: 需包含 device 和 backend ('pytorch'、'torchscript' 或 'onnx', 默认 'pytorch').
+            pytorch 后端需要 model_config, model_checkpoint, 可选 optimize 表示是否做推理图优化,
+            quantize='dynamic-int8' 表示CPU动态int8量化;
+            torchscript/onnx 后端需要 model_artifact (tools/export.py 导出的文件),
+            onnx 后端可选 ort_threads 和 ort_opt_level
+
+    Returns:
+        tuple: (model, config), torchscript/onnx 后端的 config 是导出时写入的元信息
+    """
+    backend = getattr(args, 'backend', 'pytorch')
+    if backend == 'pytorch':
+        key = (backend, args.model_config, args.model_checkpoint, args.device.lower(),
+               getattr(args, 'optimize', False), getattr(args, 'quantize', None))
+        loader = _load_pytorch_model
+    elif backend == 'torchscript':
+        key = (backend, args.model_artifact, args.device.lower())
+        loader = _load_torchscript_model
+    elif backend == 'onnx':
+        key = (backend, args.model_artifact, getattr(args, 'ort_threads', 0), getattr(args, 'ort_opt_level', 'all'))
+        loader = _load_onnx_model
+    else:
+        raise ValueError(f"不支持的推理后端: {backend}")
+
+    with _model_cache_lock:
+        if key not in _model_cache:
+            _model_cache[key] = loader(args)
+    return _model_cache[key]
+
+def Inference(pcd,args,precision=None,stop_at=None,num_query=None,latency_budget_ms=None,seed=None,
+              priority=None,deadline=None):
+    return Inference_batch([pcd], args, precision=precision, stop_at=stop_at, num_query=num_query,
+                           latency_budget_ms=latency_budget_ms, seed=seed, priority=priority, deadline=deadline)[0]
+
+def Inference_batch(clouds,args,precision=None,stop_at=None,num_query=None,latency_budget_ms=None,seed=None,
+                    priority=None,deadline=None):
+    """与 Inference 相同, 但一次前向处理多个归一化后的点云, 返回补全点云列表
+
+    priority ('interactive'/'bulk') 和 deadline (time.monotonic() 的绝对时间) 用于推理调度器排队,
+    前向开始前已超过截止时间时抛出 DeadlineExceeded.
+    """
+    stop_at = stop_at or getattr(args, 'stop_at', None)
+    num_query = resolve_num_query(args, num_query, latency_budget_ms)
+    if _inference_scheduler is not None:
+        return _inference_scheduler.run(clouds, (precision, stop_at, num_query, seed), priority, deadline)
+    check_deadline(deadline)
+    return forward_batch(clouds, args, precision, stop_at, num_query, seed)
+
+def Inference_chunked(clouds, args, chunk_size=None, **options):
+    """把大量点云(分块、多物体)按 chunk_size 拆成多次 Inference_batch, 返回与 clouds 对应的补全点云列表
+
+    每份作为单独的任务提交, 单次前向的内存有上限; 使用多副本推理池时同时提交, 由不同副本并行处理.
+
+    Args:
+        chunk_size (int, optional): 每次提交的点云数, 默认取 --max_batch_size, 没有时为 DEFAULT_CHUNK_SIZE
+        options: 透传给 Inference_batch 的参数
+    """
+    chunk_size = chunk_size or getattr(args, 'max_batch_size', None) or DEFAULT_CHUNK_SIZE
+    chunks = [clouds[i:i + chunk_size] for i in range(0, len(clouds), chunk_size)]
+    workers = len(_inference_pool.replicas) if _inference_pool is not None else 1
+    if len(chunks) <= 1 or workers <= 1:
+        return [out for chunk in chunks for out in Inference_batch(chunk, args, **options)]
+    with ThreadPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+        outputs = list(executor.map(lambda chunk: Inference_batch(chunk, args, **options), chunks))
+    return [out for chunk_outputs in outputs for out in chunk_outputs]
+
+def forward_batch(clouds, args, precision=None, stop_at=None, num_query=None, seed=None):
+    """直接执行前向(多副本推理池或本进程的模型), 不经过调度器, stop_at/num_query 已解析"""
+    with STAGE_SECONDS.time(stage='forward'):
+        return _forward_batch(clouds, args, precision, stop_at, num_query, seed)
+
+def _forward_batch(clouds, args, precision, stop_at, num_query, seed):
+    if _inference_pool is not None:
+        # Open3D 点云对象不能跨进程传递, 只传坐标
+        clouds = [np.asarray(pcd.points) if isinstance(pcd, o3d.geometry.PointCloud) else np.asarray(pcd)
+                  for pcd in clouds]
+        return _inference_pool.run(clouds, precision=precision, stop_at=stop_at, num_query=num_query, seed=seed)
+
+    base_model, config = load_inference_model(args)
 
-    pcd = inference_single(base_model, pcd, args, config)
+    def forward(clouds):
+        capture = _profile_capture
+        with capture.record(base_model) if capture is not None else contextlib.nullcontext():
+            return inference_batch(base_model, clouds, args, config, precision=precision, stop_at=stop_at,
+                                   num_query=num_query, max_batch_size=getattr(args, 'max_batch_size', None),
+                                   seed=seed)
 
-    return pcd
+    if _memory_manager is None:
+        return forward(clouds)
+    return _memory_manager.run(forward, clouds, f'{precision or "default"}/{stop_at or "full"}/{num_query or "default"}')
 
 
 def main():
+    from tools import builder
+    from utils.config import cfg_from_yaml_file
     args = get_args()
 
     # init config
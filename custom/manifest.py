@@ -0,0 +1,59 @@
+import json
+import os
+import threading
+import time
+
+MANIFEST_NAME = '.completion_manifest.jsonl'
+
+
+class FolderManifest(object):
+    """输出文件夹中的追加式处理清单, 每处理完一个文件追加一行 JSON
+
+    每行记录输入文件的 sha256、参数摘要、输出路径及大小、状态和各阶段耗时, 同一文件以最后一行为准.
+    重新运行同一文件夹时, 输入、参数都没变且输出文件仍然完整的文件可以跳过, 进程中途退出后也能从断点继续.
+    """
+    def __init__(self, output_folder, name=MANIFEST_NAME):
+        self.path = os.path.join(output_folder, name)
+        self._lock = threading.Lock()
+        self._records = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 进程退出时可能留下写了一半的最后一行
+                        continue
+                    self._records[record['file']] = record
+
+    def is_done(self, filename, input_digest, params_digest, output_path):
+        """该文件是否已用相同的输入和参数成功处理, 且输出文件仍然存在、大小与记录一致"""
+        record = self._records.get(filename)
+        if record is None or record.get('status') != 'success':
+            return False
+        if record.get('input_sha256') != input_digest or record.get('params') != params_digest:
+            return False
+        if record.get('output_path') != output_path or not os.path.exists(output_path):
+            return False
+        return os.path.getsize(output_path) == record.get('output_size')
+
+    def append(self, filename, input_digest, params_digest, output_path, status, timings=None, error=None):
+        record = {
+            'file': filename,
+            'input_sha256': input_digest,
+            'params': params_digest,
+            'output_path': output_path,
+            'output_size': os.path.getsize(output_path) if status == 'success' else None,
+            'status': status,
+            'timings': timings or {},
+            'time': time.time(),
+        }
+        if error is not None:
+            record['error'] = error
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._records[filename] = record
+        return record
@@ -0,0 +1,181 @@
+import gc
+import threading
+import time
+from contextlib import contextmanager
+
+import torch
+
+from custom.metrics import STAGE_SECONDS, process_rss_bytes
+
+# 释放缓存的策略: adaptive 只在空闲显存低于水位或 OOM 后释放, always 每个请求后都释放(原来的行为, 用于对比)
+MEMORY_POLICIES = ['adaptive', 'always']
+
+
+def is_oom(e):
+    # torch.cuda.OutOfMemoryError 在较新的 torch 中才有, 旧版本是带 "out of memory" 的 RuntimeError
+    oom_type = getattr(torch.cuda, 'OutOfMemoryError', None)
+    if oom_type is not None and isinstance(e, oom_type):
+        return True
+    return isinstance(e, RuntimeError) and 'out of memory' in str(e)
+
+
+class MemoryManager(object):
+    """推理内存管理: 按batch形状记录内存占用, 按需释放 CUDA 缓存分配器的缓存
+
+    - CUDA 设备上记录每种batch形状的峰值已分配显存和预留显存; 每个请求结束后只有设备空闲显存低于 watermark
+      且分配器还缓存着未使用的显存时才 gc.collect() + empty_cache(), 其他时候缓存留给下一次前向复用
+    - 前向 OOM 时释放缓存并把batch对半拆开重试, 单个点云仍然 OOM 时抛出
+    - CPU 上没有缓存可释放, 记录每种batch形状前向后的进程 RSS 及前向期间的增长
+    - 每次释放的耗时(gc、empty_cache 分开)计入 stats 和 /metrics 的 memory_release 阶段; always 策略下即为原来每个
+      请求都释放的延迟开销. adaptive 策略下平时很少释放, 每 sample_every 个没有释放的请求抽样释放一次(原因为 sample)
+      测得释放耗时, 再按平均释放耗时估计省下的时间
+
+    Args:
+        device (str): 推理设备
+        watermark (float): 设备空闲显存占总显存的比例低于该值时释放缓存
+        policy (str): 'adaptive' 或 'always'
+        sample_every (int): adaptive 策略下每隔多少个没有释放的请求抽样释放一次, 0 表示不抽样
+    """
+    def __init__(self, device, watermark=0.1, policy='adaptive', sample_every=50):
+        if policy not in MEMORY_POLICIES:
+            raise ValueError(f"不支持的内存策略: {policy}, 可选 {MEMORY_POLICIES}")
+        self.device = torch.device(device.lower())
+        self.cuda = self.device.type == 'cuda' and torch.cuda.is_available()
+        self.watermark = watermark
+        self.policy = policy
+        self.sample_every = sample_every
+        self._skipped = 0
+        self._lock = threading.Lock()
+        self._shapes = {}
+        self._stats = {'requests': 0, 'ooms': 0, 'oom_splits': 0}
+        self._releases = {}
+        self._release_ms = {'gc': 0.0, 'empty_cache': 0.0}
+
+    def _record(self, shape, elapsed_ms, **memory):
+        with self._lock:
+            entry = self._shapes.setdefault(shape, {'batches': 0, 'total_ms': 0.0})
+            entry['batches'] += 1
+            entry['total_ms'] += elapsed_ms
+            for name, mb in memory.items():
+                # 峰值和增长取最大值, 其余(预留显存、RSS)取最近一次
+                if name.startswith('peak') or name.endswith('growth_mb'):
+                    entry[name] = max(entry.get(name, 0.0), mb)
+                else:
+                    entry[name] = mb
+
+    @contextmanager
+    def track(self, shape):
+        """记录一次前向的内存占用, shape 是batch形状的描述(点云数和推理参数)"""
+        if self.cuda:
+            # 并发前向时峰值包含同时在跑的其他前向
+            torch.cuda.reset_peak_memory_stats(self.device)
+        else:
+            rss = process_rss_bytes()
+        start = time.perf_counter()
+        yield
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if self.cuda:
+            self._record(shape, elapsed_ms,
+                         peak_allocated_mb=torch.cuda.max_memory_allocated(self.device) / 1024 / 1024,
+                         reserved_mb=torch.cuda.memory_reserved(self.device) / 1024 / 1024)
+        else:
+            after = process_rss_bytes()
+            self._record(shape, elapsed_ms, rss_mb=after / 1024 / 1024,
+                         rss_growth_mb=max(0, after - rss) / 1024 / 1024)
+
+    def run(self, forward, clouds, key=''):
+        """执行 forward(clouds), OOM 时释放缓存并把batch拆成两半分别重试
+
+        Args:
+            forward (callable): forward(clouds) 返回与 clouds 对应的输出列表
+            key (str): 推理参数的描述, 与点云数一起作为batch形状
+        """
+        try:
+            with self.track(f'{len(clouds)}x {key}'.strip()):
+                return forward(clouds)
+        except Exception as e:
+            if not is_oom(e):
+                raise
+            with self._lock:
+                self._stats['ooms'] += 1
+            if len(clouds) <= 1:
+                self.release('oom')
+                raise
+        # 离开 except 块后异常的 traceback 不再引用前向中的张量, 释放才有效
+        self.release('oom')
+        with self._lock:
+            self._stats['oom_splits'] += 1
+        half = len(clouds) // 2
+        return self.run(forward, clouds[:half], key) + self.run(forward, clouds[half:], key)
+
+    def release(self, reason):
+        """gc.collect() + empty_cache(), 按原因计数并记录耗时"""
+        start = time.perf_counter()
+        gc.collect()
+        gc_ms = (time.perf_counter() - start) * 1000
+        if self.cuda:
+            torch.cuda.empty_cache()
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage='memory_release')
+        with self._lock:
+            self._releases[reason] = self._releases.get(reason, 0) + 1
+            self._release_ms['gc'] += gc_ms
+            self._release_ms['empty_cache'] += elapsed * 1000 - gc_ms
+
+    def below_watermark(self):
+        """设备空闲显存低于水位, 且分配器缓存着可以还给设备的显存"""
+        if not self.cuda:
+            return False
+        free, total = torch.cuda.mem_get_info(self.device)
+        cached = torch.cuda.memory_reserved(self.device) - torch.cuda.memory_allocated(self.device)
+        return free < self.watermark * total and cached > 0
+
+    def after_request(self):
+        """每个请求(文件)结束后调用, 代替原来无条件的 empty_cache + gc.collect"""
+        with self._lock:
+            self._stats['requests'] += 1
+        if self.policy == 'always':
+            self.release('request')
+        elif self.below_watermark():
+            self.release('watermark')
+        elif self.cuda and self.sample_every:
+            with self._lock:
+                self._skipped += 1
+                sample = self._skipped % self.sample_every == 0
+            if sample:
+                self.release('sample')
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            releases = dict(self._releases)
+            release_ms = dict(self._release_ms)
+            shapes = {shape: dict(entry) for shape, entry in self._shapes.items()}
+        for entry in shapes.values():
+            entry['mean_ms'] = round(entry.pop('total_ms') / entry['batches'], 2)
+            for name, value in entry.items():
+                if name.endswith('_mb'):
+                    entry[name] = round(value, 1)
+        count = sum(releases.values())
+        mean_ms = (release_ms['gc'] + release_ms['empty_cache']) / count if count else None
+        # 原来只在有 CUDA 时每个请求都释放; 请求结束后因任何原因释放过的不算省下
+        released = sum(releases.get(reason, 0) for reason in ('request', 'watermark', 'sample'))
+        skipped = stats['requests'] - released if self.cuda else 0
+        stats.update({
+            'device': str(self.device),
+            'policy': self.policy,
+            'watermark': self.watermark,
+            'sample_every': self.sample_every,
+            'shapes': shapes,
+            'releases': releases,
+            'release_ms': {name: round(ms, 2) for name, ms in release_ms.items()},
+            'mean_release_ms': round(mean_ms, 2) if mean_ms is not None else None,
+            # 没有释放的请求按平均释放耗时估计省下的延迟
+            'skipped_releases': skipped,
+            'estimated_saved_ms': round(skipped * mean_ms, 2) if mean_ms is not None else None,
+        })
+        if self.cuda:
+            stats['allocated_mb'] = round(torch.cuda.memory_allocated(self.device) / 1024 / 1024, 1)
+            stats['reserved_mb'] = round(torch.cuda.memory_reserved(self.device) / 1024 / 1024, 1)
+        stats['rss_mb'] = round(process_rss_bytes() / 1024 / 1024, 1)
+        return stats
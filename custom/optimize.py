@@ -0,0 +1,288 @@
+import torch
+import torch.nn as nn
+
+
+def _fuse_bn_weights(weight, bias, bn):
+    """计算把 BatchNorm 折叠进前一层后的权重和偏置
+
+    Args:
+        weight (torch.Tensor): 前一层权重, 第0维是输出通道
+        bias (torch.Tensor or None): 前一层偏置
+        bn (nn.modules.batchnorm._BatchNorm): eval模式下的BN层
+
+    Returns:
+        tuple: (fused_weight, fused_bias)
+    """
+    # eval模式下 BN 是一个逐通道的仿射变换: y = (x - mean) / sqrt(var + eps) * gamma + beta
+    std = torch.sqrt(bn.running_var + bn.eps)
+    gamma = bn.weight if bn.affine else torch.ones_like(std)
+    beta = bn.bias if bn.affine else torch.zeros_like(std)
+    if bias is None:
+        bias = torch.zeros_like(bn.running_mean)
+
+    scale = gamma / std
+    fused_weight = weight * scale.reshape([-1] + [1] * (weight.dim() - 1))
+    fused_bias = (bias - bn.running_mean) * scale + beta
+    return fused_weight, fused_bias
+
+
+def _can_fuse(layer, bn):
+    if not isinstance(bn, (nn.BatchNorm1d, nn.BatchNorm2d)):
+        return False
+    if not bn.track_running_stats or bn.running_mean is None:
+        # 没有统计量的BN在eval时仍使用batch统计, 无法折叠
+        return False
+    if isinstance(layer, nn.Linear):
+        return isinstance(bn, nn.BatchNorm1d)
+    if isinstance(layer, nn.Conv1d):
+        return isinstance(bn, nn.BatchNorm1d) and layer.groups == 1
+    if isinstance(layer, nn.Conv2d):
+        return isinstance(bn, nn.BatchNorm2d) and layer.groups == 1
+    return False
+
+
+@torch.no_grad()
+def _fuse_into(layer, bn):
+    weight, bias = _fuse_bn_weights(layer.weight, layer.bias, bn)
+    layer.weight.copy_(weight)
+    if layer.bias is None:
+        layer.bias = nn.Parameter(bias)
+    else:
+        layer.bias.copy_(bias)
+
+
+def fold_batchnorm(model):
+    """把 BatchNorm 折叠进前面的 Conv1d/Conv2d/Linear
+
+    支持两种结构:
+        1. nn.Sequential 中紧跟在卷积/全连接层后面的 BN
+        2. SnowFlakeNet 中带 conv/bn/if_bn 属性的 Conv1d/Conv2d 封装
+
+    Returns:
+        int: 折叠的BN层数量
+    """
+    n_folded = 0
+    for module in model.modules():
+        if isinstance(module, nn.Sequential):
+            for i in range(len(module) - 1):
+                if _can_fuse(module[i], module[i + 1]):
+                    _fuse_into(module[i], module[i + 1])
+                    module[i + 1] = nn.Identity()
+                    n_folded += 1
+        elif hasattr(module, 'conv') and hasattr(module, 'bn') and getattr(module, 'if_bn', False):
+            if _can_fuse(module.conv, module.bn):
+                _fuse_into(module.conv, module.bn)
+                module.if_bn = False
+                module.bn = nn.Identity()
+                n_folded += 1
+    return n_folded
+
+
+def _is_pointwise(layer):
+    if isinstance(layer, nn.Linear):
+        return True
+    if isinstance(layer, (nn.Conv1d, nn.Conv2d)):
+        return (layer.groups == 1
+                and all(k == 1 for k in layer.kernel_size)
+                and all(s == 1 for s in layer.stride)
+                and all(d == 1 for d in layer.dilation)
+                and all(p == 0 for p in layer.padding)
+                and layer.padding_mode == 'zeros')
+    return False
+
+
+@torch.no_grad()
+def _merge_pair(first, second):
+    """合并两个中间没有非线性的逐点层: y = W2 (W1 x + b1) + b2"""
+    w1 = first.weight.reshape(first.weight.size(0), -1)
+    w2 = second.weight.reshape(second.weight.size(0), -1)
+    weight = w2 @ w1
+    bias = second.bias.clone() if second.bias is not None else torch.zeros(w2.size(0), device=w2.device, dtype=w2.dtype)
+    if first.bias is not None:
+        bias += w2 @ first.bias
+
+    if isinstance(first, nn.Linear):
+        merged = nn.Linear(w1.size(1), w2.size(0))
+    else:
+        merged = type(first)(w1.size(1), w2.size(0), 1)
+    merged = merged.to(device=w1.device, dtype=w1.dtype)
+    merged.weight.copy_(weight.reshape(merged.weight.shape))
+    merged.bias.copy_(bias)
+    return merged
+
+
+def _worth_merging(first, second):
+    # 只有在合并后计算量不增加时才合并, 避免破坏瓶颈结构
+    c_in = first.weight.reshape(first.weight.size(0), -1).size(1)
+    c_mid = first.weight.size(0)
+    c_out = second.weight.size(0)
+    return c_in * c_out <= c_mid * (c_in + c_out)
+
+
+def simplify_sequentials(model):
+    """去掉 nn.Sequential 里的 Identity, 并合并相邻的 1x1 卷积/全连接层
+
+    Returns:
+        int: 合并的层对数量
+    """
+    n_merged = 0
+    for module in list(model.modules()):
+        if not isinstance(module, nn.Sequential):
+            continue
+        layers = [m for m in module if not isinstance(m, nn.Identity)]
+        if not layers:
+            continue
+        merged = [layers[0]]
+        for layer in layers[1:]:
+            prev = merged[-1]
+            if (type(prev) is type(layer) and _is_pointwise(prev) and _is_pointwise(layer)
+                    and _worth_merging(prev, layer)):
+                merged[-1] = _merge_pair(prev, layer)
+                n_merged += 1
+            else:
+                merged.append(layer)
+        if len(merged) != len(module):
+            for key in list(module._modules.keys()):
+                del module._modules[key]
+            for i, layer in enumerate(merged):
+                module.add_module(str(i), layer)
+    return n_merged
+
+
+def remove_dropout(model):
+    """把 Dropout/DropPath 替换成 Identity (eval时二者本来就是恒等映射)
+
+    Returns:
+        int: 替换的层数量
+    """
+    n_removed = 0
+    for module in list(model.modules()):
+        for name, child in list(module.named_children()):
+            if isinstance(child, nn.modules.dropout._DropoutNd) or type(child).__name__ == 'DropPath':
+                setattr(module, name, nn.Identity())
+                n_removed += 1
+    return n_removed
+
+
+class PrecomputedFold(nn.Module):
+    """推理用的 Fold, 预先计算与输入无关的 folding_seed 分支
+
+    Fold 第一层卷积的输入是 cat([seed, features]), 其中 seed 是常量, features 在所有
+    S 个折叠点上是同一个向量. 因此可以拆成:
+        W @ cat([seed, f]) + b = (W_seed @ seed + b) + W_feat @ f
+    前一项只需计算一次并保存为buffer, 后一项每个样本只需计算一次而不是 S 次.
+    folding2 的 features 分支同理.
+    """
+    def __init__(self, fold):
+        super().__init__()
+        self.in_channel = fold.in_channel
+        self.step = fold.step
+        num_sample = self.step * self.step
+
+        with torch.no_grad():
+            conv1 = fold.folding1[0]
+            w1 = conv1.weight.squeeze(-1)  # H, 2 + C
+            b1 = conv1.bias if conv1.bias is not None else torch.zeros(w1.size(0), device=w1.device)
+            seed = fold.folding_seed.view(2, num_sample).to(w1)
+            self.register_buffer('seed_term', (w1[:, :2] @ seed + b1.unsqueeze(-1)).unsqueeze(0), persistent=False)  # 1 H S
+            self.feat1 = nn.Linear(self.in_channel, w1.size(0), bias=False).to(w1)
+            self.feat1.weight.copy_(w1[:, 2:])
+
+            conv2 = fold.folding2[0]
+            w2 = conv2.weight.squeeze(-1)  # H, 3 + C
+            self.point2 = nn.Conv1d(3, w2.size(0), 1).to(w2)
+            self.point2.weight.copy_(w2[:, :3].unsqueeze(-1))
+            if conv2.bias is not None:
+                self.point2.bias.copy_(conv2.bias)
+            else:
+                self.point2.bias.zero_()
+            self.feat2 = nn.Linear(self.in_channel, w2.size(0), bias=False).to(w2)
+            self.feat2.weight.copy_(w2[:, 3:])
+
+        self.folding1 = nn.Sequential(*list(fold.folding1)[1:])
+        self.folding2 = nn.Sequential(*list(fold.folding2)[1:])
+
+    def forward(self, x):
+        bs = x.size(0)
+        x = x.view(bs, self.in_channel)
+        fd1 = self.folding1(self.seed_term + self.feat1(x).unsqueeze(-1))
+        fd2 = self.folding2(self.point2(fd1) + self.feat2(x).unsqueeze(-1))
+
+        return fd2
+
+
+def _is_fold(module):
+    return (type(module).__name__ == 'Fold'
+            and all(hasattr(module, attr) for attr in ['folding_seed', 'folding1', 'folding2', 'step', 'in_channel'])
+            and isinstance(module.folding1[0], nn.Conv1d)
+            and isinstance(module.folding2[0], nn.Conv1d))
+
+
+def precompute_folds(model):
+    """把模型中的 Fold 替换为 PrecomputedFold
+
+    Returns:
+        int: 替换的 Fold 数量
+    """
+    n_replaced = 0
+    for module in list(model.modules()):
+        for name, child in list(module.named_children()):
+            if _is_fold(child):
+                setattr(module, name, PrecomputedFold(child))
+                n_replaced += 1
+    return n_replaced
+
+
+def optimize_for_inference(model, verbose=True):
+    """推理图优化: 折叠BN, 预计算常量, 去掉 Dropout/DropPath, 合并相邻的 1x1 层
+
+    只改变模型结构而不改变权重文件, 需要在 load_model 之后调用. 优化后的模型只能用于推理.
+
+    Args:
+        model (nn.Module): 已加载权重的模型
+        verbose (bool): 是否打印优化统计
+
+    Returns:
+        nn.Module: 原地优化后的模型
+    """
+    model.eval()
+
+    n_bn = fold_batchnorm(model)
+    n_fold = precompute_folds(model)
+    n_dropout = remove_dropout(model)
+    n_merged = simplify_sequentials(model)
+
+    for param in model.parameters():
+        param.requires_grad_(False)
+
+    if verbose:
+        print(f"推理优化: 折叠BN {n_bn} 个, 预计算Fold {n_fold} 个, 移除Dropout/DropPath {n_dropout} 个, 合并1x1层 {n_merged} 对")
+    return model
+
+
+def quantize_dynamic_int8(model, verbose=True):
+    """CPU推理的动态int8量化: nn.Linear 的权重量化为int8, 激活在运行时动态量化
+
+    直接作用在坐标上的全连接层(输入维度<=3, 如 pos_embed 和 query_ranking 的第一层)保持float,
+    FPS/kNN 等点操作不受影响. 量化后的模型只能在CPU上运行.
+
+    Args:
+        model (nn.Module): 已加载权重的模型, 需在CPU上
+        verbose (bool): 是否打印量化统计
+
+    Returns:
+        nn.Module: 量化后的模型
+    """
+    try:
+        from torch.ao.quantization import quantize_dynamic
+    except ImportError:
+        from torch.quantization import quantize_dynamic
+
+    model.eval()
+    targets = set(name for name, module in model.named_modules()
+                  if isinstance(module, nn.Linear) and module.in_features > 3)
+    model = quantize_dynamic(model, qconfig_spec=targets, dtype=torch.qint8, inplace=True)
+
+    if verbose:
+        print(f"动态int8量化: 量化 nn.Linear {len(targets)} 个")
+    return model
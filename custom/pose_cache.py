@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+# 描述子中径向距离直方图的分箱
+_RADIAL_BINS = np.linspace(0, 3, 17)
+
+
+def canonical_frame(points):
+    """PCA 规范化坐标系
+
+    以质心为原点, 主轴按特征值从大到小排列, 每个轴的方向取三阶矩为正的一侧, 并保证是右手系(纯旋转).
+    尺度取到质心的均方根距离, 与姿态无关(归一化时的包围盒尺度会随旋转变化).
+
+    Args:
+        points (np.ndarray): 点云 shape=(N, 3)
+
+    Returns:
+        tuple: (center, rotation, scale), 规范坐标为 (points - center) @ rotation / scale
+    """
+    center = points.mean(axis=0)
+    centered = points - center
+    eigvals, eigvecs = np.linalg.eigh(centered.T @ centered / len(points))
+    rotation = eigvecs[:, np.argsort(eigvals)[::-1]]
+    skew = np.sum((centered @ rotation) ** 3, axis=0)
+    rotation = rotation * np.where(skew < 0, -1.0, 1.0)
+    if np.linalg.det(rotation) < 0:
+        rotation[:, 2] = -rotation[:, 2]
+    scale = np.sqrt(np.mean(np.sum(centered ** 2, axis=1)))
+    return center, rotation, max(scale, 1e-12)
+
+
+def shape_descriptor(canonical_points):
+    """与姿态无关的形状描述子: 主轴方差比例 + 径向距离直方图"""
+    variances = np.var(canonical_points, axis=0)
+    radial = np.linalg.norm(canonical_points, axis=1)
+    hist, _ = np.histogram(radial, bins=_RADIAL_BINS)
+    return np.concatenate([variances / max(variances.sum(), 1e-12), hist / max(len(radial), 1)])
+
+
+def chamfer_distance(a, b):
+    """对称的 L1 Chamfer 距离(最近邻欧氏距离的均值)"""
+    da, _ = cKDTree(b).query(a)
+    db, _ = cKDTree(a).query(b)
+    return (da.mean() + db.mean()) / 2
+
+
+class PoseCache(object):
+    """姿态规范化缓存: 复用同一物体在其他刚体姿态下的补全结果
+
+    每个预处理后的点云变换到 PCA 规范坐标系, 按形状描述子查找容差内的已补全形状,
+    再在子采样点上做 Chamfer 校验, 通过后把缓存的规范坐标补全结果按当前点云的刚体变换映射回去.
+    不同请求参数(模型、精度、查询数等)的结果互不复用.
+    """
+    def __init__(self, max_entries=1024, descriptor_tol=0.05, chamfer_tol=0.02, verify_points=256):
+        self.max_entries = max_entries
+        self.descriptor_tol = descriptor_tol
+        self.chamfer_tol = chamfer_tol
+        self.verify_points = verify_points
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # id -> (params_key, descriptor, canonical subsample, canonical output, latency_ms)
+        self._next_id = 0
+        self._stats = {'lookups': 0, 'hits': 0, 'rejected': 0, 'misses': 0, 'saved_ms': 0.0, 'lookup_ms': 0.0}
+
+    def _canonicalize(self, points):
+        center, rotation, scale = canonical_frame(points)
+        canonical = (points - center) @ rotation / scale
+        # 子采样使用固定步长, 同一点云每次得到相同的子集
+        step = max(1, len(canonical) // self.verify_points)
+        return (center, rotation, scale), canonical, shape_descriptor(canonical), canonical[::step][:self.verify_points]
+
+    def lookup(self, params_key, points):
+        """查找可复用的补全结果
+
+        Args:
+            params_key (str): 请求参数的摘要
+            points (np.ndarray): 预处理后(归一化+采样)的输入点云 shape=(N, 3)
+
+        Returns:
+            tuple: (output, token). 命中时 output 为映射到当前姿态的补全结果, 否则为 None;
+                token 传给 put 以免重复计算规范坐标系
+        """
+        start = time.perf_counter()
+        frame, _, descriptor, subsample = token = self._canonicalize(points)
+        with self._lock:
+            candidates = [(np.linalg.norm(entry[1] - descriptor), key, entry)
+                          for key, entry in self._entries.items() if entry[0] == params_key]
+        candidates = sorted(c for c in candidates if c[0] <= self.descriptor_tol)
+
+        output, rejected = None, 0
+        for _, key, entry in candidates[:4]:
+            if chamfer_distance(subsample, entry[2]) <= self.chamfer_tol:
+                center, rotation, scale = frame
+                output = entry[3] * scale @ rotation.T + center
+                break
+            rejected += 1
+
+        with self._lock:
+            self._stats['lookups'] += 1
+            self._stats['rejected'] += rejected
+            self._stats['lookup_ms'] += (time.perf_counter() - start) * 1000
+            if output is None:
+                self._stats['misses'] += 1
+            else:
+                self._stats['hits'] += 1
+                self._stats['saved_ms'] += entry[4]
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+        return output, token
+
+    def put(self, params_key, token, output, latency_ms):
+        """保存补全结果(归一化坐标), latency_ms 为本次推理的耗时, 命中时计入节省的延迟"""
+        (center, rotation, scale), _, descriptor, subsample = token
+        canonical_output = (np.asarray(output) - center) @ rotation / scale
+        with self._lock:
+            self._entries[self._next_id] = (params_key, descriptor, subsample, canonical_output, latency_ms)
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['lookups']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        # 命中节省的推理时间减去所有查找(含未命中)的开销
+        stats['net_saved_ms'] = stats['saved_ms'] - stats['lookup_ms']
+        return stats
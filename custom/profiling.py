@@ -0,0 +1,178 @@
+import contextlib
+import json
+import os
+import threading
+
+import torch
+from torch.autograd import DeviceType
+from torch.profiler import ProfilerActivity, profile, record_function
+
+# 汇总表按这些子模块(named_modules 的最后一级名字)分组, 不在其中的算子归入 other
+SUBMODULES = ('grouper', 'encoder', 'decoder', 'decode_head')
+_RANGE_PREFIX = 'submodule::'
+
+
+def _event_value(event, *names):
+    # 不同 torch 版本的字段名不同(self_cuda_* 后来改为 self_device_*), 取第一个存在的
+    for name in names:
+        value = getattr(event, name, None)
+        if value is not None:
+            return value
+    return 0
+
+
+@contextlib.contextmanager
+def label_submodules(model, names=SUBMODULES):
+    """前向期间用 record_function 区间标记指定的子模块, profiler 中区间内的算子归到该子模块
+
+    导出的模型(torchscript/onnx)不支持 forward hook, 不做标记.
+    """
+    handles = []
+    if isinstance(model, torch.nn.Module) and not isinstance(model, torch.jit.ScriptModule):
+        for path, module in model.named_modules():
+            name = path.rsplit('.', 1)[-1]
+            if name not in names:
+                continue
+            ranges = []
+
+            def enter(module, inputs, name=name, ranges=ranges):
+                ranges.append(record_function(_RANGE_PREFIX + name).__enter__())
+
+            def leave(module, inputs, output, ranges=ranges):
+                ranges.pop().__exit__(None, None, None)
+
+            handles.append(module.register_forward_pre_hook(enter))
+            handles.append(module.register_forward_hook(leave))
+    try:
+        yield
+    finally:
+        for handle in handles:
+            handle.remove()
+
+
+def _submodule(event):
+    parent = event.cpu_parent
+    while parent is not None:
+        if parent.name.startswith(_RANGE_PREFIX):
+            return parent.name[len(_RANGE_PREFIX):]
+        parent = parent.cpu_parent
+    return 'other'
+
+
+class ProfileCapture(object):
+    """用 torch.profiler 录制接下来 num_requests 次模型前向(含调用栈和内存)
+
+    每次前向写出一个 Chrome trace (request_<i>.trace.json, 可用 chrome://tracing 或 Perfetto 打开),
+    录满后写出按子模块分组的算子汇总: summary.txt 为各子模块按自身耗时排序的前 row_limit 个算子, summary.json
+    为同样的数据. 录制期间的前向依次执行, 避免并发请求的算子混入同一份 trace; 录满后不再有额外开销.
+
+    Args:
+        output_dir (str): 输出目录
+        num_requests (int): 录制的前向次数, 调度器拼成的一个batch算一次
+        row_limit (int): 汇总表中每个子模块列出的算子数
+    """
+    def __init__(self, output_dir, num_requests=1, row_limit=15):
+        self.output_dir = output_dir
+        self.num_requests = num_requests
+        self.row_limit = row_limit
+        self.captured = 0
+        self.traces = []
+        self.summary_path = None
+        self._device = torch.cuda.is_available()
+        # (子模块, 算子) -> [调用次数, 自身CPU耗时(us), 自身CUDA耗时(us), 自身CPU内存(B), 自身CUDA内存(B)]
+        self._ops = {}
+        self._lock = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+
+    @property
+    def done(self):
+        return self.captured >= self.num_requests
+
+    def record(self, model):
+        """包住一次前向, 已录满时什么也不做"""
+        if self.done:
+            return contextlib.nullcontext()
+        return self._record(model)
+
+    @contextlib.contextmanager
+    def _record(self, model):
+        with self._lock:
+            if self.done:
+                # 等锁期间其他前向已经录满
+                yield
+                return
+            activities = [ProfilerActivity.CPU] + ([ProfilerActivity.CUDA] if self._device else [])
+            with label_submodules(model), profile(activities=activities, record_shapes=True, profile_memory=True,
+                                                  with_stack=True) as prof:
+                yield
+            self._collect(prof)
+
+    def _collect(self, prof):
+        trace = os.path.join(self.output_dir, f'request_{self.captured}.trace.json')
+        prof.export_chrome_trace(trace)
+        self.traces.append(trace)
+        for event in prof.events():
+            if event.device_type != DeviceType.CPU or event.name.startswith(_RANGE_PREFIX):
+                continue
+            row = self._ops.setdefault((_submodule(event), event.name), [0, 0.0, 0.0, 0, 0])
+            row[0] += 1
+            row[1] += event.self_cpu_time_total
+            row[2] += _event_value(event, 'self_device_time_total', 'self_cuda_time_total')
+            row[3] += _event_value(event, 'self_cpu_memory_usage')
+            row[4] += _event_value(event, 'self_device_memory_usage', 'self_cuda_memory_usage')
+        self.captured += 1
+        if self.done:
+            self.summary_path = self.write_summary()
+
+    def summary(self):
+        """按子模块汇总, 有 GPU 时按自身 CUDA 耗时排序, 否则按自身 CPU 耗时
+
+        Returns:
+            dict: {子模块: {'self_cpu_ms', 'self_cuda_ms', 'ops': [前 row_limit 个算子]}}, 耗时为所有录制前向的总和
+        """
+        grouped = {}
+        for (module, op), (calls, cpu_us, device_us, cpu_mem, device_mem) in self._ops.items():
+            grouped.setdefault(module, []).append({
+                'op': op, 'calls': calls, 'self_cpu_ms': cpu_us / 1000, 'self_cuda_ms': device_us / 1000,
+                'self_cpu_mem_mb': cpu_mem / 1024 / 1024, 'self_cuda_mem_mb': device_mem / 1024 / 1024})
+        sort_key = 'self_cuda_ms' if self._device else 'self_cpu_ms'
+        order = [m for m in SUBMODULES if m in grouped] + sorted(m for m in grouped if m not in SUBMODULES)
+        summary = {}
+        for module in order:
+            ops = sorted(grouped[module], key=lambda row: row[sort_key], reverse=True)
+            summary[module] = {
+                'self_cpu_ms': round(sum(row['self_cpu_ms'] for row in ops), 3),
+                'self_cuda_ms': round(sum(row['self_cuda_ms'] for row in ops), 3),
+                'ops': [{k: round(v, 3) if isinstance(v, float) else v for k, v in row.items()}
+                        for row in ops[:self.row_limit]],
+            }
+        return summary
+
+    def write_summary(self):
+        summary = self.summary()
+        with open(os.path.join(self.output_dir, 'summary.json'), 'w') as f:
+            json.dump(summary, f, indent=2)
+        lines = []
+        for module, group in summary.items():
+            lines.append(f"== {module}: self CPU {group['self_cpu_ms']:.2f} ms, self CUDA {group['self_cuda_ms']:.2f} ms "
+                         f"({self.captured} forward passes)")
+            lines.append(f"{'operator':<40} {'calls':>7} {'self CPU ms':>12} {'self CUDA ms':>13} "
+                         f"{'CPU mem MB':>11} {'CUDA mem MB':>12}")
+            for row in group['ops']:
+                lines.append(f"{row['op'][:40]:<40} {row['calls']:>7} {row['self_cpu_ms']:>12.3f} "
+                             f"{row['self_cuda_ms']:>13.3f} {row['self_cpu_mem_mb']:>11.2f} {row['self_cuda_mem_mb']:>12.2f}")
+            lines.append('')
+        path = os.path.join(self.output_dir, 'summary.txt')
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines))
+        return path
+
+    def status(self):
+        return {
+            'output_dir': self.output_dir,
+            'num_requests': self.num_requests,
+            'captured': self.captured,
+            'done': self.done,
+            'traces': list(self.traces),
+            'summary': self.summary_path,
+        }
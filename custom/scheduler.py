@@ -0,0 +1,167 @@
+import itertools
+import math
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+# 调度优先级, 数值小的先调度
+PRIORITIES = {'interactive': 0, 'bulk': 1}
+
+
+class DeadlineExceeded(Exception):
+    """请求在占用模型之前已超过截止时间, 被取消"""
+
+
+def deadline_after(deadline_ms, start=None):
+    """把相对截止时间(毫秒)换算为 time.monotonic() 的绝对时间, None 表示没有截止时间"""
+    if deadline_ms is None:
+        return None
+    return (time.monotonic() if start is None else start) + deadline_ms / 1000
+
+
+def _expired(deadline, before):
+    return DeadlineExceeded(f"已超过截止时间 {(time.monotonic() - deadline) * 1000:.0f}ms, 在{before}前取消")
+
+
+def check_deadline(deadline, before='推理'):
+    """已超过截止时间时抛出 DeadlineExceeded, 原因中给出超时的毫秒数"""
+    if deadline is not None and time.monotonic() > deadline:
+        raise _expired(deadline, before)
+
+
+class _Job(object):
+    def __init__(self, clouds, key, priority, deadline, seq):
+        self.clouds = clouds
+        self.key = key
+        self.priority = priority
+        self.deadline = deadline
+        self.seq = seq
+        self.future = Future()
+
+    def urgency(self):
+        # 优先级高的先; 同优先级截止时间近的先, 没有截止时间的排在后面; 再按提交顺序
+        return self.priority, math.inf if self.deadline is None else self.deadline, self.seq
+
+
+class InferenceScheduler(object):
+    """推理调度器: 请求线程提交前向任务, 调度线程按优先级和截止时间组成batch执行
+
+    每次取队列中最紧急的任务, 再按同样的顺序拼上推理参数相同的其他任务, 直到点云数达到 max_batch_size
+    (单个任务超过时单独执行). 组batch时已超过截止时间的任务不再占用模型, 直接以 DeadlineExceeded 结束.
+    调度线程中的异常只让当前batch的任务失败, 调度线程继续运行.
+
+    Args:
+        run_batch (callable): run_batch(clouds, key) 执行一次前向, 返回与 clouds 对应的输出列表;
+            key 是推理参数 (precision, stop_at, num_query, seed), 只有 key 相同的任务会拼在一起
+        max_batch_size (int): 一次前向拼接的最大点云数
+        num_threads (int): 调度线程数, 使用多副本推理池时与副本数相同, 各副本可以同时执行不同的batch
+        timeout (float): run 等待结果(排队加前向)的最长时间(秒), None 表示不限
+    """
+    def __init__(self, run_batch, max_batch_size=8, num_threads=1, timeout=None):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+        self._jobs = []
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._stats = {'submitted': 0, 'batches': 0, 'batched_jobs': 0, 'expired': 0}
+        self._threads = [threading.Thread(target=self._loop, daemon=True) for _ in range(num_threads)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, clouds, key, priority=None, deadline=None):
+        """提交一个前向任务
+
+        Args:
+            clouds (list): 归一化后的点云
+            priority (str or int, optional): 'interactive'、'bulk' 或数值, 默认 'bulk'
+            deadline (float, optional): time.monotonic() 的绝对截止时间
+
+        Returns:
+            concurrent.futures.Future: 结果为补全点云列表, 超时取消时为 DeadlineExceeded
+        """
+        if priority is None:
+            priority = 'bulk'
+        if priority in PRIORITIES:
+            priority = PRIORITIES[priority]
+        elif isinstance(priority, bool) or not isinstance(priority, int):
+            raise ValueError(f"不支持的优先级: {priority!r}, 可选 {list(PRIORITIES)} 或整数")
+        job = _Job(list(clouds), key, priority, deadline, next(self._seq))
+        with self._cond:
+            self._jobs.append(job)
+            self._stats['submitted'] += 1
+            self._cond.notify()
+        return job.future
+
+    def run(self, clouds, key, priority=None, deadline=None, timeout=None):
+        """提交并等待结果, 最多等待 timeout 秒(默认为调度器的 timeout), 超时后撤回还在排队的任务并抛出 RuntimeError"""
+        timeout = self.timeout if timeout is None else timeout
+        future = self.submit(clouds, key, priority, deadline)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            with self._cond:
+                self._jobs = [job for job in self._jobs if job.future is not future]
+            raise RuntimeError(f"推理调度 {timeout}s 内没有返回结果") from None
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._jobs:
+                self._cond.wait()
+            now = time.monotonic()
+            expired = [job for job in self._jobs if job.deadline is not None and now > job.deadline]
+            ordered = sorted((job for job in self._jobs if job not in expired), key=_Job.urgency)
+            batch, size = [], 0
+            if ordered:
+                head = ordered[0]
+                batch, size = [head], len(head.clouds)
+                for job in ordered[1:]:
+                    if job.key == head.key and size + len(job.clouds) <= self.max_batch_size:
+                        batch.append(job)
+                        size += len(job.clouds)
+            self._jobs = [job for job in ordered if job not in batch]
+            self._stats['expired'] += len(expired)
+            if batch:
+                self._stats['batches'] += 1
+                self._stats['batched_jobs'] += len(batch)
+        return batch, expired
+
+    def _loop(self):
+        while True:
+            batch = None
+            try:
+                batch, expired = self._next_batch()
+                for job in expired:
+                    job.future.set_exception(_expired(job.deadline, '推理'))
+                if batch:
+                    self._run(batch)
+            except Exception as e:
+                if batch is None:
+                    # 组batch出错时队列无法排序, 排队中的任务全部失败, 避免调度线程反复出错
+                    with self._cond:
+                        batch, self._jobs = self._jobs, []
+                for job in batch:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+
+    def _run(self, batch):
+        clouds = [cloud for job in batch for cloud in job.clouds]
+        outputs = self.run_batch(clouds, batch[0].key)
+        if len(outputs) != len(clouds):
+            raise RuntimeError(f"前向返回 {len(outputs)} 个结果, 输入 {len(clouds)} 个点云")
+        start = 0
+        for job in batch:
+            job.future.set_result(outputs[start:start + len(job.clouds)])
+            start += len(job.clouds)
+
+    def stats(self):
+        with self._cond:
+            names = {value: name for name, value in PRIORITIES.items()}
+            queued = {}
+            for job in self._jobs:
+                name = names.get(job.priority, str(job.priority))
+                queued[name] = queued.get(name, 0) + 1
+            stats = dict(self._stats)
+        stats['queued'] = queued
+        stats['mean_batch_jobs'] = round(stats['batched_jobs'] / stats['batches'], 2) if stats['batches'] else None
+        return stats
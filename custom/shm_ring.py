@@ -0,0 +1,184 @@
+import multiprocessing
+import queue
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+# 每个槽位的元信息: 点数, 中心 x/y/z, 缩放因子, 原始点云的点数
+_META_FIELDS = 6
+
+
+class CloudRing(object):
+    """固定大小 float32 槽位的共享内存环形缓冲区, 用于在进程间传递 N x 3 点云及其 (center, scale_factor)
+
+    一块 multiprocessing.shared_memory 依次存放 float64 元信息 [num_slots, 6] 和 float32 坐标
+    [num_slots, max_points, 3]. 创建者维护空闲槽位队列(acquire/release), 其他进程用 attach 按名字映射同一块内存,
+    读写槽位不需要序列化数组.
+
+    Args:
+        num_slots (int): 槽位数, 即同时在途的点云数上限
+        max_points (int): 每个槽位的最大点数
+        name (str, optional): 已有共享内存的名字, 指定时映射已有的缓冲区而不是新建
+    """
+    def __init__(self, num_slots, max_points, name=None):
+        self.num_slots = num_slots
+        self.max_points = max_points
+        meta_bytes = num_slots * _META_FIELDS * 8
+        size = meta_bytes + num_slots * max_points * 3 * 4
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=size if self.owner else 0)
+        if not self.owner:
+            # 只由创建者负责 unlink, 映射方退出时不应让 resource_tracker 回收这块内存
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        self.meta = np.ndarray((num_slots, _META_FIELDS), dtype=np.float64, buffer=self.shm.buf)
+        self.points = np.ndarray((num_slots, max_points, 3), dtype=np.float32, buffer=self.shm.buf, offset=meta_bytes)
+        self._free = None
+        if self.owner:
+            self._free = queue.Queue()
+            for slot in range(num_slots):
+                self._free.put(slot)
+
+    @property
+    def spec(self):
+        """传给其他进程 attach 的参数"""
+        return self.shm.name, self.num_slots, self.max_points
+
+    @classmethod
+    def attach(cls, spec):
+        name, num_slots, max_points = spec
+        return cls(num_slots, max_points, name=name)
+
+    def acquire(self, timeout=None):
+        """取一个空闲槽位, 全部在途时阻塞(背压)"""
+        return self._free.get(timeout=timeout)
+
+    def release(self, slot):
+        self._free.put(slot)
+
+    def write(self, slot, points, center, scale_factor, source_points=0):
+        n = len(points)
+        if n > self.max_points:
+            raise ValueError(f"点数 {n} 超过共享内存槽位的容量 {self.max_points}")
+        self.points[slot, :n] = points
+        self.meta[slot, 0] = n
+        self.meta[slot, 1:4] = center
+        self.meta[slot, 4] = scale_factor
+        self.meta[slot, 5] = source_points
+
+    def read(self, slot):
+        """读取槽位, 坐标是共享内存的视图(不复制), 槽位 release 前有效
+
+        Returns:
+            tuple: (points, center, scale_factor), points shape=(n, 3) float32
+        """
+        n = int(self.meta[slot, 0])
+        return self.points[slot, :n], self.meta[slot, 1:4].copy(), float(self.meta[slot, 4])
+
+    def source_points(self, slot):
+        """写入该槽位的点云在预处理前的点数"""
+        return int(self.meta[slot, 5])
+
+    def close(self):
+        # 先释放 numpy 视图, 否则共享内存的 buffer 仍被引用无法关闭
+        self.meta = self.points = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+_worker_ring = None
+
+
+def _init_worker(spec):
+    global _worker_ring
+    _worker_ring = CloudRing.attach(spec)
+
+
+def _preprocess_to_slot(input_path, slot, target_points, sampling_method, seed):
+    # 在预处理进程中执行, 与 Process_point_cloud 相同: 读取 -> 归一化 -> 采样 -> 去除离群点
+    import open3d as o3d
+    from custom.down_sample import normalize_point_cloud, sample_point_cloud, remove_outliers
+
+    points = np.asarray(o3d.io.read_point_cloud(input_path).points)
+    if len(points) == 0:
+        raise ValueError(f"{input_path} 是空点云")
+    normalized = normalize_point_cloud(points)
+    if normalized is None:
+        raise ValueError(f"{input_path} 是平面或线性点云, 无法归一化")
+    normalized_points, center, scale_factor = normalized
+    sampled_points = sample_point_cloud(normalized_points, target_points, sampling_method, seed)
+    pcd_filtered = remove_outliers(sampled_points)
+    _worker_ring.write(slot, np.asarray(pcd_filtered.points), center, scale_factor, len(points))
+
+
+class ShmPreprocessor(object):
+    """在进程池中预处理点云文件, 结果写入共享内存槽位, 推理进程直接读取槽位中的坐标
+
+    Open3D 读取、FPS 和离群点移除大部分时间持有 GIL, 放到独立进程后不再与推理线程争抢;
+    进程之间只传递文件路径和槽位编号, 点云本身不经过 pickle.
+
+    Args:
+        num_workers (int): 预处理进程数
+        num_slots (int): 共享内存槽位数, 默认每个进程两个
+        max_points (int): 每个槽位的最大点数, 应不小于请求的 target_points
+    """
+    def __init__(self, num_workers, num_slots=None, max_points=16384):
+        self.ring = CloudRing(num_slots or 2 * num_workers, max_points)
+        self._executor = ProcessPoolExecutor(num_workers, mp_context=multiprocessing.get_context('spawn'),
+                                             initializer=_init_worker, initargs=(self.ring.spec,))
+
+    def submit(self, input_path, target_points, sampling_method='fps', seed=None):
+        """提交一个文件的预处理, 没有空闲槽位时阻塞
+
+        Returns:
+            tuple: (slot, future), future 完成后用 ring.read(slot) 读取, 用完后调用 release(slot)
+        """
+        slot = self.ring.acquire()
+        try:
+            return slot, self._executor.submit(_preprocess_to_slot, input_path, slot, target_points,
+                                               sampling_method, seed)
+        except Exception:
+            self.ring.release(slot)
+            raise
+
+    def release(self, slot):
+        self.ring.release(slot)
+
+    def map(self, paths, target_points, sampling_method='fps', seed=None):
+        """按顺序预处理多个文件, 提前提交后面的文件以与推理重叠
+
+        每个文件产生 (points, center, scale_factor), 失败时产生异常对象. points 是共享内存视图,
+        在取下一个结果前有效.
+        """
+        pending = deque()
+        paths = iter(paths)
+        for path in paths:
+            pending.append(self.submit(path, target_points, sampling_method, seed))
+            if len(pending) >= self.ring.num_slots:
+                break
+        try:
+            while pending:
+                slot, future = pending.popleft()
+                try:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        yield e
+                    else:
+                        yield self.ring.read(slot)
+                finally:
+                    self.release(slot)
+                path = next(paths, None)
+                if path is not None:
+                    pending.append(self.submit(path, target_points, sampling_method, seed))
+        finally:
+            # 调用方提前结束时, 等已提交的任务写完槽位再归还
+            for slot, future in pending:
+                future.exception()
+                self.release(slot)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.ring.close()
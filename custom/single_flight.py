@@ -0,0 +1,42 @@
+import asyncio
+import functools
+
+
+class SingleFlight(object):
+    """合并相同的并发请求: 同一个键同时只计算一次, 后到的请求等待并共享第一个请求的结果
+
+    计算在线程池中执行, 事件循环在等待期间可以继续接收请求. 只在事件循环线程中使用, 不需要加锁.
+    """
+    def __init__(self):
+        self._inflight = {}
+        self._stats = {'leaders': 0, 'coalesced': 0}
+
+    async def run(self, key, fn, *args, **kwargs):
+        """执行 fn(*args, **kwargs), 已有相同键的计算在进行时直接等待它的结果
+
+        Returns:
+            tuple: (result, coalesced), coalesced 表示结果是否来自其他请求的计算
+        """
+        future = self._inflight.get(key)
+        if future is not None:
+            self._stats['coalesced'] += 1
+            # shield: 等待的请求被取消时不影响正在进行的计算
+            return await asyncio.shield(future), True
+
+        loop = asyncio.get_running_loop()
+        # 计算的 future 不属于任何一个请求: 第一个请求被取消时计算继续进行, 等待它的其他请求照常得到结果
+        future = loop.run_in_executor(None, functools.partial(fn, *args, **kwargs))
+        # 没有请求等待时也标记异常已读取, 避免 "exception was never retrieved" 警告
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        future.add_done_callback(functools.partial(self._done, key))
+        self._inflight[key] = future
+        self._stats['leaders'] += 1
+        return await asyncio.shield(future), False
+
+    def _done(self, key, future):
+        # 计算完成时(而不是第一个请求返回时)才移除, 完成之前到达的相同请求都会合并到这次计算
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+
+    def stats(self):
+        return {'in_flight': len(self._inflight), **self._stats}
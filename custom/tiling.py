@@ -0,0 +1,135 @@
+import itertools
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from sklearn.cluster import DBSCAN
+
+from custom.down_sample import normalize_point_cloud, sample_point_cloud, remove_outliers
+from custom.inference import Inference_chunked
+from custom.inverse_normalize import inverse_normalize_point_cloud
+
+# 模型输入点数, 与 custom/inference.py 中 UpSamplePoints 的点数一致
+MODEL_INPUT_POINTS = 2048
+
+
+def grid_tiles(points, tile_size=0.25, overlap=0.25, min_points=64):
+    """把归一化后的点云切成相互重叠的立方体分块
+
+    Args:
+        points (np.ndarray): 归一化后的点云 shape=(N, 3)
+        tile_size (float): 分块边长 (归一化坐标, 整个点云的最大边长为1)
+        overlap (float): 相邻分块重叠的比例, [0, 1)
+        min_points (int): 点数少于该值的分块直接丢弃
+
+    Returns:
+        list: 每个分块的 (lower, upper, indices)
+    """
+    if not 0 <= overlap < 1:
+        raise ValueError(f"overlap 应在 [0, 1) 范围内, 当前 {overlap}")
+    stride = tile_size * (1 - overlap)
+    lo = points.min(axis=0)
+    hi = points.max(axis=0)
+    counts = np.maximum(1, np.ceil((hi - lo - tile_size) / stride).astype(int) + 1)
+
+    tiles = []
+    for cell in itertools.product(*[range(c) for c in counts]):
+        lower = lo + np.array(cell) * stride
+        upper = lower + tile_size
+        indices = np.nonzero(np.all((points >= lower) & (points <= upper), axis=1))[0]
+        if len(indices) >= min_points:
+            tiles.append((lower, upper, indices))
+    return tiles
+
+
+def dbscan_tiles(points, eps=0.05, min_points=64):
+    """用 DBSCAN 把归一化后的点云按空间聚类分块
+
+    聚类在边长为 eps/2 的体素中心上进行, 再把标签映射回所有点, 避免在百万级点云上直接跑 DBSCAN.
+    噪声点不属于任何分块.
+
+    Returns:
+        list: 每个分块的 (lower, upper, indices)
+    """
+    voxel_size = eps / 2
+    keys = np.floor(points / voxel_size).astype(np.int64)
+    _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    voxel_labels = DBSCAN(eps=eps, min_samples=3).fit_predict(points[first])
+    labels = voxel_labels[inverse.reshape(-1)]
+
+    tiles = []
+    for label in np.unique(labels):
+        if label < 0:
+            continue
+        indices = np.nonzero(labels == label)[0]
+        if len(indices) >= min_points:
+            tiles.append((points[indices].min(axis=0), points[indices].max(axis=0), indices))
+    return tiles
+
+
+def voxel_dedup(points, voxel_size):
+    """体素哈希去重: 每个体素只保留第一个点, 用于合并分块重叠区域的输出"""
+    if len(points) == 0:
+        return points
+    keys = np.floor(points / voxel_size).astype(np.int64)
+    keys -= keys.min(axis=0)
+    dims = keys.max(axis=0) + 1
+    hashes = (keys[:, 0] * dims[1] + keys[:, 1]) * dims[2] + keys[:, 2]
+    _, first = np.unique(hashes, return_index=True)
+    return points[np.sort(first)]
+
+
+def _prepare_tile(points, target_points, sampling_method, seed=None):
+    # 与多物体模式的 _prepare_object 相同: 每个分块单独归一化到单位立方体 -> 采样 -> 统计离群点移除
+    normalized = normalize_point_cloud(points)
+    if normalized is None:
+        return None
+    normalized_points, center, scale_factor = normalized
+    sampled_points = sample_point_cloud(normalized_points, target_points, sampling_method, seed)
+    return np.asarray(remove_outliers(sampled_points).points), center, scale_factor
+
+
+def Tiled_inference(points, args, tile_method='grid', tile_size=0.25, tile_overlap=0.25, cluster_eps=0.05,
+                    merge_voxel_size=0.002, min_tile_points=64, target_points=MODEL_INPUT_POINTS, sampling_method='fps',
+                    num_workers=4, seed=None, **options):
+    """分块补全场景级点云
+
+    把归一化后的点云切成重叠分块(或 DBSCAN 聚类), 分块按 Inference_chunked 分批前向(使用推理池时由多个副本并行),
+    每个分块的输出按各自的归一化参数逆变换回整体的归一化坐标, 最后用体素哈希合并重叠区域.
+
+    Args:
+        points (np.ndarray): 整体归一化后的点云 shape=(N, 3), 不需要预先采样
+        args: 推理参数, 同 Inference
+        tile_method (str): 'grid' 规则分块或 'dbscan' 聚类分块
+        target_points (int): 每个分块采样后的点数
+        num_workers (int): 分块预处理(归一化+采样)的线程数
+        seed (int, optional): 采样随机种子, 指定后结果可复现
+        options: 透传给 Inference_chunked 的参数(chunk_size, precision, stop_at, num_query, latency_budget_ms, priority, deadline)
+
+    Returns:
+        np.ndarray: 合并后的补全点云, 整体归一化坐标
+    """
+    if tile_method == 'grid':
+        tiles = grid_tiles(points, tile_size, tile_overlap, min_tile_points)
+    elif tile_method == 'dbscan':
+        tiles = dbscan_tiles(points, cluster_eps, min_tile_points)
+    else:
+        raise ValueError(f"不支持的分块方法: {tile_method}")
+
+    with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+        prepared = list(executor.map(lambda tile: _prepare_tile(points[tile[2]], target_points, sampling_method, seed), tiles))
+    tiles = [(tile, p) for tile, p in zip(tiles, prepared) if p is not None]
+    if not tiles:
+        raise ValueError(f"没有点数不少于 {min_tile_points} 的分块")
+    print(f"分块补全: {len(tiles)} 个分块 ({tile_method})")
+
+    outputs = Inference_chunked([p[0] for _, p in tiles], args, seed=seed, **options)
+
+    merged = []
+    for ((lower, upper, _), (_, center, scale_factor)), out in zip(tiles, outputs):
+        restored = inverse_normalize_point_cloud(out, center, scale_factor)
+        if tile_method == 'grid':
+            # 规则分块的输出裁剪到分块范围(留出一半重叠), 分块外的区域由相邻分块负责
+            margin = tile_size * tile_overlap / 2
+            keep = np.all((restored >= lower - margin) & (restored <= upper + margin), axis=1)
+            restored = restored[keep]
+        merged.append(restored)
+    return voxel_dedup(np.concatenate(merged), merge_voxel_size)
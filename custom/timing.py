@@ -0,0 +1,39 @@
+import time
+from contextlib import contextmanager
+
+from custom.metrics import STAGE_SECONDS
+
+
+class StageTimer(object):
+    """记录一次请求各处理阶段的耗时(毫秒), 同名阶段多次进入时累加; 每次耗时同时计入 /metrics 的阶段直方图"""
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed * 1000
+            STAGE_SECONDS.observe(elapsed, stage=name)
+
+    def total(self):
+        return sum(self.timings.values())
+
+    def rounded(self, digits=2):
+        return {name: round(ms, digits) for name, ms in self.timings.items()}
+
+
+def server_timing(timings, total_ms=None):
+    """把各阶段耗时(毫秒)格式化为 Server-Timing 响应头, 浏览器开发者工具和客户端可以直接解析
+
+    Args:
+        timings (dict): 阶段名 -> 耗时(毫秒)
+        total_ms (float, optional): 服务器处理请求的总耗时, 指定时追加为 total 项
+    """
+    entries = [f'{name};dur={ms:.2f}' for name, ms in timings.items()]
+    if total_ms is not None:
+        entries.append(f'total;dur={total_ms:.2f}')
+    return ', '.join(entries)
@@ -0,0 +1,313 @@
+import copy
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+# 最近延迟的指数滑动平均系数
+_LATENCY_DECAY = 0.8
+# 收集线程等待结果的超时(秒), 超时后检查副本进程是否还活着
+_WATCH_INTERVAL = 1.0
+
+
+def parse_replicas(spec):
+    """解析副本配置, 逗号分隔, 每项为一个设备, CPU副本可以用 cpu:<核编号> 绑定核:
+
+        cuda:0,cuda:1        两个GPU副本
+        cpu:0-3,cpu:4-7      两个CPU副本, 各绑定4个核
+        cpu,cpu              两个不绑核的CPU副本
+
+    Returns:
+        list: 每个副本的 (device, cores), cores 为 None 表示不绑核
+    """
+    replicas = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        if item.startswith('cpu:'):
+            cores = []
+            for part in item[4:].split('+'):
+                lo, _, hi = part.partition('-')
+                cores.extend(range(int(lo), int(hi or lo) + 1))
+            replicas.append(('cpu', sorted(set(cores))))
+        else:
+            replicas.append((item, None))
+    if not replicas:
+        raise ValueError(f"副本配置为空: {spec}")
+    return replicas
+
+
+def process_memory(pid):
+    """进程的内存占用(MB): rss 为常驻内存, pss 把共享页按共享进程数均摊, shared 为与其他进程共享的页
+
+    读取 /proc/<pid>/smaps_rollup, 不支持的平台返回空字典.
+    """
+    fields = {'Rss': 'rss_mb', 'Pss': 'pss_mb', 'Shared_Clean': 'shared_mb', 'Shared_Dirty': 'shared_mb'}
+    memory = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                if name in fields:
+                    key = fields[name]
+                    memory[key] = memory.get(key, 0.0) + int(value.split()[0]) / 1024
+    except (OSError, ValueError):
+        return {}
+    return {key: round(mb, 1) for key, mb in memory.items()}
+
+
+def _replica_main(args, device, cores, requests, results, index):
+    # spawn 出的子进程重新导入模块; fork 出的子进程继承了父进程加载好的模型, load_inference_model 直接命中缓存
+    import torch
+    from custom.inference import (load_inference_model, model_metadata, Inference_batch, set_inference_pool,
+                                  set_memory_manager)
+    from custom.memory import MemoryManager
+
+    set_inference_pool(None)
+    if cores:
+        os.sched_setaffinity(0, cores)
+        torch.set_num_threads(len(cores))
+    args.device = device
+    # 每个副本管理自己设备上的内存, OOM 时在副本内拆分batch重试
+    memory = MemoryManager(device, getattr(args, 'memory_watermark', 0.1), getattr(args, 'memory_policy', 'adaptive'),
+                           getattr(args, 'memory_sample_every', 50))
+    set_memory_manager(memory)
+    start = time.perf_counter()
+    model, _ = load_inference_model(args)
+    results.put(('ready', index, (time.perf_counter() - start) * 1000, model_metadata(model)))
+
+    while True:
+        job = requests.get()
+        if job is None:
+            break
+        job_id, clouds, options = job
+        start = time.perf_counter()
+        try:
+            outputs = Inference_batch(clouds, args, **options)
+            results.put((job_id, index, True, outputs, (time.perf_counter() - start) * 1000))
+        except Exception as e:
+            results.put((job_id, index, False, f"{type(e).__name__}: {e}", (time.perf_counter() - start) * 1000))
+        memory.after_request()
+
+
+class _Replica(object):
+    def __init__(self, index, device, cores):
+        self.index = index
+        self.device = device
+        self.cores = cores
+        self.process = None
+        self.requests = None
+        self.pending = 0
+        # 已交给该副本、还没有返回结果的任务
+        self.jobs = set()
+        self.exitcode = None
+        self.completed = 0
+        self.failed = 0
+        self.latency_ms = None
+        self.load_ms = None
+        self.start_ms = None
+
+    def expected_wait(self):
+        # 排队中的任务数 x 最近的单次延迟; 还没有延迟记录时只按排队数比较
+        return (self.pending + 1) * (self.latency_ms or 0.0), self.pending
+
+
+class WorkerPool(object):
+    """多副本推理池: 每个副本是一个独立进程, 固定在一个设备或一组CPU核上, 各自加载一份模型
+
+    前端进程把每个batch交给负载最低的副本(按排队任务数和最近延迟估计的等待时间), 结果通过队列返回.
+    子进程默认使用 spawn 启动, CUDA 在前端进程中初始化过也不受影响.
+
+    收集线程每隔 _WATCH_INTERVAL 秒检查一次副本进程, 副本退出(崩溃、被 OOM killer 杀掉)后不再分配任务,
+    已交给它的任务以 RuntimeError 结束, 不会一直等下去.
+
+    副本加载完模型后随 ready 消息发回模型信息(model_metadata), 保存在 model_info 中, 前端进程校验请求时不必自己加载模型.
+
+    prefork=True 时(只支持CPU副本)前端进程先加载并优化一次模型, 把参数和缓冲区移到共享内存
+    (Module.share_memory), 再 fork 出副本进程; 副本直接映射同一份权重, 不再各自读取权重文件.
+
+    Args:
+        args: 推理参数, 同 load_inference_model, 每个副本会替换 device
+        replicas (list): parse_replicas 的结果
+        prefork (bool): 是否在前端进程加载模型后 fork 副本
+        timeout (float): run 等待一个batch结果的最长时间(秒), None 表示不限
+    """
+    def __init__(self, args, replicas, prefork=False, timeout=None):
+        self.args = args
+        self.replicas = [_Replica(i, device, cores) for i, (device, cores) in enumerate(replicas)]
+        self.prefork = prefork
+        self.timeout = timeout
+        self.parent_load_ms = None
+        self.model_info = None
+        if prefork:
+            if any(r.device != 'cpu' for r in self.replicas):
+                raise ValueError("prefork 只支持CPU副本")
+            if getattr(args, 'backend', 'pytorch') == 'onnx':
+                raise ValueError("prefork 不支持 onnx 后端")
+        self._context = multiprocessing.get_context('fork' if prefork else 'spawn')
+        self._results = self._context.Queue()
+        # job_id -> (Future, 副本)
+        self._futures = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._collector = None
+
+    def start(self, timeout=600):
+        """启动所有副本并等待模型加载完成"""
+        if self.prefork:
+            from custom.inference import load_inference_model
+
+            self.args.device = 'cpu'
+            start = time.perf_counter()
+            model, _ = load_inference_model(self.args)
+            model.share_memory()
+            self.parent_load_ms = (time.perf_counter() - start) * 1000
+
+        started = time.perf_counter()
+        for replica in self.replicas:
+            replica.requests = self._context.Queue()
+            replica.process = self._context.Process(
+                target=_replica_main,
+                args=(copy.copy(self.args), replica.device, replica.cores, replica.requests, self._results,
+                      replica.index),
+                daemon=True)
+            replica.process.start()
+        for _ in self.replicas:
+            _, index, load_ms, self.model_info = self._wait_ready(started, timeout)
+            # start_ms: 从启动进程到副本可以接收任务的冷启动时间(包括导入模块和加载模型)
+            self.replicas[index].load_ms = load_ms
+            self.replicas[index].start_ms = (time.perf_counter() - started) * 1000
+        self._collector = threading.Thread(target=self._collect, daemon=True)
+        self._collector.start()
+        return self
+
+    def _wait_ready(self, started, timeout):
+        # 加载模型时崩溃的副本不会发出 ready, 不必等满 timeout
+        while True:
+            try:
+                return self._results.get(timeout=_WATCH_INTERVAL)
+            except queue.Empty:
+                pass
+            dead = [r for r in self.replicas if r.load_ms is None and not r.process.is_alive()]
+            if dead:
+                raise RuntimeError(f"副本 {dead[0].index} ({dead[0].device}) 加载模型时退出 "
+                                   f"(exitcode {dead[0].process.exitcode})")
+            if time.perf_counter() - started > timeout:
+                raise RuntimeError(f"推理副本 {timeout}s 内没有加载完模型")
+
+    def _collect(self):
+        last_check = time.monotonic()
+        while True:
+            try:
+                message = self._results.get(timeout=_WATCH_INTERVAL)
+            except queue.Empty:
+                message = ()
+            if message is None:
+                break
+            if time.monotonic() - last_check >= _WATCH_INTERVAL:
+                self._check_replicas()
+                last_check = time.monotonic()
+            if not message:
+                continue
+            job_id, index, ok, payload, latency_ms = message
+            replica = self.replicas[index]
+            with self._lock:
+                if job_id not in self._futures:
+                    # 任务已经因为副本退出而失败
+                    continue
+                future, _ = self._futures.pop(job_id)
+                replica.jobs.discard(job_id)
+                replica.pending -= 1
+                if ok:
+                    replica.completed += 1
+                    replica.latency_ms = latency_ms if replica.latency_ms is None else (
+                        _LATENCY_DECAY * replica.latency_ms + (1 - _LATENCY_DECAY) * latency_ms)
+                else:
+                    replica.failed += 1
+            if ok:
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(f"副本 {index} ({replica.device}) 推理失败: {payload}"))
+
+    def _check_replicas(self):
+        """已退出的副本把排队中的任务全部以 RuntimeError 结束"""
+        failed = []
+        with self._lock:
+            for replica in self.replicas:
+                if replica.exitcode is not None or replica.process is None or replica.process.is_alive():
+                    continue
+                replica.exitcode = replica.process.exitcode
+                failed.extend((self._futures.pop(job_id)[0], replica) for job_id in replica.jobs)
+                replica.failed += len(replica.jobs)
+                replica.jobs.clear()
+                replica.pending = 0
+        for future, replica in failed:
+            future.set_exception(RuntimeError(
+                f"副本 {replica.index} ({replica.device}) 已退出 (exitcode {replica.exitcode}), 任务未完成"))
+
+    def submit(self, clouds, **options):
+        """把一个batch交给负载最低的副本
+
+        Returns:
+            concurrent.futures.Future: 结果为补全点云列表, 同 Inference_batch
+        """
+        future = Future()
+        with self._lock:
+            alive = [r for r in self.replicas if r.process is not None and r.process.is_alive()]
+            if not alive:
+                raise RuntimeError("没有可用的推理副本")
+            replica = min(alive, key=_Replica.expected_wait)
+            job_id = next(self._ids)
+            self._futures[job_id] = (future, replica)
+            replica.jobs.add(job_id)
+            replica.pending += 1
+        replica.requests.put((job_id, clouds, options))
+        return future
+
+    def run(self, clouds, timeout=None, **options):
+        """同步执行一个batch, 最多等待 timeout 秒(默认为池的 timeout), 超时抛出 RuntimeError"""
+        timeout = self.timeout if timeout is None else timeout
+        future = self.submit(clouds, **options)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            raise RuntimeError(f"推理副本 {timeout}s 内没有返回结果") from None
+
+    def stats(self):
+        """各副本的状态, 以及 prefork 模式下父进程加载模型的耗时(即每个副本单独加载时的开销)"""
+        with self._lock:
+            replicas = [{
+                'index': r.index,
+                'device': r.device,
+                'cores': r.cores,
+                'pid': r.process.pid if r.process is not None else None,
+                'alive': r.process is not None and r.process.is_alive(),
+                'exitcode': r.exitcode,
+                'queue_depth': r.pending,
+                'completed': r.completed,
+                'failed': r.failed,
+                'latency_ms': round(r.latency_ms, 2) if r.latency_ms is not None else None,
+                'load_ms': round(r.load_ms, 2) if r.load_ms is not None else None,
+                'start_ms': round(r.start_ms, 2) if r.start_ms is not None else None,
+            } for r in self.replicas]
+        for replica in replicas:
+            if replica['alive']:
+                replica['memory'] = process_memory(replica['pid'])
+        return {
+            'mode': 'prefork' if self.prefork else 'spawn',
+            'parent_load_ms': round(self.parent_load_ms, 2) if self.parent_load_ms is not None else None,
+            'replicas': replicas,
+        }
+
+    def close(self):
+        for replica in self.replicas:
+            if replica.process is not None and replica.process.is_alive():
+                replica.requests.put(None)
+        for replica in self.replicas:
+            if replica.process is not None:
+                replica.process.join(timeout=10)
+        self._results.put(None)
@@ -69,20 +69,23 @@ class RandomSamplePoints(object):
 class UpSamplePoints(object):
     def __init__(self, parameters):
         self.n_points = parameters['n_points']
+        # optional seed makes the sampling reproducible
+        seed = parameters.get('seed')
+        self.rng = np.random if seed is None else np.random.RandomState(seed)
 
     def __call__(self, ptcloud):
         curr = ptcloud.shape[0]
         need = self.n_points - curr
 
         if need < 0:
-            return ptcloud[np.random.permutation(self.n_points)]
+            return ptcloud[self.rng.permutation(self.n_points)]
 
         while curr <= need:
             ptcloud = np.tile(ptcloud, (2, 1))
             need -= curr
             curr *= 2
 
-        choice = np.random.permutation(need)
+        choice = self.rng.permutation(need)
         ptcloud = np.concatenate((ptcloud, ptcloud[choice]))
 
         return ptcloud
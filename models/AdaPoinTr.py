@@ -8,7 +8,7 @@ import torch.nn as nn
 from functools import partial, reduce
 from timm.models.layers import DropPath, trunc_normal_
 from extensions.chamfer_dist import ChamferDistanceL1
-from .build import MODELS, build_model_from_cfg
+from .build import MODELS, build_model_from_cfg, stage_index
 from models.Transformer_utils import *
 from utils import misc
 
@@ -539,6 +539,7 @@ class DGCNN_Grouper(nn.Module):
                                    )
         self.num_features = 128
     @staticmethod
+    @misc.fp32_geometry
     def fps_downsample(coor, x, num_group):
         xyz = coor.transpose(1, 2).contiguous() # b, n, 3
         fps_idx = pointnet2_utils.furthest_point_sample(xyz, num_group)
@@ -699,7 +700,7 @@ class Fold(nn.Module):
 
         a = torch.linspace(-1., 1., steps=step, dtype=torch.float).view(1, step).expand(step, step).reshape(1, -1)
         b = torch.linspace(-1., 1., steps=step, dtype=torch.float).view(step, 1).expand(step, step).reshape(1, -1)
-        self.folding_seed = torch.cat([a, b], dim=0).cuda()
+        self.register_buffer('folding_seed', torch.cat([a, b], dim=0), persistent=False)
 
         self.folding1 = nn.Sequential(
             nn.Conv1d(in_channel + 2, hidden_dim, 1),
@@ -769,6 +770,8 @@ class PCTransformer(nn.Module):
 
         in_chans = 3
         self.num_query = query_num = config.num_query
+        # the decoder attends over the k nearest queries, fewer queries than that cannot be decoded
+        self.min_query = getattr(decoder_config, 'k', 8)
         global_feature_dim = config.global_feature_dim
 
         print_log(f'Transformer with config {config}', logger='MODEL')
@@ -835,8 +838,15 @@ class PCTransformer(nn.Module):
             nn.init.constant_(m.bias, 0)
             nn.init.constant_(m.weight, 1.0)
 
-    def forward(self, xyz):
+    def forward(self, xyz, num_query=None):
+        '''
+            num_query: keep only the top ranked queries at inference, default self.num_query
+        '''
         bs = xyz.size(0)
+        if num_query is None or self.training:
+            num_query = self.num_query
+        if not self.min_query <= num_query <= self.num_query:
+            raise ValueError(f'num_query should be in [{self.min_query}, {self.num_query}], got {num_query}')
         coor, f = self.grouper(xyz, self.center_num) # b n c
         pe =  self.pos_embed(coor)
         x = self.input_proj(f)
@@ -855,7 +865,7 @@ class PCTransformer(nn.Module):
         # query selection
         query_ranking = self.query_ranking(coarse) # b n 1
         idx = torch.argsort(query_ranking, dim=1, descending=True) # b n 1
-        coarse = torch.gather(coarse, 1, idx[:,:self.num_query].expand(-1, -1, coarse.size(-1)))
+        coarse = torch.gather(coarse, 1, idx[:,:num_query].expand(-1, -1, coarse.size(-1)))
 
         if self.training:
             # add denoise task
@@ -903,6 +913,7 @@ class AdaPoinTr(nn.Module):
 
         self.fold_step = 8
         self.base_model = PCTransformer(config)
+        self.min_query = self.base_model.min_query
         
         if self.decoder_type == 'fold':
             self.factor = self.fold_step**2
@@ -922,6 +933,8 @@ class AdaPoinTr(nn.Module):
             nn.Conv1d(1024, 1024, 1)
         )
         self.reduce_map = nn.Linear(self.trans_dim + 1027, self.trans_dim)
+        # outputs forward can stop at during inference
+        self.stages = ['coarse', 'fine']
         self.build_loss_func()
 
     def build_loss_func(self):
@@ -947,8 +960,18 @@ class AdaPoinTr(nn.Module):
 
         return loss_denoised, loss_recon
 
-    def forward(self, xyz):
-        q, coarse_point_cloud, denoise_length = self.base_model(xyz) # B M C and B M 3
+    def forward(self, xyz, stop_at=None, num_query=None):
+        '''
+            stop_at: one of self.stages, 'coarse' skips the fine decoder (inference only)
+            num_query: run the decoder with fewer queries (inference only), the output
+                       shrinks to num_query * self.factor points
+        '''
+        q, coarse_point_cloud, denoise_length = self.base_model(xyz, num_query) # B M C and B M 3
+        # coordinates stay fp32 under autocast
+        coarse_point_cloud = coarse_point_cloud.float()
+        if not self.training and stage_index(self, stop_at) == 0:
+            # skip the fine decoder
+            return (coarse_point_cloud, coarse_point_cloud)
     
         B, M ,C = q.shape
 
@@ -965,12 +988,12 @@ class AdaPoinTr(nn.Module):
         if self.decoder_type == 'fold':
             rebuild_feature = self.reduce_map(rebuild_feature.reshape(B*M, -1)) # BM C
             relative_xyz = self.decode_head(rebuild_feature).reshape(B, M, 3, -1)    # B M 3 S
-            rebuild_points = (relative_xyz + coarse_point_cloud.unsqueeze(-1)).transpose(2,3)  # B M S 3
+            rebuild_points = (relative_xyz.float() + coarse_point_cloud.unsqueeze(-1)).transpose(2,3)  # B M S 3
 
         else:
             rebuild_feature = self.reduce_map(rebuild_feature) # B M C
             relative_xyz = self.decode_head(rebuild_feature)   # B M S 3
-            rebuild_points = (relative_xyz + coarse_point_cloud.unsqueeze(-2))  # B M S 3
+            rebuild_points = (relative_xyz.float() + coarse_point_cloud.unsqueeze(-2))  # B M S 3
 
         if self.training:
             # split the reconstruction and denoise task
@@ -990,8 +1013,8 @@ class AdaPoinTr(nn.Module):
             assert denoise_length == 0
             rebuild_points = rebuild_points.reshape(B, -1, 3).contiguous()  # B N 3
 
-            assert rebuild_points.size(1) == self.num_query * self.factor
-            assert coarse_point_cloud.size(1) == self.num_query
+            assert rebuild_points.size(1) == M * self.factor
+            assert coarse_point_cloud.size(1) == (num_query or self.num_query)
 
             ret = (coarse_point_cloud, rebuild_points)
             return ret
\ No newline at end of file
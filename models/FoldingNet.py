@@ -46,7 +46,7 @@ class FoldingNet(nn.Module):
 
         a = torch.linspace(-0.5, 0.5, steps=self.grid_size, dtype=torch.float).view(1, self.grid_size).expand(self.grid_size, self.grid_size).reshape(1, -1)
         b = torch.linspace(-0.5, 0.5, steps=self.grid_size, dtype=torch.float).view(self.grid_size, 1).expand(self.grid_size, self.grid_size).reshape(1, -1)
-        self.folding_seed = torch.cat([a, b], dim=0).view(1, 2, self.grid_size ** 2).cuda() # 1 2 N
+        self.register_buffer('folding_seed', torch.cat([a, b], dim=0).view(1, 2, self.grid_size ** 2), persistent=False) # 1 2 N
         self.build_loss_func()
 
     def build_loss_func(self):
@@ -43,7 +43,7 @@ class PCN(nn.Module):
         )
         a = torch.linspace(-0.05, 0.05, steps=grid_size, dtype=torch.float).view(1, grid_size).expand(grid_size, grid_size).reshape(1, -1)
         b = torch.linspace(-0.05, 0.05, steps=grid_size, dtype=torch.float).view(grid_size, 1).expand(grid_size, grid_size).reshape(1, -1)
-        self.folding_seed = torch.cat([a, b], dim=0).view(1, 2, grid_size ** 2).cuda() # 1 2 S
+        self.register_buffer('folding_seed', torch.cat([a, b], dim=0).view(1, 2, grid_size ** 2), persistent=False) # 1 2 S
         self.build_loss_func()
 
     def build_loss_func(self):
@@ -4,9 +4,11 @@ from torch import nn
 from pointnet2_ops import pointnet2_utils
 from extensions.chamfer_dist import ChamferDistanceL1
 from .Transformer import PCTransformer
-from .build import MODELS
+from .build import MODELS, stage_index
+from utils.misc import fp32_geometry
 
 
+@fp32_geometry
 def fps(pc, num):
     fps_idx = pointnet2_utils.furthest_point_sample(pc, num) 
     sub_pc = pointnet2_utils.gather_operation(pc.transpose(1, 2).contiguous(), fps_idx).transpose(1,2).contiguous()
@@ -22,7 +24,7 @@ class Fold(nn.Module):
 
         a = torch.linspace(-1., 1., steps=step, dtype=torch.float).view(1, step).expand(step, step).reshape(1, -1)
         b = torch.linspace(-1., 1., steps=step, dtype=torch.float).view(step, 1).expand(step, step).reshape(1, -1)
-        self.folding_seed = torch.cat([a, b], dim=0).cuda()
+        self.register_buffer('folding_seed', torch.cat([a, b], dim=0), persistent=False)
 
         self.folding1 = nn.Sequential(
             nn.Conv1d(in_channel + 2, hidden_dim, 1),
@@ -78,6 +80,8 @@ class PoinTr(nn.Module):
             nn.Conv1d(1024, 1024, 1)
         )
         self.reduce_map = nn.Linear(self.trans_dim + 1027, self.trans_dim)
+        # outputs forward can stop at during inference
+        self.stages = ['coarse', 'fine']
         self.build_loss_func()
 
     def build_loss_func(self):
@@ -88,8 +92,14 @@ class PoinTr(nn.Module):
         loss_fine = self.loss_func(ret[1], gt)
         return loss_coarse, loss_fine
 
-    def forward(self, xyz):
+    def forward(self, xyz, stop_at=None):
         q, coarse_point_cloud = self.base_model(xyz) # B M C and B M 3
+        # coordinates stay fp32 under autocast
+        coarse_point_cloud = coarse_point_cloud.float()
+        if not self.training and stage_index(self, stop_at) == 0:
+            # skip the folding decoder, same coarse output as the full forward
+            coarse_point_cloud = torch.cat([coarse_point_cloud, fps(xyz, self.num_query)], dim=1).contiguous()
+            return (coarse_point_cloud, coarse_point_cloud)
     
         B, M ,C = q.shape
 
@@ -107,7 +117,7 @@ class PoinTr(nn.Module):
 
         # NOTE: foldingNet
         relative_xyz = self.foldingnet(rebuild_feature).reshape(B, M, 3, -1)    # B M 3 S
-        rebuild_points = (relative_xyz + coarse_point_cloud.unsqueeze(-1)).transpose(2,3).reshape(B, -1, 3)  # B N 3
+        rebuild_points = (relative_xyz.float() + coarse_point_cloud.unsqueeze(-1)).transpose(2,3).reshape(B, -1, 3)  # B N 3
 
         # NOTE: fc
         # relative_xyz = self.refine(rebuild_feature)  # BM 3S
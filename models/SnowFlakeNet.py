@@ -8,7 +8,7 @@ from torch import nn, einsum
 from pointnet2_ops import pointnet2_utils
 from extensions.chamfer_dist import ChamferDistanceL1, ChamferDistanceL1_PM
 from .SnowFlakeNet_utils import PointNet_SA_Module_KNN, MLP_Res, MLP_CONV, fps_subsample, Transformer, MLP_Res, grouping_operation, query_knn
-from .build import MODELS
+from .build import MODELS, stage_index
 
 def fps(pc, num):
     fps_idx = pointnet2_utils.furthest_point_sample(pc, num) 
@@ -200,21 +200,24 @@ class Decoder(nn.Module):
 
         self.uppers = nn.ModuleList(uppers)
 
-    def forward(self, feat, partial, return_P0=False):
+    def forward(self, feat, partial, return_P0=False, num_uppers=None):
         """
         Args:
             feat: Tensor, (b, dim_feat, n)
             partial: Tensor, (b, n, 3)
+            num_uppers: int, number of SPD stages to run, None runs all of them
         """
         arr_pcd = []
         pcd = self.decoder_coarse(feat).permute(0, 2, 1).contiguous()  # (B, num_pc, 3)
         arr_pcd.append(pcd)
+        if num_uppers == 0:
+            return arr_pcd
         pcd = fps_subsample(torch.cat([pcd, partial], 1), self.num_p0)
         if return_P0:
             arr_pcd.append(pcd)
         K_prev = None
         pcd = pcd.permute(0, 2, 1).contiguous()
-        for upper in self.uppers:
+        for upper in self.uppers[:num_uppers]:
             pcd, K_prev = upper(pcd, feat, K_prev)
             arr_pcd.append(pcd.permute(0, 2, 1).contiguous())
 
@@ -241,6 +244,8 @@ class SnowFlakeNet(nn.Module):
 
         self.feat_extractor = FeatureExtractor(out_dim=dim_feat)
         self.decoder = Decoder(dim_feat=dim_feat, num_pc=num_pc, num_p0=num_p0, radius=radius, up_factors=up_factors)
+        # outputs forward can stop at during inference: seed cloud Pc, then one per SPD stage
+        self.stages = ['pc'] + ['p%d' % (i + 1) for i in range(len(self.decoder.uppers))]
         self.build_loss_func()
 
     def build_loss_func(self):
@@ -273,17 +278,19 @@ class SnowFlakeNet(nn.Module):
         # losses = [cdc, cd1, cd2, cd3, partial_matching]
         return loss_coarse, loss_fine
 
-    def forward(self, point_cloud, return_P0=False):
+    def forward(self, point_cloud, return_P0=False, stop_at=None):
         """
         Args:
             point_cloud: (B, N, 3)
+            stop_at: str, one of self.stages, skip the remaining SPD stages (inference only)
         """
         pcd_bnc = point_cloud
         point_cloud = point_cloud.permute(0, 2, 1).contiguous()
         feat = self.feat_extractor(point_cloud)
-        out = self.decoder(feat, pcd_bnc, return_P0=return_P0)
+        num_uppers = None if self.training else stage_index(self, stop_at)
+        out = self.decoder(feat, pcd_bnc, return_P0=return_P0, num_uppers=num_uppers)
         if self.training:
             out = (*out, point_cloud.permute(0, 2, 1).contiguous())
         else:
-            out = (out[1], out[-1])    
+            out = (out[min(1, len(out) - 1)], out[-1])    
         return out
\ No newline at end of file
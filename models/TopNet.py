@@ -2,7 +2,7 @@ import torch
 import torch.nn as nn
 import math
 import numpy as np
-from .build import MODELS
+from .build import MODELS, stage_index
 from extensions.chamfer_dist import ChamferDistanceL2
 
 
@@ -59,6 +59,8 @@ class TopNet(nn.Module):
         )
         self.leaf_layer = self.get_tree_layer(self.Top_in_channel, 3, int(self.tarch[-1]))
         self.feature_layers = nn.ModuleList([self.get_tree_layer(self.Top_in_channel, self.Top_out_channel, int(self.tarch[d]) ) for d in range(1, self.nlevels - 1)])
+        # the intermediate tree levels are node features, only the leaf level has coordinates
+        self.stages = ['fine']
         self.build_loss_func()
 
     def build_loss_func(self):
@@ -84,7 +86,8 @@ class TopNet(nn.Module):
             nn.Conv1d(in_channel//8, out_channel * node, 1),
         )
 
-    def forward(self, xyz):
+    def forward(self, xyz, stop_at=None):
+        stage_index(self, stop_at)
         bs , n , _ = xyz.shape
         # encoder
         feature = self.first_conv(xyz.transpose(2,1))  # B 256 n
@@ -5,10 +5,12 @@ from timm.models.layers import DropPath,trunc_normal_
 
 from .dgcnn_group import DGCNN_Grouper
 from utils.logger import *
+from utils.misc import fp32_geometry
 import numpy as np
 # from knn_cuda import KNN
 # knn = KNN(k=8, transpose_mode=False)
 
+@fp32_geometry
 def knn_point(nsample, xyz, new_xyz):
     """
     Input:
@@ -12,8 +12,10 @@ import torch.nn as nn
 from timm.models.layers import DropPath
 from pointnet2_ops import pointnet2_utils
 from utils.logger import *
+from utils.misc import fp32_geometry
 import einops
 
+@fp32_geometry
 def knn_point(nsample, xyz, new_xyz):
     """
     Input:
@@ -27,6 +29,14 @@ def knn_point(nsample, xyz, new_xyz):
     _, group_idx = torch.topk(sqrdists, nsample, dim = -1, largest=False, sorted=False)
     return group_idx
 
+@fp32_geometry
+def _three_nn(unknown, known):
+    return pointnet2_utils.three_nn(unknown, known)
+
+@fp32_geometry
+def _three_interpolate(features, idx, weight):
+    return pointnet2_utils.three_interpolate(features, idx, weight)
+
 def square_distance(src, dst):
     """
     Calculate Euclid distance between each two points.
@@ -223,11 +233,11 @@ class DeformableLocalAttention(nn.Module):
         pos = einops.rearrange(pos, 'b g n c -> (b g) n c') # Bg N 3
         v = einops.rearrange(x, 'b n (g c) -> (b g) n c', g=self.n_group, c=self.group_dims) # Bg N c
         # three_nn and three_interpolate
-        dist, _idx = pointnet2_utils.three_nn(shift_pos.contiguous(), pos.contiguous())  #  Bg k*N 3, Bg k*N 3
+        dist, _idx = _three_nn(shift_pos.contiguous(), pos.contiguous())  #  Bg k*N 3, Bg k*N 3
         dist_reciprocal = 1.0 / (dist + 1e-8)
         norm = torch.sum(dist_reciprocal, dim=2, keepdim=True)
         weight = dist_reciprocal / norm
-        interpolated_feats = pointnet2_utils.three_interpolate(v.transpose(-1, -2).contiguous(), _idx, weight).transpose(-1, -2).contiguous() 
+        interpolated_feats = _three_interpolate(v.transpose(-1, -2).contiguous(), _idx, weight).transpose(-1, -2).contiguous() 
         interpolated_feats = einops.rearrange(interpolated_feats, '(b g) (n k) c  -> b n k (g c)', b=B, g=self.n_group, n=N, k=self.k) # B N k gc
 
         # some assert to ensure the right feature shape
@@ -348,11 +358,11 @@ class DeformableLocalCrossAttention(nn.Module):
             v_pos = einops.rearrange(v_pos, 'b g n c -> (b g) n c') # Bg Nk 3
             v = einops.rearrange(v, 'b n (g c) -> (b g) n c', g=self.n_group, c=self.group_dims) # Bg Nk c
             # three_nn and three_interpolate
-            dist, idx = pointnet2_utils.three_nn(shift_pos.contiguous(), v_pos.contiguous())  #  Bg k*N 3, Bg k*N 3
+            dist, idx = _three_nn(shift_pos.contiguous(), v_pos.contiguous())  #  Bg k*N 3, Bg k*N 3
             dist_reciprocal = 1.0 / (dist + 1e-8)
             norm = torch.sum(dist_reciprocal, dim=2, keepdim=True)
             weight = dist_reciprocal / norm
-            interpolated_feats = pointnet2_utils.three_interpolate(v.transpose(-1, -2).contiguous(), idx, weight).transpose(-1, -2).contiguous() 
+            interpolated_feats = _three_interpolate(v.transpose(-1, -2).contiguous(), idx, weight).transpose(-1, -2).contiguous() 
             interpolated_feats = einops.rearrange(interpolated_feats, '(b g) (n k) c  -> b n k (g c)', b=B, g=self.n_group, n=N, k=self.k) # B N k gc
 
             # some assert to ensure the right feature shape
@@ -449,11 +459,11 @@ class DeformableLocalCrossAttention(nn.Module):
             v_pos = einops.rearrange(v_pos, 'b g n c -> (b g) n c') # Bg Nk 3
             v = einops.rearrange(v, 'b n (g c) -> (b g) n c', g=self.n_group, c=self.group_dims) # Bg Nk c
             # three_nn and three_interpolate
-            dist, idx = pointnet2_utils.three_nn(shift_pos.contiguous(), v_pos.contiguous())  #  Bg k*N 3, Bg k*N 3
+            dist, idx = _three_nn(shift_pos.contiguous(), v_pos.contiguous())  #  Bg k*N 3, Bg k*N 3
             dist_reciprocal = 1.0 / (dist + 1e-8)
             norm = torch.sum(dist_reciprocal, dim=2, keepdim=True)
             weight = dist_reciprocal / norm
-            interpolated_feats = pointnet2_utils.three_interpolate(v.transpose(-1, -2).contiguous(), idx, weight).transpose(-1, -2).contiguous() 
+            interpolated_feats = _three_interpolate(v.transpose(-1, -2).contiguous(), idx, weight).transpose(-1, -2).contiguous() 
             interpolated_feats = einops.rearrange(interpolated_feats, '(b g) (n k) c  -> b n k (g c)', b=B, g=self.n_group, n=N, k=self.k) # B N k gc
 
             # some assert to ensure the right feature shape
@@ -579,11 +589,11 @@ class improvedDeformableLocalCrossAttention(nn.Module):
         v_pos = einops.rearrange(v_pos, 'b g n c -> (b g) n c') # Bg Nk 3
         v = einops.rearrange(v, 'b n (g c) -> (b g) n c', g=self.n_group, c=self.group_dims) # Bg Nk c
         # three_nn and three_interpolate
-        dist, idx = pointnet2_utils.three_nn(shift_pos.contiguous(), v_pos.contiguous())  #  Bg k*N 3, Bg k*N 3
+        dist, idx = _three_nn(shift_pos.contiguous(), v_pos.contiguous())  #  Bg k*N 3, Bg k*N 3
         dist_reciprocal = 1.0 / (dist + 1e-8)
         norm = torch.sum(dist_reciprocal, dim=2, keepdim=True)
         weight = dist_reciprocal / norm
-        interpolated_feats = pointnet2_utils.three_interpolate(v.transpose(-1, -2).contiguous(), idx, weight).transpose(-1, -2).contiguous() 
+        interpolated_feats = _three_interpolate(v.transpose(-1, -2).contiguous(), idx, weight).transpose(-1, -2).contiguous() 
         interpolated_feats = einops.rearrange(interpolated_feats, '(b g) (n k) c  -> b n k (g c)', b=B, g=self.n_group, n=N, k=self.k) # B N k gc
 
         # some assert to ensure the right feature shape
@@ -690,11 +700,11 @@ class improvedDeformableLocalGraphAttention(nn.Module):
             # interpolate
             shift_pos = einops.rearrange(shift_pos, 'b n k c -> b (n k) c') # B k*N 3
             # three_nn and three_interpolate
-            dist, idx = pointnet2_utils.three_nn(shift_pos.contiguous(), v_pos.contiguous())  #  B k*N 3, B k*N 3
+            dist, idx = _three_nn(shift_pos.contiguous(), v_pos.contiguous())  #  B k*N 3, B k*N 3
             dist_reciprocal = 1.0 / (dist + 1e-8)
             norm = torch.sum(dist_reciprocal, dim=2, keepdim=True)
             weight = dist_reciprocal / norm
-            interpolated_feats = pointnet2_utils.three_interpolate(v.transpose(-1, -2).contiguous(), idx, weight).transpose(-1, -2).contiguous() 
+            interpolated_feats = _three_interpolate(v.transpose(-1, -2).contiguous(), idx, weight).transpose(-1, -2).contiguous() 
             interpolated_feats = einops.rearrange(interpolated_feats, 'b (n k) c  -> b n k c', n=N, k=self.k) # B N k c
 
             q = q.unsqueeze(-2).expand(-1, -1, self.k, -1) # B N k C
@@ -758,11 +768,11 @@ class improvedDeformableLocalGraphAttention(nn.Module):
             # interpolate
             shift_pos = einops.rearrange(shift_pos, 'b n k c -> b (n k) c') # B k*N 3
             # three_nn and three_interpolate
-            dist, idx = pointnet2_utils.three_nn(shift_pos.contiguous(), v_pos.contiguous())  #  B k*N 3, B k*N 3
+            dist, idx = _three_nn(shift_pos.contiguous(), v_pos.contiguous())  #  B k*N 3, B k*N 3
             dist_reciprocal = 1.0 / (dist + 1e-8)
             norm = torch.sum(dist_reciprocal, dim=2, keepdim=True)
             weight = dist_reciprocal / norm
-            interpolated_feats = pointnet2_utils.three_interpolate(v.transpose(-1, -2).contiguous(), idx, weight).transpose(-1, -2).contiguous() 
+            interpolated_feats = _three_interpolate(v.transpose(-1, -2).contiguous(), idx, weight).transpose(-1, -2).contiguous() 
             interpolated_feats = einops.rearrange(interpolated_feats, 'b (n k) c  -> b n k c', n=N, k=self.k) # B N k c
             
             q = q.unsqueeze(-2).expand(-1, -1, self.k, -1) # B N k C
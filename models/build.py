@@ -15,3 +15,22 @@ def build_model_from_cfg(cfg, **kwargs):
     return MODELS.build(cfg, **kwargs)
 
 
+
+
+def stage_index(model, stop_at):
+    """
+    Position of `stop_at` in `model.stages`, the intermediate outputs the
+    model can stop at during inference (the last one is the full output).
+    Args:
+        stop_at (str or None): None runs every stage.
+    Returns:
+        int
+    """
+    stages = getattr(model, 'stages', None)
+    if stages is None:
+        raise ValueError(f'{type(model).__name__} does not support stop_at')
+    if stop_at is None:
+        return len(stages) - 1
+    if stop_at not in stages:
+        raise ValueError(f'unexpected stop_at {stop_at} for {type(model).__name__}, choose from {stages}')
+    return stages.index(stop_at)
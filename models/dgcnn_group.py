@@ -1,10 +1,12 @@
 import torch
 from torch import nn
 from pointnet2_ops import pointnet2_utils
+from utils.misc import fp32_geometry
 # from knn_cuda import KNN
 # knn = KNN(k=16, transpose_mode=False)
 
 
+@fp32_geometry
 def knn_point(nsample, xyz, new_xyz):
     """
     Input:
@@ -70,6 +72,7 @@ class DGCNN_Grouper(nn.Module):
 
     
     @staticmethod
+    @fp32_geometry
     def fps_downsample(coor, x, num_group):
         xyz = coor.transpose(1, 2).contiguous() # b, n, 3
         fps_idx = pointnet2_utils.furthest_point_sample(xyz, num_group)
@@ -2,14 +2,52 @@ import argparse
 import numpy as np
 import open3d as o3d
 import os
+import time
 from sklearn.neighbors import NearestNeighbors
 from tqdm import tqdm
-from custom.down_sample import Process_point_cloud
-from custom.inference import Inference
+from custom.down_sample import Process_point_cloud, Load_normalized_point_cloud
+from custom.inference import Inference, set_profile_capture
 from custom.inverse_normalize import Restore_point_cloud
-normal_record_map = {}
+from custom.tiling import Tiled_inference
+from custom.clustering import Objects_inference
+from custom.pose_cache import PoseCache
+from custom.manifest import FolderManifest
+from custom.cache import file_digest, model_digest, params_digest
+from custom.shm_ring import ShmPreprocessor
+from custom.profiling import ProfileCapture
 
-def batch_process_point_clouds(input_dir, output_dir, target_points=2048, sampling_method='fps', file_extension='.ply',args=None):
+# 不影响补全结果的命令行参数, 不参与处理清单的参数摘要
+_IO_ARGS = ['pc_root', 'pc', 'save_vis_img', 'out_pc_root', 'overwrite', 'preprocess_workers', 'profile', 'profile_dir']
+
+def run_params_digest(args, target_points, sampling_method, seed):
+    """本次运行影响补全结果的参数摘要(含模型文件摘要)"""
+    params = {k: v for k, v in vars(args).items() if k not in _IO_ARGS}
+    params.update(target_points=target_points, sampling_method=sampling_method, seed=seed, model=model_digest(args))
+    return params_digest(params)
+
+def preprocess_files(paths, target_points, sampling_method, seed, mode='single', preprocessor=None):
+    """按顺序产生每个文件预处理后的 (点云, center, scale_factor), 失败时产生异常对象
+
+    指定 preprocessor (ShmPreprocessor) 时在预处理进程中提前处理后面的文件, 点云是共享内存槽位的视图,
+    在取下一个文件前有效.
+    """
+    if preprocessor is not None:
+        yield from preprocessor.map(paths, target_points, sampling_method, seed)
+        return
+    for path in paths:
+        try:
+            if mode in ['tiled', 'objects']:
+                # 分块/多物体模式在完整分辨率的归一化点云上切分
+                success,center,scale_factor,pcd_filtered = Load_normalized_point_cloud(path)
+            else:
+                success,center,scale_factor,pcd_filtered = Process_point_cloud(path, target_points, sampling_method, seed)
+        except Exception as e:
+            yield e
+            continue
+        yield (pcd_filtered, center, scale_factor) if success else ValueError(f"{path} 预处理失败")
+
+def batch_process_point_clouds(input_dir, output_dir, target_points=2048, sampling_method='fps', file_extension='.ply',args=None,
+                               seed=None):
     """批量处理文件夹中的点云文件
 
     Args:
@@ -18,6 +56,7 @@ def batch_process_point_clouds(input_dir, output_dir, target_points=2048, sampli
         target_points (int): 采样后的点数
         sampling_method (str): 采样方法, 'random'、'fps'或'voxel'
         file_extension (str): 点云文件扩展名
+        seed (int, optional): 采样随机种子, 指定后结果可复现
     """
     # 确保输出目录存在
     os.makedirs(output_dir, exist_ok=True)
@@ -31,49 +70,130 @@ def batch_process_point_clouds(input_dir, output_dir, target_points=2048, sampli
 
     print(f"找到 {len(ply_files)} 个{file_extension}文件，开始处理...")
 
-    # 处理每个文件
-    success_count = 0
-    for filename in tqdm(ply_files):
+    # 输出文件夹中的处理清单, 输入和参数都没变且输出完整的文件直接跳过, 中途退出后重新运行即可继续
+    manifest = FolderManifest(output_dir)
+    run_digest = run_params_digest(args, target_points, sampling_method, seed)
+    overwrite = getattr(args, 'overwrite', False)
+
+    # 同一次运行的参数相同, 姿态缓存只需按形状查找
+    pose_cache = None
+    if getattr(args, 'pose_cache', False):
+        pose_cache = PoseCache(args.pose_cache_entries, args.pose_descriptor_tol, args.pose_chamfer_tol)
+
+    # 处理清单中已完成的文件直接跳过
+    skipped_count = 0
+    pending = []
+    for filename in ply_files:
         input_path = os.path.join(input_dir, filename)
 
         # 保持相同的文件名但更改扩展名为.ply
         output_filename = os.path.splitext(filename)[0] + '.ply'
         output_path = os.path.join(output_dir, output_filename)
 
-        try:
-            success,center,scale_factor,pcd_filtered = Process_point_cloud(input_path, target_points, sampling_method)
-            # 将归一化参数保存到字典中
-            normal_record_map[output_filename] = (center, scale_factor)
-            if success:
-                success_count += 1
-        except Exception as e:
-            print(f"处理 {filename} 时出错: {str(e)}")
+        input_digest = file_digest(input_path)
+        if not overwrite and manifest.is_done(filename, input_digest, run_digest, output_path):
+            skipped_count += 1
             continue
+        pending.append((filename, input_path, output_filename, output_path, input_digest))
 
-        pcd_out = Inference(pcd_filtered,args)
+    mode = getattr(args, 'mode', 'single')
+    preprocessor = None
+    if getattr(args, 'preprocess_workers', 0) > 0 and mode == 'single':
+        # 读取和预处理在独立进程中提前进行, 结果经共享内存槽位交给推理
+        preprocessor = ShmPreprocessor(args.preprocess_workers, max_points=max(target_points, 2048))
+    prepared = preprocess_files([p[1] for p in pending], target_points, sampling_method, seed, mode, preprocessor)
 
-        # 从字典中获取当前文件的原始中心点和缩放因子
-        current_center, current_scale_factor = normal_record_map[output_filename]
-        restored_pcd = Restore_point_cloud(pcd_out, current_center, current_scale_factor)
+    # 用 torch.profiler 录制前几次前向
+    capture = None
+    if getattr(args, 'profile', 0) > 0:
+        capture = ProfileCapture(args.profile_dir, args.profile)
+        set_profile_capture(capture)
 
-        # 统计离群点移除
-        cl, ind = restored_pcd.remove_statistical_outlier(nb_neighbors=20, std_ratio=2)
-        resuilt_pcd = restored_pcd.select_by_index(ind)
-        # print("移除离群点后点云点数：", len(pcd_filtered.points))
+    # 处理每个文件
+    success_count = 0
+    try:
+        for (filename, input_path, output_filename, output_path, input_digest), result in tqdm(
+                zip(pending, prepared), total=len(pending)):
+            start_time = time.perf_counter()
+            if isinstance(result, Exception):
+                print(f"处理 {filename} 时出错: {str(result)}")
+                manifest.append(filename, input_digest, run_digest, output_path, 'failed', error=str(result))
+                continue
+            pcd_filtered, center, scale_factor = result
+            success_count += 1
 
-        o3d.io.write_point_cloud(output_path, resuilt_pcd)
+            if mode == 'objects':
+                pcd_out = Objects_inference(pcd_filtered, args, voxel_size=args.cluster_voxel_size,
+                                            min_points=args.min_cluster_points, target_points=target_points,
+                                            sampling_method=sampling_method, seed=seed)
+            elif mode == 'tiled':
+                pcd_out = Tiled_inference(pcd_filtered, args, tile_method=args.tile_method, tile_size=args.tile_size,
+                                          tile_overlap=args.tile_overlap, cluster_eps=args.cluster_eps,
+                                          merge_voxel_size=args.merge_voxel_size, target_points=target_points,
+                                          sampling_method=sampling_method, seed=seed)
+            elif pose_cache is not None:
+                points = pcd_filtered if isinstance(pcd_filtered, np.ndarray) else np.asarray(pcd_filtered.points)
+                pcd_out, token = pose_cache.lookup('pipeline', points)
+                if pcd_out is None:
+                    start = time.perf_counter()
+                    pcd_out = Inference(pcd_filtered,args,seed=seed)
+                    pose_cache.put('pipeline', token, pcd_out, (time.perf_counter() - start) * 1000)
+            else:
+                pcd_out = Inference(pcd_filtered,args,seed=seed)
+
+            restored_pcd = Restore_point_cloud(pcd_out, center, scale_factor)
+
+            # 统计离群点移除
+            cl, ind = restored_pcd.remove_statistical_outlier(nb_neighbors=20, std_ratio=2)
+            resuilt_pcd = restored_pcd.select_by_index(ind)
+            # print("移除离群点后点云点数：", len(pcd_filtered.points))
+
+            o3d.io.write_point_cloud(output_path, resuilt_pcd)
+            manifest.append(filename, input_digest, run_digest, output_path, 'success',
+                            {'total': round((time.perf_counter() - start_time) * 1000, 2)})
+    finally:
+        if preprocessor is not None:
+            prepared.close()
+            preprocessor.close()
+        if capture is not None:
+            set_profile_capture(None)
 
     # print(f"成功正则化，采样,移除离群点 {success_count}/{len(ply_files)} 个文件")
     print(f"成功处理 {success_count}/{len(ply_files)} 个文件")
+    if skipped_count:
+        print(f"按处理清单跳过已完成的文件 {skipped_count} 个 ({manifest.path})")
+    if pose_cache is not None:
+        stats = pose_cache.stats()
+        print(f"姿态缓存: 命中 {stats['hits']}/{stats['lookups']} ({stats['hit_rate'] * 100:.1f}%), "
+              f"节省推理 {stats['saved_ms'] / 1000:.2f}秒, 查找开销 {stats['lookup_ms'] / 1000:.2f}秒")
+    if capture is not None:
+        if capture.captured and not capture.done:
+            # 文件数少于 --profile 时用已录制的前向生成汇总
+            capture.summary_path = capture.write_summary()
+        print(f"profiler: 录制 {capture.captured} 次前向, trace 和汇总在 {capture.output_dir}")
 
 def get_args():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         'model_config',
-        help = 'yaml config file')
+        nargs = '?',
+        help = 'yaml config file (pytorch backend)')
     parser.add_argument(
         'model_checkpoint',
-        help = 'pretrained weight')
+        nargs = '?',
+        help = 'pretrained weight (pytorch backend)')
+    parser.add_argument(
+        '--backend',
+        choices=['pytorch', 'torchscript', 'onnx'],
+        default='pytorch',
+        help='inference backend, torchscript/onnx load an artifact exported by tools/export.py')
+    parser.add_argument('--model_artifact', type=str, default=None, help='exported model file')
+    parser.add_argument('--ort_threads', type=int, default=0, help='onnxruntime intra-op threads')
+    parser.add_argument(
+        '--ort_opt_level',
+        choices=['disable', 'basic', 'extended', 'all'],
+        default='all',
+        help='onnxruntime graph optimization level')
     parser.add_argument('--pc_root', type=str, default='', help='Pc root')
     parser.add_argument('--pc', type=str, default='', help='Pc file')
     parser.add_argument(
@@ -89,11 +209,94 @@ def get_args():
         'Default not saving the visualization images.')
     parser.add_argument(
         '--device', default='cuda:0', help='Device used for inference')
+    parser.add_argument(
+        '--optimize',
+        action='store_true',
+        default=False,
+        help='fold BatchNorm, precompute constants and drop Dropout/DropPath at load time')
+    parser.add_argument(
+        '--quantize',
+        choices=['dynamic-int8'],
+        default=None,
+        help='Dynamically quantize nn.Linear layers to int8 (pytorch backend, cpu only)')
+    parser.add_argument(
+        '--precision',
+        choices=['fp32', 'bf16', 'fp16'],
+        default='fp32',
+        help='Default inference precision, bf16/fp16 run the forward pass under autocast (pytorch backend)')
+    parser.add_argument(
+        '--stop_at',
+        type=str,
+        default=None,
+        help='Default decoder stage to stop at, e.g. coarse for AdaPoinTr/PoinTr, pc/p1/p2 for SnowFlakeNet (pytorch backend)')
+    parser.add_argument(
+        '--num_query',
+        type=int,
+        default=None,
+        help='Default number of AdaPoinTr queries, fewer queries are faster and give num_query * factor points')
+    parser.add_argument(
+        '--latency_budget_ms',
+        type=float,
+        default=None,
+        help='Default latency budget, picks the AdaPoinTr query count from --query_calibration')
+    parser.add_argument(
+        '--query_calibration',
+        type=str,
+        default=None,
+        help='Query count / latency table written by tools/calibrate_queries.py')
+    parser.add_argument(
+        '--max_batch_size',
+        type=int,
+        default=None,
+        help='Maximum point clouds per forward pass when several are batched; tiles and objects are submitted '
+             'as separate jobs of this many clouds (default 8)')
+    parser.add_argument(
+        '--mode', choices=['single', 'tiled', 'objects'], default='single',
+        help='tiled splits scene-scale clouds into tiles, objects completes every object of a multi-object scan')
+    parser.add_argument('--tile_method', choices=['grid', 'dbscan'], default='grid')
+    parser.add_argument('--tile_size', type=float, default=0.25, help='tile edge in normalized coordinates')
+    parser.add_argument('--tile_overlap', type=float, default=0.25, help='overlap ratio of neighbouring tiles')
+    parser.add_argument('--cluster_eps', type=float, default=0.05, help='DBSCAN radius in normalized coordinates')
+    parser.add_argument('--merge_voxel_size', type=float, default=0.002, help='voxel size used to merge tile outputs')
+    parser.add_argument('--cluster_voxel_size', type=float, default=0.02, help='voxel size of the objects clustering')
+    parser.add_argument('--min_cluster_points', type=int, default=64, help='smaller clusters are dropped as noise')
+    parser.add_argument('--seed', type=int, default=None, help='sampling seed, makes the outputs reproducible')
+    parser.add_argument(
+        '--overwrite',
+        action='store_true',
+        default=False,
+        help='ignore the manifest in the output folder and recompute every file')
+    parser.add_argument(
+        '--pose_cache',
+        action='store_true',
+        default=False,
+        help='reuse completions of rigidly transformed copies of already completed shapes (single mode)')
+    parser.add_argument('--pose_cache_entries', type=int, default=1024, help='maximum shapes kept by the pose cache')
+    parser.add_argument('--pose_descriptor_tol', type=float, default=0.05, help='maximum shape descriptor distance')
+    parser.add_argument('--pose_chamfer_tol', type=float, default=0.02, help='maximum Chamfer distance in the canonical frame')
+    parser.add_argument(
+        '--preprocess_workers',
+        type=int,
+        default=0,
+        help='preprocess files in this many processes ahead of inference, handing clouds over in shared memory (single mode)')
+    parser.add_argument(
+        '--profile',
+        type=int,
+        default=0,
+        help='capture a torch.profiler trace of the first N forward passes, with a top-operators summary per submodule')
+    parser.add_argument('--profile_dir', type=str, default='profiles', help='output directory of --profile')
     args = parser.parse_args()
 
     assert args.save_vis_img or (args.out_pc_root != '')
-    assert args.model_config is not None
-    assert args.model_checkpoint is not None
+    if args.backend == 'pytorch':
+        assert args.model_config is not None
+        assert args.model_checkpoint is not None
+    else:
+        assert args.model_artifact is not None
+    if args.precision != 'fp32':
+        assert args.backend == 'pytorch', '--precision bf16/fp16 only supports the pytorch backend'
+    if args.quantize is not None:
+        assert args.backend == 'pytorch' and args.device.lower() == 'cpu', '--quantize only supports the pytorch backend on cpu'
     assert (args.pc != '') or (args.pc_root != '')
 
     return args
@@ -111,5 +314,6 @@ if __name__ == "__main__":
         target_points=8192,  # PoinTr模型需要2048个点
         sampling_method='fps',  # 'random', 'fps', 或 'voxel'
         file_extension='.ply',
-        args=args
+        args=args,
+        seed=args.seed
     )
\ No newline at end of file
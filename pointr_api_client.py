@@ -1,7 +1,25 @@
 import requests
 import os
+import json
 import time
-from typing import Optional, Dict, Any, Union, List
+import base64
+import numpy as np
+from typing import Optional, Dict, Any, Union, List, Iterator, Callable
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """解析 Server-Timing 响应头，返回 {阶段名: 耗时(毫秒)}，其中 'total' 是服务器处理请求的总耗时"""
+    timings = {}
+    for entry in (header or "").split(","):
+        name, _, params = entry.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if name and key == "dur":
+                timings[name] = float(value)
+    return timings
+
+
+def format_timings(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{name} {ms:.1f}ms" for name, ms in timings.items())
 
 def complete_point_cloud(
     input_path: str,
@@ -10,7 +28,14 @@ def complete_point_cloud(
     target_points: int = 4096,
     sampling_method: str = "fps",
     timeout: int = 300,
-    verbose: bool = True
+    verbose: bool = True,
+    precision: Optional[str] = None,
+    stop_at: Optional[str] = None,
+    num_query: Optional[int] = None,
+    latency_budget_ms: Optional[float] = None,
+    seed: Optional[int] = None,
+    priority: Optional[str] = None,
+    deadline_ms: Optional[float] = None
 ) -> Dict[str, Any]:
     """调用点云补全API服务处理单个点云文件
     
@@ -22,9 +47,19 @@ def complete_point_cloud(
         sampling_method (str): 采样方法，可选 "fps", "random", "voxel"，默认 "fps"
         timeout (int): 请求超时时间（秒），默认 300
         verbose (bool): 是否显示详细信息，默认 True
+        precision (str, optional): 推理精度 "fp32", "bf16", "fp16"，默认使用服务器设置
+        stop_at (str, optional): 提前结束的解码阶段，如 "coarse"，可选值见 /model_info
+        num_query (int, optional): AdaPoinTr 查询数，范围见 /model_info 的 query_range
+        latency_budget_ms (float, optional): 延迟预算(毫秒)，由服务器按标定表选择查询数
+        seed (int, optional): 采样随机种子，默认使用服务器默认值 0，相同输入和参数的结果可被服务器缓存命中
+        priority (str, optional): 调度优先级 "interactive" 或 "bulk"，默认 "interactive"（服务器以 --scheduler 启动时生效）
+        deadline_ms (float, optional): 截止时间（从服务器收到请求起的毫秒数），超时仍未开始推理的请求被取消，
+            返回的 error 中给出原因
         
     Returns:
-        Dict[str, Any]: 包含处理结果的字典，至少包含 'status' 和 'output_file' 字段
+        Dict[str, Any]: 包含处理结果的字典，至少包含 'status' 和 'output_file' 字段。成功时 'timings' 为服务器端
+            各阶段耗时（毫秒，如 read、normalize、sample、prefilter、inference、restore、postfilter、write），
+            'server_time' 为服务器处理请求的总耗时（秒），'elapsed_time' 减去它即网络传输和排队等其他开销
         
     Raises:
         Exception: 当API请求失败或超时时抛出
@@ -51,6 +86,20 @@ def complete_point_cloud(
         "target_points": target_points,
         "sampling_method": sampling_method
     }
+    if precision is not None:
+        request_data["precision"] = precision
+    if stop_at is not None:
+        request_data["stop_at"] = stop_at
+    if num_query is not None:
+        request_data["num_query"] = num_query
+    if latency_budget_ms is not None:
+        request_data["latency_budget_ms"] = latency_budget_ms
+    if seed is not None:
+        request_data["seed"] = seed
+    if priority is not None:
+        request_data["priority"] = priority
+    if deadline_ms is not None:
+        request_data["deadline_ms"] = deadline_ms
     
     # 检查服务器健康状态
     if verbose:
@@ -86,15 +135,27 @@ def complete_point_cloud(
         if response.status_code == 200:
             result = response.json()
             elapsed_time = time.time() - start_time
+            timings = result.get("timings", {})
+            server_ms = parse_server_timing(response.headers.get("Server-Timing")).get("total")
+            server_time = server_ms / 1000 if server_ms is not None else None
             
             if verbose:
-                print(f"处理成功! 用时: {elapsed_time:.2f}秒")
+                note = " (命中缓存)" if result.get("cached") else (" (与相同请求合并)" if result.get("coalesced") else "")
+                print(f"处理成功! 用时: {elapsed_time:.2f}秒" + note)
+                if timings:
+                    print(f"服务器各阶段耗时: {format_timings(timings)}")
+                if server_time is not None:
+                    print(f"服务器总耗时: {server_time:.2f}秒, 网络及其他: {elapsed_time - server_time:.2f}秒")
                 print(f"输出文件: {result['output_file']}")
             
             return {
                 "status": "success",
                 "input_file": result["input_file"],
                 "output_file": result["output_file"],
+                "cached": result.get("cached", False),
+                "coalesced": result.get("coalesced", False),
+                "timings": timings,
+                "server_time": server_time,
                 "elapsed_time": elapsed_time
             }
         else:
@@ -129,6 +190,198 @@ def complete_point_cloud(
         }
 
 
+def decode_points(content: bytes, headers) -> np.ndarray:
+    """把 /complete_binary 的响应体解码为 N x 3 的 float32 坐标"""
+    encoding = headers.get("X-Point-Encoding", "float32")
+    if encoding == "float32":
+        return np.frombuffer(content, dtype="<f4").reshape(-1, 3)
+    if encoding == "float16":
+        return np.frombuffer(content, dtype="<f2").reshape(-1, 3).astype(np.float32)
+    if encoding == "int16":
+        scale = np.array([float(v) for v in headers["X-Point-Scale"].split(",")], dtype=np.float32)
+        offset = np.array([float(v) for v in headers["X-Point-Offset"].split(",")], dtype=np.float32)
+        quantized = np.frombuffer(content, dtype="<i2").reshape(-1, 3).astype(np.float32)
+        return (quantized + 32768) * scale + offset
+    raise ValueError(f"不支持的编码: {encoding}")
+
+
+def complete_point_cloud_binary(
+    points: Union[str, np.ndarray],
+    server_url: str = "http://223.109.239.8:4011",
+    target_points: int = 4096,
+    sampling_method: str = "fps",
+    timeout: int = 300,
+    verbose: bool = True,
+    encoding: str = "float32",
+    compression: Optional[str] = None,
+    precision: Optional[str] = None,
+    stop_at: Optional[str] = None,
+    num_query: Optional[int] = None,
+    latency_budget_ms: Optional[float] = None,
+    seed: Optional[int] = None,
+    priority: Optional[str] = None,
+    deadline_ms: Optional[float] = None
+) -> Dict[str, Any]:
+    """上传点云数据调用补全服务，不需要与服务器共享文件系统
+    
+    Args:
+        points (str or np.ndarray): 本地 PLY 文件路径（原样上传文件字节），或 N x 3 的坐标数组（以 float32 上传）
+        server_url (str): API服务器URL，默认 "http://223.109.239.8:4011"
+        target_points (int): 采样点数，默认 4096
+        sampling_method (str): 采样方法，可选 "fps", "random", "voxel"，默认 "fps"
+        timeout (int): 请求超时时间（秒），默认 300
+        verbose (bool): 是否显示详细信息，默认 True
+        encoding (str): 返回坐标的编码 "float32", "float16" 或 "int16"(按包围盒量化)，默认 "float32"
+        compression (str, optional): 响应压缩 "gzip" 或 "deflate"，默认不压缩
+        precision, stop_at, num_query, latency_budget_ms, seed, priority, deadline_ms: 同 complete_point_cloud
+        
+    Returns:
+        Dict[str, Any]: 成功时 'points' 字段为补全后的 N x 3 float32 坐标，'timings' 为 Server-Timing 响应头中的
+            服务器端各阶段耗时（毫秒，含 'total'）
+    """
+    if isinstance(points, str):
+        with open(points, "rb") as f:
+            body = f.read()
+        source = points
+    else:
+        body = np.ascontiguousarray(points, dtype="<f4").reshape(-1, 3).tobytes()
+        source = f"<{len(body) // 12} points>"
+    
+    params = {
+        "target_points": target_points,
+        "sampling_method": sampling_method,
+        "encoding": encoding
+    }
+    optional = {"compression": compression, "precision": precision, "stop_at": stop_at,
+                "num_query": num_query, "latency_budget_ms": latency_budget_ms, "seed": seed,
+                "priority": priority, "deadline_ms": deadline_ms}
+    params.update({k: v for k, v in optional.items() if v is not None})
+    
+    if verbose:
+        print(f"正在上传点云: {source} ({len(body) / 1024:.1f}KB)")
+    
+    start_time = time.time()
+    
+    try:
+        # 响应的 Content-Encoding 由 requests 自动解压
+        response = requests.post(
+            f"{server_url}/complete_binary",
+            params=params,
+            data=body,
+            headers={"Content-Type": "application/octet-stream"},
+            timeout=timeout
+        )
+        
+        if response.status_code == 200:
+            result = decode_points(response.content, response.headers)
+            elapsed_time = time.time() - start_time
+            timings = parse_server_timing(response.headers.get("Server-Timing"))
+            
+            if verbose:
+                print(f"处理成功! 用时: {elapsed_time:.2f}秒, 输出点数: {len(result)}")
+                if timings:
+                    print(f"服务器各阶段耗时: {format_timings(timings)}")
+            
+            return {
+                "status": "success",
+                "points": result,
+                "cached": response.headers.get("X-Cached") == "true",
+                "coalesced": response.headers.get("X-Coalesced") == "true",
+                "timings": timings,
+                "elapsed_time": elapsed_time
+            }
+        else:
+            error_message = response.json().get("detail", "未知错误")
+            
+            if verbose:
+                print(f"处理失败: {error_message}")
+            
+            return {
+                "status": "error",
+                "error": error_message
+            }
+    except requests.Timeout:
+        if verbose:
+            print(f"请求超时 (>{timeout}秒)")
+        
+        return {
+            "status": "error",
+            "error": f"请求超时 (>{timeout}秒)"
+        }
+    except Exception as e:
+        if verbose:
+            print(f"请求异常: {str(e)}")
+        
+        return {
+            "status": "error",
+            "error": str(e)
+        }
+
+
+def complete_point_cloud_batch(
+    items: List[Union[str, np.ndarray, Dict[str, Any]]],
+    server_url: str = "http://223.109.239.8:4011",
+    target_points: int = 4096,
+    sampling_method: str = "fps",
+    timeout: int = 600,
+    encoding: str = "float32",
+    precision: Optional[str] = None,
+    stop_at: Optional[str] = None,
+    num_query: Optional[int] = None,
+    seed: Optional[int] = None,
+    priority: Optional[str] = None,
+    deadline_ms: Optional[float] = None
+) -> Iterator[Dict[str, Any]]:
+    """一次请求补全多个点云，逐条返回每个条目的结果
+    
+    Args:
+        items (list): 每个条目可以是服务器上的点云路径、N x 3 坐标数组，或直接是 /complete_batch 的条目字典
+            （input_file/data/output_file 及单独的 target_points、sampling_method、seed 等参数）
+        server_url (str): API服务器URL，默认 "http://223.109.239.8:4011"
+        target_points, sampling_method, precision, stop_at, num_query, seed: 所有条目的默认参数，同 complete_point_cloud
+        timeout (int): 两次收到数据之间的超时时间（秒），默认 600
+        encoding (str): 没有 output_file 的条目返回坐标的编码 "float32", "float16" 或 "int16"
+        priority, deadline_ms: 同 complete_point_cloud，批量请求默认 "bulk"；超时取消的条目 status 为 "cancelled"，
+            原因在 'reason' 字段
+        
+    Yields:
+        Dict[str, Any]: 每个条目完成后产生一条记录，成功且内嵌返回时 'points' 为解码后的坐标；
+            最后一条是汇总 {"total_items", "successful", "failed"}
+    """
+    payload_items = []
+    for item in items:
+        if isinstance(item, str):
+            payload_items.append({"input_file": item})
+        elif isinstance(item, np.ndarray):
+            data = np.ascontiguousarray(item, dtype="<f4").reshape(-1, 3).tobytes()
+            payload_items.append({"data": base64.b64encode(data).decode("ascii")})
+        else:
+            payload_items.append(item)
+    
+    request_data = {
+        "items": payload_items,
+        "target_points": target_points,
+        "sampling_method": sampling_method,
+        "encoding": encoding
+    }
+    optional = {"precision": precision, "stop_at": stop_at, "num_query": num_query, "seed": seed,
+                "priority": priority, "deadline_ms": deadline_ms}
+    request_data.update({k: v for k, v in optional.items() if v is not None})
+    
+    with requests.post(f"{server_url}/complete_batch", json=request_data, stream=True, timeout=timeout) as response:
+        if response.status_code != 200:
+            raise RuntimeError(response.json().get("detail", "未知错误"))
+        for line in response.iter_lines():
+            if not line:
+                continue
+            record = json.loads(line)
+            if "data" in record:
+                headers = {"X-Point-Encoding": record["encoding"],
+                           "X-Point-Scale": record.get("scale"), "X-Point-Offset": record.get("offset")}
+                record["points"] = decode_points(base64.b64decode(record.pop("data")), headers)
+            yield record
+
+
 def complete_point_cloud_folder(
     input_folder: str,
     output_folder: str,
@@ -138,7 +391,16 @@ def complete_point_cloud_folder(
     file_extension: str = ".ply",
     timeout: int = 600,
     verbose: bool = True,
-    skip_files: List[str] = None
+    skip_files: List[str] = None,
+    precision: Optional[str] = None,
+    stop_at: Optional[str] = None,
+    num_query: Optional[int] = None,
+    latency_budget_ms: Optional[float] = None,
+    seed: Optional[int] = None,
+    on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+    overwrite: bool = False,
+    priority: Optional[str] = None,
+    deadline_ms: Optional[float] = None
 ) -> Dict[str, Any]:
     """调用点云补全API服务处理整个文件夹的点云文件
     
@@ -152,9 +414,21 @@ def complete_point_cloud_folder(
         timeout (int): 请求超时时间（秒），默认 600
         verbose (bool): 是否显示详细信息，默认 True
         skip_files (List[str], optional): 需要跳过补全直接复制的文件名列表（不含扩展名）
+        precision (str, optional): 推理精度 "fp32", "bf16", "fp16"，默认使用服务器设置
+        stop_at (str, optional): 提前结束的解码阶段，如 "coarse"，可选值见 /model_info
+        num_query (int, optional): AdaPoinTr 查询数，范围见 /model_info 的 query_range
+        latency_budget_ms (float, optional): 延迟预算(毫秒)，由服务器按标定表选择查询数
+        seed (int, optional): 采样随机种子，默认使用服务器默认值 0，相同输入和参数的结果可被服务器缓存命中
+        on_result (callable, optional): 指定时使用流式接口 /complete_folder_stream，每个文件写出后立即以该文件的记录
+            （含各阶段耗时 timings）调用，timeout 变为两次收到数据之间的超时时间
+        overwrite (bool): 忽略输出文件夹中的处理清单，重新处理所有文件，默认 False（跳过已完成的文件）
+        priority (str, optional): 调度优先级，文件夹请求默认 "bulk"
+        deadline_ms (float, optional): 整个任务的截止时间（从服务器收到请求起的毫秒数），超时后剩余文件的 status 为
+            "cancelled"，原因在 'reason' 字段
         
     Returns:
-        Dict[str, Any]: 包含处理结果的字典，至少包含 'status', 'total_files', 'successful' 和 'results' 字段
+        Dict[str, Any]: 包含处理结果的字典，至少包含 'status', 'total_files', 'successful' 和 'results' 字段，
+            'results' 中每个文件的记录含服务器端各阶段耗时 'timings'（毫秒）
         
     Raises:
         Exception: 当API请求失败或超时时抛出
@@ -180,8 +454,23 @@ def complete_point_cloud_folder(
         "target_points": target_points,
         "sampling_method": sampling_method,
         "file_extension": file_extension,
-        "skip_files": skip_files
+        "skip_files": skip_files,
+        "overwrite": overwrite
     }
+    if precision is not None:
+        request_data["precision"] = precision
+    if stop_at is not None:
+        request_data["stop_at"] = stop_at
+    if num_query is not None:
+        request_data["num_query"] = num_query
+    if latency_budget_ms is not None:
+        request_data["latency_budget_ms"] = latency_budget_ms
+    if seed is not None:
+        request_data["seed"] = seed
+    if priority is not None:
+        request_data["priority"] = priority
+    if deadline_ms is not None:
+        request_data["deadline_ms"] = deadline_ms
     
     # 检查服务器健康状态
     if verbose:
@@ -209,15 +498,32 @@ def complete_point_cloud_folder(
     start_time = time.time()
     
     try:
-        response = requests.post(
-            f"{server_url}/complete_folder",
-            json=request_data,
-            timeout=timeout
-        )
+        if on_result is None:
+            response = requests.post(
+                f"{server_url}/complete_folder",
+                json=request_data,
+                timeout=timeout
+            )
+        else:
+            response = requests.post(
+                f"{server_url}/complete_folder_stream",
+                json=request_data,
+                stream=True,
+                timeout=timeout
+            )
         
         # 解析响应
         if response.status_code == 200:
-            result = response.json()
+            if on_result is None:
+                result = response.json()
+            else:
+                # 每行一个文件的记录, 最后一行是与 /complete_folder 相同的汇总
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    result = json.loads(line)
+                    if "total_files" not in result:
+                        on_result(result)
             elapsed_time = time.time() - start_time
             
             if verbose:
@@ -225,6 +531,10 @@ def complete_point_cloud_folder(
                 print(f"总文件数: {result['total_files']}, 成功处理: {result['successful']}")
                 if 'copied_files' in result:
                     print(f"直接复制: {result['copied_files']}个, 点云补全: {result['completed_files']}个")
+                if result.get('skipped_files'):
+                    print(f"按处理清单跳过已完成的文件: {result['skipped_files']}个")
+                if result.get('cancelled_files'):
+                    print(f"超过截止时间被取消的文件: {result['cancelled_files']}个")
             
             return {
                 "status": "success",
@@ -234,6 +544,8 @@ def complete_point_cloud_folder(
                 "successful": result["successful"],
                 "copied_files": result.get("copied_files", 0),
                 "completed_files": result.get("completed_files", result["successful"]),
+                "skipped_files": result.get("skipped_files", 0),
+                "cancelled_files": result.get("cancelled_files", 0),
                 "results": result["results"],
                 "elapsed_time": elapsed_time
             }
@@ -0,0 +1,167 @@
+##############################################################
+# Accuracy drift / latency report of reduced-precision serving variants
+###############################################################
+import argparse
+import os
+import sys
+import contextlib
+import numpy as np
+import torch
+import torch.nn as nn
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BASE_DIR, '../'))
+
+from tools import builder
+from tools.runner import test
+from tools.benchmark import random_input, time_forward, print_table
+from utils.config import cfg_from_yaml_file
+from custom.inference import load_inference_model, model_op_context, precision_context
+from extensions.chamfer_dist import ChamferDistanceL1, ChamferDistanceL2
+
+VARIANTS = {
+    # name: (quantize, precision), int8 models always run on cpu
+    'fp32': (None, 'fp32'),
+    'bf16': (None, 'bf16'),
+    'fp16': (None, 'fp16'),
+    'dynamic-int8': ('dynamic-int8', 'fp32'),
+}
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'model_config',
+        help = 'yaml config file')
+    parser.add_argument(
+        'model_checkpoint',
+        help = 'pretrained weight')
+    parser.add_argument(
+        '--variants', type=str, default='fp32,dynamic-int8', help='comma separated, from %s' % ', '.join(VARIANTS))
+    parser.add_argument('--device', default='cpu', help='Device for the fp32/bf16/fp16 variants')
+    parser.add_argument('--num_samples', type=int, default=200, help='size of the validation subset')
+    parser.add_argument('--mode', choices=['easy', 'median', 'hard'], default='median', help='crop ratio for ShapeNet')
+    parser.add_argument(
+        '--optimize',
+        action='store_true',
+        default=False,
+        help='run optimize_for_inference before evaluating')
+    parser.add_argument('--batch_sizes', type=str, default='1,4', help='comma separated batch sizes for the latency report')
+    parser.add_argument('--num_points', type=int, default=2048, help='number of input points for the latency report')
+    parser.add_argument('--threads', type=int, default=0, help='intra-op threads, 0 keeps the default')
+    parser.add_argument('--warmup', type=int, default=3, help='untimed iterations')
+    parser.add_argument('--repeats', type=int, default=20, help='timed iterations')
+    parser.add_argument('--num_workers', type=int, default=4)
+    args = parser.parse_args()
+
+    args.variants = [v.strip() for v in args.variants.split(',') if v.strip()]
+    for variant in args.variants:
+        if variant not in VARIANTS:
+            raise ValueError(f'unknown variant {variant}, choose from {list(VARIANTS)}')
+    if 'fp32' not in args.variants and any(VARIANTS[v][1] != 'fp32' for v in args.variants):
+        # the bf16/fp16 drift is reported against fp32, evaluate it first
+        args.variants.insert(0, 'fp32')
+    args.batch_sizes = [int(b) for b in args.batch_sizes.split(',')]
+    args.device = args.device.lower()
+    # needed by builder.dataset_builder and runner.test
+    args.distributed = False
+    args.experiment_path = os.path.join(os.path.dirname(os.path.abspath(args.model_checkpoint)), 'accuracy_report')
+    return args
+
+
+def variant_args(args, variant):
+    quantize, precision = VARIANTS[variant]
+    return argparse.Namespace(
+        backend='pytorch',
+        model_config=args.model_config,
+        model_checkpoint=args.model_checkpoint,
+        device='cpu' if quantize else args.device,
+        optimize=args.optimize,
+        quantize=quantize,
+        precision=precision)
+
+
+def forward_context(v_args):
+    stack = contextlib.ExitStack()
+    stack.enter_context(model_op_context(v_args))
+    stack.enter_context(precision_context(v_args))
+    return stack
+
+
+class EvalBridge(nn.Module):
+    '''
+        runner.test feeds CUDA tensors and computes the metrics with the CUDA
+        chamfer kernels; run the wrapped model on its own device in between.
+    '''
+    def __init__(self, model, v_args):
+        super().__init__()
+        self.model = model
+        self.v_args = v_args
+
+    def forward(self, x):
+        metric_device = x.device
+        with forward_context(self.v_args):
+            ret = self.model(x.to(self.v_args.device))
+        return tuple(r.float().to(metric_device) for r in ret)
+
+
+def build_subset_loader(args, config):
+    _, dataloader = builder.dataset_builder(args, config.dataset.test)
+    dataset = dataloader.dataset
+    indices = np.linspace(0, len(dataset) - 1, min(args.num_samples, len(dataset))).astype(int).tolist()
+    return torch.utils.data.DataLoader(torch.utils.data.Subset(dataset, indices), batch_size=1,
+                                       shuffle=False, num_workers=int(args.num_workers))
+
+
+def evaluate(args, config, test_dataloader):
+    if config.dataset.test._base_.NAME == 'KITTI':
+        raise ValueError('KITTI has no ground truth, the accuracy report needs PCN, ShapeNet or Projected_ShapeNet')
+    ChamferDisL1 = ChamferDistanceL1()
+    ChamferDisL2 = ChamferDistanceL2()
+    results = {}
+    for variant in args.variants:
+        v_args = variant_args(args, variant)
+        model, _ = load_inference_model(v_args)
+        print(f'[ACCURACY] evaluating {variant} on {len(test_dataloader.dataset)} samples')
+        metrics = test(EvalBridge(model, v_args), test_dataloader, ChamferDisL1, ChamferDisL2, args, config)
+        results[variant] = (v_args.device, metrics.state_dict())
+
+    # drift is reported against fp32 when it is evaluated
+    reference = results.get('fp32', (None, None))[1]
+    rows = []
+    for variant, (device, values) in results.items():
+        row = [variant, device, '%.4f' % values['CDL1'], '%.4f' % values['F-Score']]
+        if reference is not None:
+            row += ['%+.4f' % (values['CDL1'] - reference['CDL1']), '%+.4f' % (values['F-Score'] - reference['F-Score'])]
+        rows.append(row)
+    header = ['variant', 'device', 'CDL1', 'F-Score']
+    if reference is not None:
+        header += ['dCDL1', 'dF-Score']
+    print_table(header, rows)
+    return rows
+
+
+def latency(args):
+    rows = []
+    for variant in args.variants:
+        v_args = variant_args(args, variant)
+        model, _ = load_inference_model(v_args)
+        for batch_size in args.batch_sizes:
+            x = random_input(batch_size, args.num_points, v_args.device)
+            timings = time_forward(model, x, args.warmup, args.repeats, forward_context(v_args))
+            rows.append([variant, v_args.device, batch_size,
+                         '%.2f' % np.median(timings), '%.2f' % np.percentile(timings, 90)])
+    print_table(['variant', 'device', 'batch', 'median ms', 'p90 ms'], rows)
+    return rows
+
+
+def main():
+    args = get_args()
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    config = cfg_from_yaml_file(args.model_config)
+    test_dataloader = build_subset_loader(args, config)
+    evaluate(args, config, test_dataloader)
+    latency(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+##############################################################
+# Latency / throughput benchmarks for the inference backends
+###############################################################
+import argparse
+import os
+import sys
+import time
+import contextlib
+import numpy as np
+import torch
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BASE_DIR, '../'))
+
+from utils.torch_ops import use_torch_ops
+from custom.inference import load_inference_model, precision_context
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'model_config',
+        help = 'yaml config file')
+    parser.add_argument(
+        'model_checkpoint',
+        help = 'pretrained weight')
+    parser.add_argument(
+        '--backends', type=str, default='pytorch', help='comma separated, from pytorch, torchscript, onnx')
+    parser.add_argument('--torchscript', type=str, default=None, help='TorchScript artifact for the torchscript backend')
+    parser.add_argument('--onnx', type=str, default=None, help='ONNX artifact for the onnx backend')
+    parser.add_argument('--device', default='cpu', help='Device used for the pytorch/torchscript backends')
+    parser.add_argument('--batch_sizes', type=str, default='1,4,8', help='comma separated batch sizes')
+    parser.add_argument('--num_points', type=int, default=2048, help='number of input points')
+    parser.add_argument('--threads', type=int, default=0, help='intra-op threads for torch and onnxruntime, 0 keeps the default')
+    parser.add_argument('--ort_opt_level', choices=['disable', 'basic', 'extended', 'all'], default='all')
+    parser.add_argument(
+        '--optimize',
+        action='store_true',
+        default=False,
+        help='run optimize_for_inference on the pytorch model')
+    parser.add_argument(
+        '--precisions', type=str, default='fp32', help='comma separated, from fp32, bf16, fp16 (bf16/fp16 pytorch only)')
+    parser.add_argument(
+        '--stages',
+        action='store_true',
+        default=False,
+        help='time every stop_at stage of the pytorch model instead of comparing backends')
+    parser.add_argument('--warmup', type=int, default=3, help='untimed iterations')
+    parser.add_argument('--repeats', type=int, default=20, help='timed iterations')
+    args = parser.parse_args()
+
+    args.device = args.device.lower()
+    args.backends = [b.strip() for b in args.backends.split(',') if b.strip()]
+    args.batch_sizes = [int(b) for b in args.batch_sizes.split(',')]
+    args.precisions = [p.strip() for p in args.precisions.split(',') if p.strip()]
+    return args
+
+
+def backend_args(args, backend):
+    '''
+        Build the argument namespace custom/inference.py expects for one backend.
+    '''
+    artifact = {'torchscript': args.torchscript, 'onnx': args.onnx}.get(backend)
+    if backend != 'pytorch' and artifact is None:
+        raise ValueError(f'--{backend} artifact is required for the {backend} backend')
+    return argparse.Namespace(
+        backend=backend,
+        model_config=args.model_config,
+        model_checkpoint=args.model_checkpoint,
+        model_artifact=artifact,
+        device='cpu' if backend == 'onnx' else args.device,
+        optimize=args.optimize,
+        ort_threads=args.threads,
+        ort_opt_level=args.ort_opt_level)
+
+
+def random_input(batch_size, num_points, device, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    return (torch.rand(batch_size, num_points, 3, generator=generator) - 0.5).to(device)
+
+
+def op_context(backend, device, b_args=None, precision='fp32'):
+    stack = contextlib.ExitStack()
+    # the pointnet2 kernels are CUDA only, eager CPU runs need the pure torch ops
+    if backend == 'pytorch' and torch.device(device).type == 'cpu':
+        stack.enter_context(use_torch_ops())
+    if b_args is not None:
+        stack.enter_context(precision_context(b_args, precision))
+    return stack
+
+
+def time_forward(fn, x, warmup=3, repeats=20, context=None):
+    '''
+        Returns the per-call latencies in ms.
+    '''
+    context = context or contextlib.nullcontext()
+    timings = []
+    with torch.no_grad(), context:
+        for i in range(warmup + repeats):
+            if x.is_cuda:
+                torch.cuda.synchronize()
+            start = time.perf_counter()
+            fn(x)
+            if x.is_cuda:
+                torch.cuda.synchronize()
+            if i >= warmup:
+                timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def print_table(header, rows):
+    widths = [max(len(str(r[i])) for r in [header] + rows) for i in range(len(header))]
+    line = '  '.join('%-*s' % (w, h) for w, h in zip(widths, header))
+    print(line)
+    print('-' * len(line))
+    for row in rows:
+        print('  '.join('%-*s' % (w, c) for w, c in zip(widths, row)))
+
+
+def benchmark_backends(args):
+    rows = []
+    for backend in args.backends:
+        b_args = backend_args(args, backend)
+        model, _ = load_inference_model(b_args)
+        precisions = args.precisions if backend == 'pytorch' else ['fp32']
+        for precision in precisions:
+            for batch_size in args.batch_sizes:
+                x = random_input(batch_size, args.num_points, b_args.device)
+                timings = time_forward(model, x, args.warmup, args.repeats,
+                                       op_context(backend, b_args.device, b_args, precision))
+                median = float(np.median(timings))
+                rows.append([backend, b_args.device, precision, batch_size,
+                             '%.2f' % median, '%.2f' % np.percentile(timings, 90),
+                             '%.1f' % (batch_size * 1000. / median)])
+    print_table(['backend', 'device', 'precision', 'batch', 'median ms', 'p90 ms', 'clouds/s'], rows)
+    return rows
+
+
+def benchmark_stages(args):
+    '''
+        Latency of the eager model for every stage it can stop at.
+    '''
+    b_args = backend_args(args, 'pytorch')
+    model, config = load_inference_model(b_args)
+    rows = []
+    for stage in model.stages:
+        fn = lambda x, stage=stage: model(x, stop_at=stage)
+        for batch_size in args.batch_sizes:
+            x = random_input(batch_size, args.num_points, b_args.device)
+            with torch.no_grad(), op_context('pytorch', b_args.device):
+                num_out = fn(x)[-1].size(1)
+            timings = time_forward(fn, x, args.warmup, args.repeats, op_context('pytorch', b_args.device))
+            rows.append([config.model.NAME, stage, num_out, batch_size,
+                         '%.2f' % np.median(timings), '%.2f' % np.percentile(timings, 90)])
+    print_table(['model', 'stop_at', 'points', 'batch', 'median ms', 'p90 ms'], rows)
+    return rows
+
+
+def main():
+    args = get_args()
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    if args.stages:
+        benchmark_stages(args)
+    else:
+        benchmark_backends(args)
+
+if __name__ == '__main__':
+    main()
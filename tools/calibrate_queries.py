@@ -0,0 +1,104 @@
+##############################################################
+# Measure AdaPoinTr latency against the number of decoder queries
+###############################################################
+import argparse
+import os
+import sys
+import json
+import numpy as np
+import torch
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BASE_DIR, '../'))
+
+from tools.benchmark import random_input, op_context, time_forward, print_table
+from custom.inference import load_inference_model, query_range
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'model_config',
+        help = 'yaml config file')
+    parser.add_argument(
+        'model_checkpoint',
+        help = 'pretrained weight')
+    parser.add_argument(
+        '--out', type=str, default='', help='calibration file, default <checkpoint>.queries.json')
+    parser.add_argument('--device', default='cuda:0', help='Device the server runs on')
+    parser.add_argument('--precision', choices=['fp32', 'bf16', 'fp16'], default='fp32')
+    parser.add_argument(
+        '--optimize',
+        action='store_true',
+        default=False,
+        help='run optimize_for_inference, as the server does with --optimize')
+    parser.add_argument('--query_counts', type=str, default='', help='comma separated, default 8 steps up to num_query')
+    parser.add_argument('--num_points', type=int, default=2048, help='number of input points')
+    parser.add_argument('--threads', type=int, default=0, help='intra-op threads, 0 keeps the default')
+    parser.add_argument('--warmup', type=int, default=3, help='untimed iterations')
+    parser.add_argument('--repeats', type=int, default=20, help='timed iterations')
+    args = parser.parse_args()
+
+    if args.out == '':
+        args.out = os.path.splitext(args.model_checkpoint)[0] + '.queries.json'
+    args.device = args.device.lower()
+    return args
+
+
+def default_query_counts(min_query, max_query, steps=8):
+    counts = np.linspace(min_query, max_query, steps).round().astype(int)
+    return sorted(set(counts.tolist()))
+
+
+def calibrate(args):
+    m_args = argparse.Namespace(
+        backend='pytorch',
+        model_config=args.model_config,
+        model_checkpoint=args.model_checkpoint,
+        device=args.device,
+        optimize=args.optimize,
+        precision=args.precision)
+    model, config = load_inference_model(m_args)
+    limits = query_range(model)
+    if limits is None:
+        raise NotImplementedError(f'{config.model.NAME} has no adjustable query count')
+
+    if args.query_counts:
+        counts = [int(n) for n in args.query_counts.split(',')]
+    else:
+        counts = default_query_counts(*limits)
+
+    x = random_input(1, args.num_points, args.device)
+    latency_ms = {}
+    rows = []
+    for num_query in counts:
+        fn = lambda x, num_query=num_query: model(x, num_query=num_query)
+        timings = time_forward(fn, x, args.warmup, args.repeats,
+                               op_context('pytorch', args.device, m_args, args.precision))
+        latency_ms[num_query] = float(np.median(timings))
+        rows.append([num_query, num_query * model.factor, '%.2f' % latency_ms[num_query],
+                     '%.2f' % np.percentile(timings, 90)])
+    print_table(['num_query', 'points', 'median ms', 'p90 ms'], rows)
+
+    calibration = {
+        'model': config.model.NAME,
+        'checkpoint': os.path.abspath(args.model_checkpoint),
+        'device': args.device,
+        'precision': args.precision,
+        'optimized': args.optimize,
+        'num_points': args.num_points,
+        'latency_ms': latency_ms,
+    }
+    with open(args.out, 'w') as f:
+        json.dump(calibration, f, indent=2)
+    print(f'Saved query calibration to {args.out}')
+    return calibration
+
+
+def main():
+    args = get_args()
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    calibrate(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+##############################################################
+# Export completion models as self-contained deployment artifacts
+###############################################################
+import argparse
+import os
+import sys
+import json
+import time
+import subprocess
+import numpy as np
+import torch
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.join(BASE_DIR, '../')
+sys.path.append(ROOT_DIR)
+
+from tools import builder
+from utils.config import cfg_from_yaml_file
+from utils.torch_ops import use_torch_ops
+from custom.optimize import optimize_for_inference
+from custom.inference import OnnxModel
+
+SUPPORTED_MODELS = ['AdaPoinTr', 'PoinTr', 'PCN', 'FoldingNet', 'TopNet']
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'model_config',
+        help = 'yaml config file')
+    parser.add_argument(
+        'model_checkpoint',
+        help = 'pretrained weight')
+    parser.add_argument(
+        '--format', choices=['torchscript', 'onnx'], default='torchscript', help='artifact format')
+    parser.add_argument(
+        '--out', type=str, default='', help='output artifact path, default <checkpoint>.<format suffix>')
+    parser.add_argument(
+        '--device', default='cuda:0', help='Device the artifact is traced for (onnx is always exported on cpu)')
+    parser.add_argument('--opset', type=int, default=17, help='ONNX opset version')
+    parser.add_argument('--batch_size', type=int, default=1, help='batch size of the example input')
+    parser.add_argument('--num_points', type=int, default=2048, help='number of input points')
+    parser.add_argument(
+        '--no_optimize',
+        action='store_true',
+        default=False,
+        help='do not run optimize_for_inference before exporting')
+    parser.add_argument(
+        '--check',
+        action='store_true',
+        default=False,
+        help='compare the artifact with the eager model')
+    parser.add_argument(
+        '--cold_start',
+        action='store_true',
+        default=False,
+        help='compare cold-start time of the artifact and of building from yaml')
+    parser.add_argument('--repeats', type=int, default=3, help='repeats for the timing comparisons')
+    args = parser.parse_args()
+
+    if args.out == '':
+        suffix = {'torchscript': '.ts.pt', 'onnx': '.onnx'}[args.format]
+        args.out = os.path.splitext(args.model_checkpoint)[0] + suffix
+    args.device = args.device.lower()
+    if args.format == 'onnx' and args.device != 'cpu':
+        # the onnxruntime backend runs on the CPU execution provider
+        print(f'ONNX export traces on cpu instead of {args.device}')
+        args.device = 'cpu'
+    return args
+
+
+def build_eager_model(args):
+    config = cfg_from_yaml_file(args.model_config)
+    if config.model.NAME not in SUPPORTED_MODELS:
+        raise NotImplementedError(f'export is not supported for {config.model.NAME}, choose from {SUPPORTED_MODELS}')
+    base_model = builder.model_builder(config.model)
+    builder.load_model(base_model, args.model_checkpoint)
+    base_model.to(args.device)
+    base_model.eval()
+    if not args.no_optimize:
+        base_model = optimize_for_inference(base_model)
+    return base_model, config
+
+
+def example_input(batch_size, num_points, device, seed=0):
+    # inputs are normalized into the unit cube by custom/down_sample.py
+    generator = torch.Generator().manual_seed(seed)
+    return (torch.rand(batch_size, num_points, 3, generator=generator) - 0.5).to(device)
+
+
+def _max_abs_diff(out_a, out_b):
+    return max((a.float() - b.float()).abs().max().item() for a, b in zip(out_a, out_b))
+
+
+def trace_torchscript(model, example):
+    with torch.no_grad(), use_torch_ops():
+        traced = torch.jit.trace(model, example, check_trace=False)
+    return torch.jit.freeze(traced)
+
+
+def supports_dynamic_batch(model, scripted, args):
+    # shapes fixed by the tracer show up as an error or a mismatch on another batch size
+    other = example_input(args.batch_size + 1, args.num_points, args.device, seed=1)
+    try:
+        with torch.no_grad(), use_torch_ops():
+            ref = model(other)
+            out = scripted(other)
+    except RuntimeError:
+        return False
+    if any(a.shape != b.shape for a, b in zip(ref, out)):
+        return False
+    return _max_abs_diff(ref, out) < 1e-3
+
+
+def export_torchscript(model, config, args):
+    example = example_input(args.batch_size, args.num_points, args.device)
+    scripted = trace_torchscript(model, example)
+    meta = {
+        'model': config.model.NAME,
+        'format': 'torchscript',
+        'num_points': args.num_points,
+        'batch_size': args.batch_size,
+        'dynamic_batch': supports_dynamic_batch(model, scripted, args),
+        'device': args.device,
+        'optimized': not args.no_optimize,
+        'checkpoint': os.path.abspath(args.model_checkpoint),
+    }
+    torch.jit.save(scripted, args.out, _extra_files={'meta.json': json.dumps(meta)})
+    print(f'Saved {meta["model"]} TorchScript artifact to {args.out} (dynamic batch: {meta["dynamic_batch"]})')
+    return meta
+
+
+def export_onnx(model, config, args):
+    import onnx
+
+    example = example_input(args.batch_size, args.num_points, args.device)
+    with torch.no_grad(), use_torch_ops():
+        ref = model(example)
+        output_names = ['coarse', 'fine'] if len(ref) == 2 else ['out%d' % i for i in range(len(ref))]
+        dynamic_axes = {name: {0: 'batch'} for name in ['xyz'] + output_names}
+        torch.onnx.export(model, example, args.out, input_names=['xyz'], output_names=output_names,
+                          dynamic_axes=dynamic_axes, opset_version=args.opset, do_constant_folding=True)
+
+    # batch is declared dynamic, check that the graph really handles another batch size
+    other = example_input(args.batch_size + 1, args.num_points, args.device, seed=1)
+    try:
+        with torch.no_grad(), use_torch_ops():
+            other_ref = model(other)
+        other_out = OnnxModel(args.out)(other)
+        dynamic_batch = all(a.shape == b.shape for a, b in zip(other_ref, other_out)) \
+            and _max_abs_diff(other_ref, other_out) < 1e-3
+    except Exception:
+        dynamic_batch = False
+
+    meta = {
+        'model': config.model.NAME,
+        'format': 'onnx',
+        'num_points': args.num_points,
+        'batch_size': args.batch_size,
+        'dynamic_batch': dynamic_batch,
+        'device': 'cpu',
+        'optimized': not args.no_optimize,
+        'checkpoint': os.path.abspath(args.model_checkpoint),
+    }
+    onnx_model = onnx.load(args.out)
+    entry = onnx_model.metadata_props.add()
+    entry.key, entry.value = 'meta.json', json.dumps(meta)
+    onnx.save(onnx_model, args.out)
+    print(f'Saved {meta["model"]} ONNX artifact to {args.out} (dynamic batch: {meta["dynamic_batch"]})')
+    return meta
+
+
+def load_artifact(args):
+    if args.format == 'onnx':
+        return OnnxModel(args.out)
+    return torch.jit.load(args.out, map_location=args.device)
+
+
+def _latency(fn, x, repeats=10):
+    with torch.no_grad():
+        fn(x)
+        if x.is_cuda:
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        for _ in range(repeats):
+            fn(x)
+        if x.is_cuda:
+            torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def parity_check(model, args):
+    artifact = load_artifact(args)
+    x = example_input(args.batch_size, args.num_points, args.device, seed=2)
+    with torch.no_grad(), use_torch_ops():
+        ref = model(x)
+        out = artifact(x)
+    diff = _max_abs_diff(ref, out)
+    print(f'[PARITY] max abs diff vs eager (same ops): {diff:.3e}')
+
+    if x.is_cuda:
+        # the eager model with the native pointnet2 CUDA kernels
+        with torch.no_grad():
+            native = model(x)
+        if all(a.shape == b.shape for a, b in zip(native, out)):
+            print(f'[PARITY] max abs diff vs eager (pointnet2 kernels): {_max_abs_diff(native, out):.3e}')
+
+    with use_torch_ops():
+        eager_ms = _latency(model, x)
+    script_ms = _latency(artifact, x)
+    print(f'[PARITY] warm latency: eager {eager_ms:.2f} ms, artifact {script_ms:.2f} ms')
+    return diff
+
+
+_EAGER_COLD_START = '''
+import sys, contextlib, torch
+sys.path.insert(0, {root!r})
+from tools import builder
+from utils.config import cfg_from_yaml_file
+from utils.torch_ops import use_torch_ops
+config = cfg_from_yaml_file({config!r})
+model = builder.model_builder(config.model)
+builder.load_model(model, {checkpoint!r})
+model.to({device!r}).eval()
+x = torch.rand(1, {num_points}, 3, device={device!r}) - 0.5
+ops = use_torch_ops() if {device!r} == 'cpu' else contextlib.nullcontext()
+with torch.no_grad(), ops:
+    model(x)
+'''
+
+_ARTIFACT_COLD_START = '''
+import torch
+model = torch.jit.load({artifact!r}, map_location={device!r})
+x = torch.rand(1, {num_points}, 3, device={device!r}) - 0.5
+with torch.no_grad():
+    model(x)
+'''
+
+_ONNX_COLD_START = '''
+import numpy as np
+import onnxruntime as ort
+session = ort.InferenceSession({artifact!r}, providers=['CPUExecutionProvider'])
+x = np.random.rand(1, {num_points}, 3).astype(np.float32) - 0.5
+session.run(None, {{session.get_inputs()[0].name: x}})
+'''
+
+
+def _time_process(code, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True, cwd=ROOT_DIR,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def cold_start_comparison(args):
+    '''
+        Time a fresh process from interpreter start to the first completed forward
+        pass, once building the model from yaml and once loading the artifact.
+    '''
+    fmt = dict(root=os.path.abspath(ROOT_DIR), config=args.model_config, checkpoint=args.model_checkpoint,
+               artifact=os.path.abspath(args.out), device=args.device, num_points=args.num_points)
+    eager = _time_process(_EAGER_COLD_START.format(**fmt), args.repeats)
+    artifact_code = _ONNX_COLD_START if args.format == 'onnx' else _ARTIFACT_COLD_START
+    artifact = _time_process(artifact_code.format(**fmt), args.repeats)
+    print('[COLD START] process start -> first forward (s), median of %d' % args.repeats)
+    print('  yaml + checkpoint : %.2f' % np.median(eager))
+    print('  %-18s: %.2f' % (args.format, np.median(artifact)))
+    return np.median(eager), np.median(artifact)
+
+
+def main():
+    args = get_args()
+    model, config = build_eager_model(args)
+
+    if args.format == 'torchscript':
+        export_torchscript(model, config, args)
+    elif args.format == 'onnx':
+        export_onnx(model, config, args)
+
+    if args.check:
+        parity_check(model, args)
+    if args.cold_start:
+        cold_start_comparison(args)
+
+if __name__ == '__main__':
+    main()
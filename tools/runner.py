@@ -419,7 +419,8 @@ def test(base_model, test_dataloader, ChamferDisL1, ChamferDisL2, args, config,
                             (idx + 1, n_samples, taxonomy_id, model_id, ['%.4f' % l for l in test_losses.val()], 
                             ['%.4f' % m for m in _metrics]), logger=logger)
         if dataset_name == 'KITTI':
-            return
+            # no ground truth for KITTI, only the visualizations are written
+            return Metrics(config.consider_metric, {})
         for _,v in category_metrics.items():
             test_metrics.update(v.avg())
         print_log('[TEST] Metrics = %s' % (['%.4f' % m for m in test_metrics.avg()]), logger=logger)
@@ -452,4 +453,4 @@ def test(base_model, test_dataloader, ChamferDisL1, ChamferDisL2, args, config,
     for value in test_metrics.avg():
         msg += '%.3f \t' % value
     print_log(msg, logger=logger)
-    return 
+    return Metrics(config.consider_metric, test_metrics.avg())
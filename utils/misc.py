@@ -7,6 +7,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 import os
 from collections import abc
+from functools import wraps
 from pointnet2_ops import pointnet2_utils
 
 def jitter_points(pc, std=0.01, clip=0.05):
@@ -29,6 +30,23 @@ def random_sample(data, number):
     data = torch.gather(data, 1, ind.unsqueeze(-1).expand(-1, -1, data.size(-1)))
     return data
 
+def fp32_geometry(fn):
+    '''
+        Run `fn` in fp32 with autocast disabled. Point sampling and neighbour
+        search on reduced-precision coordinates pick different points.
+    '''
+    def _to_fp32(x):
+        return x.float() if torch.is_tensor(x) and x.is_floating_point() else x
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        args = [_to_fp32(a) for a in args]
+        kwargs = {k: _to_fp32(v) for k, v in kwargs.items()}
+        with torch.autocast('cuda', enabled=False), torch.autocast('cpu', enabled=False):
+            return fn(*args, **kwargs)
+    return wrapper
+
+@fp32_geometry
 def fps(data, number):
     '''
         data B N 3
@@ -0,0 +1,182 @@
+'''
+Pure PyTorch implementations of the pointnet2_ops CUDA operators.
+
+The CUDA kernels are opaque to torch.jit.trace / torch.onnx.export and do not
+run on CPU. The functions below follow the same signatures and semantics so a
+model can be traced or run on CPU inside `use_torch_ops()`. The loops are
+scripted, so they stay loops in the exported graph instead of being unrolled.
+'''
+import sys
+import contextlib
+import threading
+import torch
+
+
+@torch.jit.script
+def furthest_point_sample(xyz: torch.Tensor, npoint: int) -> torch.Tensor:
+    '''
+        xyz : B N 3
+        ----------------------
+        idx : B npoint (int32)
+    '''
+    B = xyz.size(0)
+    N = xyz.size(1)
+    # same as the CUDA kernel: points with a tiny norm are never picked (except the first one)
+    valid = (xyz * xyz).sum(-1) > 1e-3
+    dist = torch.full([B, N], 1e10, dtype=xyz.dtype, device=xyz.device)
+    farthest = torch.zeros([B], dtype=torch.long, device=xyz.device)
+    batch = torch.arange(B, device=xyz.device)
+    idx = torch.zeros([B, npoint], dtype=torch.long, device=xyz.device)
+    for i in range(npoint):
+        idx[:, i] = farthest
+        centroid = xyz[batch, farthest].unsqueeze(1)
+        dist = torch.minimum(dist, ((xyz - centroid) ** 2).sum(-1))
+        farthest = dist.masked_fill(~valid, -1.).argmax(-1)
+    return idx.int()
+
+
+def gather_operation(features, idx):
+    '''
+        features : B C N
+        idx : B npoint
+        ----------------------
+        out : B C npoint
+    '''
+    idx = idx.long().unsqueeze(1).expand(-1, features.size(1), -1)
+    return torch.gather(features, 2, idx)
+
+
+def grouping_operation(features, idx):
+    '''
+        features : B C N
+        idx : B npoint nsample
+        ----------------------
+        out : B C npoint nsample
+    '''
+    B, npoint, nsample = idx.shape
+    out = gather_operation(features, idx.reshape(B, npoint * nsample))
+    return out.reshape(B, features.size(1), npoint, nsample)
+
+
+def ball_query(radius, nsample, xyz, new_xyz):
+    '''
+        xyz : B N 3
+        new_xyz : B npoint 3
+        ----------------------
+        idx : B npoint nsample (int32), first `nsample` points inside the ball
+              in index order, padded with the first one found
+    '''
+    N = xyz.size(1)
+    sqrdists = torch.cdist(new_xyz, xyz) ** 2
+    group_idx = torch.arange(N, device=xyz.device).view(1, 1, N).expand(sqrdists.shape).clone()
+    group_idx[sqrdists >= radius ** 2] = N
+    group_idx = group_idx.sort(dim=-1)[0][:, :, :nsample]
+    first = group_idx[:, :, :1].expand_as(group_idx)
+    group_idx = torch.where(group_idx == N, first, group_idx)
+    # a query with no neighbour at all points to index 0, like the kernel
+    group_idx = torch.where(group_idx == N, torch.zeros_like(group_idx), group_idx)
+    return group_idx.int()
+
+
+def three_nn(unknown, known):
+    '''
+        unknown : B n 3
+        known : B m 3
+        ----------------------
+        dist : B n 3, l2 distance to the three nearest neighbours
+        idx : B n 3 (int32)
+    '''
+    sqrdists = torch.cdist(unknown, known) ** 2
+    dist2, idx = torch.topk(sqrdists, 3, dim=-1, largest=False, sorted=True)
+    return torch.sqrt(dist2), idx.int()
+
+
+def three_interpolate(features, idx, weight):
+    '''
+        features : B C m
+        idx : B n 3
+        weight : B n 3
+        ----------------------
+        out : B C n
+    '''
+    B, n, _ = idx.shape
+    neighbours = gather_operation(features, idx.reshape(B, n * 3)).reshape(B, features.size(1), n, 3)
+    return (neighbours * weight.unsqueeze(1)).sum(-1)
+
+
+_OPS = {
+    'furthest_point_sample': furthest_point_sample,
+    'gather_operation': gather_operation,
+    'grouping_operation': grouping_operation,
+    'ball_query': ball_query,
+    'three_nn': three_nn,
+    'three_interpolate': three_interpolate,
+}
+
+# modules that bind pointnet2 operators by name at import time
+_IMPORTED_BY_NAME = ['models.SnowFlakeNet_utils', 'models.SnowFlakeNet']
+
+
+def _patch_targets():
+    targets = []
+    try:
+        from pointnet2_ops import pointnet2_utils
+        targets.append(pointnet2_utils)
+    except ImportError:
+        pass
+    for name in _IMPORTED_BY_NAME:
+        if name in sys.modules:
+            targets.append(sys.modules[name])
+    return targets
+
+
+_install_lock = threading.Lock()
+
+
+def _device_dispatch(cuda_op, torch_op):
+    def op(*args, **kwargs):
+        tensor = next((a for a in args if isinstance(a, torch.Tensor)), None)
+        if cuda_op is not None and tensor is not None and tensor.is_cuda:
+            return cuda_op(*args, **kwargs)
+        return torch_op(*args, **kwargs)
+    op.device_dispatch = True
+    return op
+
+
+def install_device_dispatch():
+    '''
+        Replace the pointnet2_ops operators, once and for good, with wrappers
+        that run the CUDA kernel for CUDA tensors and the pure PyTorch version
+        otherwise. Unlike use_torch_ops() nothing is swapped per forward, so
+        concurrent CPU and CUDA forwards in one process are safe. Idempotent.
+    '''
+    with _install_lock:
+        for module in _patch_targets():
+            for name, torch_op in _OPS.items():
+                if not hasattr(module, name):
+                    continue
+                current = getattr(module, name)
+                if getattr(current, 'device_dispatch', False):
+                    continue
+                setattr(module, name, _device_dispatch(None if current is torch_op else current, torch_op))
+
+
+@contextlib.contextmanager
+def use_torch_ops():
+    '''
+        Temporarily replace the pointnet2_ops operators with the pure PyTorch
+        versions above, for tracing/exporting. This swaps module globals, so it
+        is only meant for single-threaded tools; servers use
+        install_device_dispatch().
+    '''
+    saved = []
+    for module in _patch_targets():
+        for name, op in _OPS.items():
+            if hasattr(module, name):
+                saved.append((module, name, getattr(module, name)))
+                setattr(module, name, op)
+    try:
+        yield
+    finally:
+        for module, name, op in reversed(saved):
+            setattr(module, name, op)